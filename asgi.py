@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+
+from beesly import create_app
+from beesly.asgi import AsgiApp
+
+app = AsgiApp(create_app())
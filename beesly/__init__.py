@@ -1,15 +1,16 @@
 import sys
 import os.path
 
-from beesly._logging import structured_log
-from beesly.config import ConfigError, initialize_config
-from beesly.views import app, rlimiter
-
 
 def create_app():
     """
     Initializes the Flask application.
     """
+    # the application is imported here so that importing beesly, eg. beesly.version from gconfig.py, stays fast
+    from beesly._logging import log_sampler, structured_log
+    from beesly.config import ConfigError, initialize_config
+    from beesly.views import app, group_cache, key_cache, pam_pool, profiler, request_metrics, rlimiter, statsd, static_responses, system_info, token_cache
+    from beesly.warmup import warm_up
 
     structured_log(level='info', msg="Starting beesly...")
 
@@ -24,9 +25,27 @@ def create_app():
         app.static_folder = os.path.dirname(os.path.realpath(__file__)) + "/swagger-ui"
         app.add_url_rule("/service/docs/<path:filename>", endpoint="/service/docs", view_func=app.send_static_file)
 
+    # hybrid rate limiting storage exports its metrics with the application's statsd client
+    if "RATELIMIT_STORAGE_OPTIONS" in settings:
+        settings["RATELIMIT_STORAGE_OPTIONS"]["statsd"] = statsd.client
+
     app.config.update(settings)
     structured_log(level='info', msg="Successfully loaded configuration")
 
+    log_sampler.init_app(app)
     rlimiter.init_app(app)
+    group_cache.init_app(app)
+    key_cache.init_app(app)
+    token_cache.init_app(app)
+    pam_pool.init_app(app)
+    system_info.init_app(app)
+    request_metrics.init_app(app)
+    profiler.init_app(app)
+
+    # static responses are built last, once every route has been added
+    static_responses.init_app(app)
+
+    if settings["WARMUP"]:
+        warm_up(app)
 
     return app
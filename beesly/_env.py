@@ -0,0 +1,19 @@
+def strtobool(value):
+    """
+    Converts a string representing truth to True or False, like distutils.util.strtobool().
+    ValueError is raised if the value is invalid. This module has no dependencies, so that
+    gconfig.py can parse settings without importing the application.
+
+    Arguments
+    ----------
+    value : string
+      the value to convert, eg. true, False, yes, 0
+    """
+    value = value.lower()
+
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return True
+    elif value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return False
+
+    raise ValueError(f"invalid truth value {value!r}")
@@ -0,0 +1,125 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
+
+
+JSON_LIBRARY = 'json' if orjson is None else 'orjson'
+
+
+def dumps(obj, sort_keys=False, default=None):
+    """
+    Returns the compact JSON encoding of the object as UTF-8 encoded bytes. orjson is used if
+    it is installed, otherwise the json module. Objects orjson can't encode, eg. integers larger
+    than 64 bits, are encoded with the json module.
+
+    Arguments
+    ----------
+    obj : object
+      the object to encode
+
+    sort_keys : boolean
+      whether the keys of dictionaries are sorted
+
+    default : function
+      called with objects that can't otherwise be encoded, returns an encodable object
+    """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+        # datetimes are passed to default so that they are encoded as they are by the json module
+        if default is not None:
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass
+
+    return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys, default=default).encode('utf-8')
+
+
+def loads(data):
+    """
+    Returns the object decoded from a JSON document. ValueError is raised if the document is invalid.
+
+    Arguments
+    ----------
+    data : bytes or string
+      the JSON document, bytes must be UTF-8 encoded
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+if DefaultJSONProvider is not None:
+    class JSONProvider(DefaultJSONProvider):
+        """
+        Flask JSON provider that encodes responses and decodes request bodies with orjson.
+        Responses are pretty printed with the json module in debug mode.
+        """
+        def dumps(self, obj, **kwargs):
+            if kwargs.get('indent') is not None:
+                return super(JSONProvider, self).dumps(obj, **kwargs)
+
+            return dumps(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys), default=self.default).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return loads(s)
+
+        def response(self, *args, **kwargs):
+            if self.compact is False or (self.compact is None and self._app.debug):
+                return super(JSONProvider, self).response(*args, **kwargs)
+
+            obj = self._prepare_response_obj(args, kwargs)
+            body = dumps(obj, sort_keys=self.sort_keys, default=self.default) + b'\n'
+
+            return self._app.response_class(body, mimetype=self.mimetype)
+else:
+    from flask.json import JSONDecoder as FlaskJSONDecoder, JSONEncoder as FlaskJSONEncoder
+
+    class JSONEncoder(FlaskJSONEncoder):
+        """
+        Flask JSON encoder that encodes responses with orjson, for versions of Flask without JSON providers.
+        """
+        def encode(self, o):
+            if self.indent is not None:
+                return super(JSONEncoder, self).encode(o)
+
+            return dumps(o, sort_keys=self.sort_keys, default=self.default).decode('utf-8')
+
+    class JSONDecoder(FlaskJSONDecoder):
+        """
+        Flask JSON decoder that decodes request bodies with orjson, for versions of Flask without JSON providers.
+        """
+        def decode(self, s):
+            return loads(s)
+
+
+def init_app(app):
+    """
+    Encodes the Flask application's responses and decodes its request bodies with orjson
+    if it is installed. The application's default JSON handling is kept otherwise.
+
+    Arguments
+    ----------
+    app : Flask object
+      the application
+    """
+    if orjson is None:
+        return
+
+    if DefaultJSONProvider is not None:
+        app.json = JSONProvider(app)
+    else:
+        app.json_encoder = JSONEncoder
+        app.json_decoder = JSONDecoder
@@ -1,8 +1,26 @@
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+import atexit
 import logging
+import os
+import queue
+import random
+import threading
+import time
 
 from beesly.version import __app__
 
 
+APP_LOGGER = logging.getLogger(f'{__app__}.logger')
+
+LOG_LEVELS = {
+    'INFO': logging.INFO,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+    'CRITICAL': logging.CRITICAL
+}
+
+
 class CustomLogFilter(logging.Filter):
     """
     Custom logging filter that adds the name of the application to each log.
@@ -15,32 +33,221 @@ class CustomLogFilter(logging.Filter):
         return True
 
 
-def structured_log(level, msg, **kwargs):
+class KeyValueFormatter(logging.Formatter):
+    """
+    Logging formatter used by gconfig.py that writes each log as
+    `{"timestamp":"...","loglevel":"...","app":"...","pid":"...","message":"..."}`, the same
+    as the equivalent format string but without formatting the timestamp and a dictionary
+    of record attributes for every log. The timestamp is formatted at most once per second.
+    """
+    DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self):
+        super(KeyValueFormatter, self).__init__()
+        self._timestamp = (None, None)
+
+    def format(self, record):
+        second = int(record.created)
+
+        timestamp = self._timestamp
+        if timestamp[0] != second:
+            timestamp = self._timestamp = (second, time.strftime(self.DATE_FORMAT, self.converter(record.created)))
+
+        log = (f'{{"timestamp":"{timestamp[1]}.{int(record.msecs):03d}","loglevel":"{record.levelname}",'
+               f'"app":"{record.app}","pid":"{record.process}","message":"{record.getMessage()}"}}')
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            log += '\n' + record.exc_text
+
+        if record.stack_info:
+            log += '\n' + self.formatStack(record.stack_info)
+
+        return log
+
+
+class QueueLogHandler(QueueHandler):
     """
-    Outputs structured, key-value log messages.
+    Logging handler that queues logs to be formatted and written to a stream by a
+    background thread, so that logging never blocks on writes to stdout. The formatter
+    and level set on this handler are used to write logs. Each forked gunicorn worker
+    starts its own thread, and queued logs are written when the handler is closed.
 
     Arguments
     ----------
-    level : string
-      the log level for the log, eg. info, warning, error, critical
+    stream : file object
+      the stream logs are written to, defaults to sys.stderr
+    """
+    def __init__(self, stream=None):
+        self.target = logging.StreamHandler(stream)
+        self.listener = None
 
-    msg : string
-      the message field in the log
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        super(QueueLogHandler, self).__init__(queue.Queue())
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # logs are formatted by the background thread
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start()
+
+        self.queue.put_nowait(record)
+
+    def close(self):
+        with self._start_lock:
+            if self.listener is not None and self._pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+        self.target.close()
+        super(QueueLogHandler, self).close()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+
+            # the queue and thread of the parent process are not usable after fork
+            self.queue = queue.Queue()
+            self.listener = QueueListener(self.queue, self.target)
+            self.listener.start()
+            self._pid = os.getpid()
+
+
+class LogSampler(object):
+    """
+    Samples high-volume logs and periodically summarizes them. Logs are sampled by
+    message, or by level if there is no rate for their message. Every `summary_interval`
+    seconds a summary is logged for each sampled message, with the number of times it
+    occurred, how many were logged, and the number of occurrences for each error.
+    Warnings and errors are never sampled.
+
+    Attributes
+    ----------
+    rates : dict
+      the fraction of logs to keep for each message or level, eg. {'JWT successfully verified': 0.01}
+
+    summary_interval : integer
+      the number of seconds between summaries, 0 disables summaries
     """
-    level = level.upper()
+    def __init__(self, rates=None, summary_interval=10):
+        self.rates = rates or {}
+        self.summary_interval = summary_interval
+
+        self._events = {}
+        self._since = time.monotonic()
+        self._lock = threading.Lock()
+
+        atexit.register(self.summarize)
+
+    def init_app(self, app):
+        """
+        Configures sampling from the Flask application's configuration.
+        """
+        self.rates = app.config.get('LOG_SAMPLE_RATES', self.rates)
+        self.summary_interval = app.config.get('LOG_SUMMARY_INTERVAL', self.summary_interval)
+
+    def sample(self, level, msg, error=None):
+        """
+        Returns True if the log should be written, otherwise False.
+
+        Arguments
+        ----------
+        level : string
+          the log level for the log
+
+        msg : string
+          the message field in the log
+
+        error : object
+          the error included in the log, counted by the summary
+        """
+        rate = self.rates.get(msg)
+        if rate is None:
+            rate = self.rates.get(level.lower())
+            if rate is None:
+                return True
+
+        keep = rate >= 1 or random.random() < rate
+
+        if self.summary_interval <= 0:
+            return keep
+
+        with self._lock:
+            event = self._events.get(msg)
+            if event is None:
+                event = self._events[msg] = [0, 0, Counter()]
+
+            event[0] += 1
+            event[1] += keep
+            if error is not None:
+                event[2][str(error)] += 1
+
+            due = time.monotonic() - self._since >= self.summary_interval
+
+        if due:
+            self.summarize()
+
+        return keep
+
+    def summarize(self):
+        """
+        Logs a summary of the sampled logs since the last summary.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            events, self._events = self._events, {}
+            interval, self._since = now - self._since, now
+
+        for (msg, (count, logged, errors)) in events.items():
+            kwargs = dict(event=f"'{msg}'", count=count, logged=logged, interval=f"{interval:.0f}s")
+            if errors:
+                kwargs['errors'] = dict(errors)
+
+            _write_log(logging.INFO, "Log summary", kwargs)
+
+
+log_sampler = LogSampler()
+
+
+def _write_log(log_level, msg, kwargs):
+    if not APP_LOGGER.isEnabledFor(log_level):
+        return
+
     log_body = msg
     if kwargs:
         kv_pairs = ','.join([f'{k}={v}' for (k, v) in sorted(kwargs.items())]).rstrip('"') # trailing double quote is removed
         log_body += f'",{kv_pairs}' # double quote here closes the msg field
 
-    app_logger_name = f'{__app__}.logger'
-    app_logger_func = logging.getLogger(app_logger_name)
+    APP_LOGGER.log(log_level, log_body)
+
+
+def structured_log(level, msg, **kwargs):
+    """
+    Outputs structured, key-value log messages. Info logs may be sampled, see LogSampler.
+
+    Arguments
+    ----------
+    level : string
+      the log level for the log, eg. info, warning, error, critical
+
+    msg : string
+      the message field in the log
+    """
+    log_level = LOG_LEVELS[level.upper()]
 
-    app_logger = {
-        'INFO': app_logger_func.info,
-        'WARNING': app_logger_func.warning,
-        'ERROR': app_logger_func.error,
-        'CRITICAL': app_logger_func.critical
-    }
+    if log_level < logging.WARNING and log_sampler.rates and not log_sampler.sample(level, msg, kwargs.get('error')):
+        return
 
-    app_logger[level](log_body)
+    _write_log(log_level, msg, kwargs)
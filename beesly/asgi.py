@@ -0,0 +1,215 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import sys
+
+from flask import jsonify, request_started
+from werkzeug.exceptions import HTTPException
+
+from beesly.pamauth import PamPoolFullError, PamTimeoutError
+from beesly.utils import get_request_json
+from beesly.views import auth_result, group_cache, pam_error, pam_pool, parse_credentials, request_metrics, statsd
+
+
+class AsgiApp(object):
+    """
+    ASGI application that serves the Flask application from an event loop, so that a
+    single process can hold thousands of concurrent requests to /auth. /auth is handled
+    by a coroutine that waits for PAM authentication and group lookups without holding
+    a thread. All other routes are CPU bound and are handled by the Flask application
+    in a pool of `threads` threads.
+
+    Requests to /auth keep their Flask request context while they wait, so rate limiting,
+    metrics and error handlers apply to them as they do when served by gunicorn's sync workers.
+
+    Arguments
+    ----------
+    app : Flask object
+      the application returned by create_app()
+
+    Attributes
+    ----------
+    threads : integer
+      the number of threads used to handle requests to other routes and look up groups
+    """
+    def __init__(self, app):
+        # Flask's request context is isolated between coroutines using contextvars
+        if sys.version_info < (3, 7):
+            raise RuntimeError("The ASGI application requires Python 3.7 or later")
+
+        self.app = app
+        self.threads = app.config.get('ASGI_THREADS', 32)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+        self._async_views = {
+            'auth_endpoint': self.auth_endpoint,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] != 'http':
+            return
+
+        # bodies larger than the maximum are truncated, the request is rejected by get_request_json()
+        body = await self._read_body(receive, self.app.config.get('REQUEST_MAX_BODY_SIZE', 65536) + 1)
+        environ = self._environ(scope, body)
+
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+
+        view = self._async_views.get(endpoint)
+
+        if view is not None:
+            status_code, headers, body = await self._dispatch(view, environ)
+        else:
+            loop = asyncio.get_event_loop()
+            status_code, headers, body = await loop.run_in_executor(self.executor, self._wsgi, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for (name, value) in headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def auth_endpoint(self):
+        """
+        Authenticates users using PAM, like beesly.views.auth_endpoint().
+        """
+        request_json = get_request_json()
+
+        try:
+            username, password = parse_credentials(request_json)
+        except ValueError as err:
+            return jsonify(message=str(err)), 400
+
+        pam_service = self.app.config['PAM_SERVICE']
+
+        try:
+            with statsd.client.timer("pam_auth"), request_metrics.stage("pam_auth"):
+                authenticated = await pam_pool.authenticate_async(username, password, service=pam_service)
+        except (PamPoolFullError, PamTimeoutError) as err:
+            response_body, status_code = pam_error(err, username)
+            return jsonify(response_body), status_code
+
+        groups = None
+
+        if authenticated:
+            loop = asyncio.get_event_loop()
+
+            with request_metrics.stage("group_lookup"):
+                groups = await loop.run_in_executor(self.executor, group_cache.get, username)
+
+        response_body, status_code = auth_result(username, authenticated, groups)
+
+        return jsonify(response_body), status_code
+
+    async def _dispatch(self, view, environ):
+        # mirrors Flask.wsgi_app() and Flask.full_dispatch_request() with an awaited view
+        ctx = self.app.request_context(environ)
+        error = None
+
+        try:
+            try:
+                ctx.push()
+
+                try:
+                    request_started.send(self.app)
+                    rv = self.app.preprocess_request()
+                    if rv is None:
+                        rv = await view()
+                except Exception as err:
+                    rv = self.app.handle_user_exception(err)
+
+                response = self.app.finalize_request(rv)
+            except Exception as err:
+                error = err
+                response = self.app.handle_exception(err)
+
+            return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+        finally:
+            ctx.pop(error)
+
+    def _wsgi(self, environ):
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status[:] = [int(status_line.split(' ', 1)[0]), headers]
+
+        result = self.app(environ, start_response)
+
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return status[0], status[1], body
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                pam_pool.shutdown()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive, max_size):
+        body = b''
+
+        while len(body) < max_size:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+
+        return body[:max_size]
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+
+        for (name, value) in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                environ[name] = value
+                continue
+
+            name = f'HTTP_{name}'
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+
+        return environ
@@ -0,0 +1,447 @@
+from collections import OrderedDict
+from hashlib import sha256
+import os
+import queue
+import threading
+import time
+
+from nacl.hash import blake2b
+
+from beesly._logging import structured_log
+from beesly.utils import get_group_membership
+
+
+class LRUCache(object):
+    """
+    Thread-safe, size-bounded cache that evicts the least recently used entry
+    when full. Each entry expires at a given time and is evicted on access after that.
+
+    Attributes
+    ----------
+    max_entries : integer
+      the maximum number of entries held in the cache
+    """
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=None):
+        """
+        Returns the value stored for the key or None if it is missing or has expired.
+
+        Arguments
+        ----------
+        key : hashable
+          the key to look up
+
+        now : float
+          the current time, defaults to time.time()
+        """
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        """
+        Stores the value for the key until the given expiry time.
+
+        Arguments
+        ----------
+        key : hashable
+          the key to store the value under
+
+        value : object
+          the value to store
+
+        expires_at : float
+          the UNIX timestamp after which the entry is no longer returned
+        """
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes the entry for the key if it exists.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+class GroupCache(object):
+    """
+    Per-worker cache of the groups users are a member of. Entries are fresh for
+    `ttl` seconds, after which they are served stale for up to `stale_ttl` seconds
+    while the group membership is refreshed in the background. Stale entries are
+    refreshed one at a time by a single thread in each worker. Refreshes are dropped
+    while `REFRESH_QUEUE_SIZE` are already waiting, and retried by later requests.
+
+    Attributes
+    ----------
+    ttl : integer
+      the number of seconds group membership is cached for, 0 disables the cache
+
+    stale_ttl : integer
+      the number of seconds an expired entry can still be served while it is refreshed
+
+    resolver : string
+      the method used to look up groups, passed to get_group_membership()
+
+    statsd : StatsClient object
+      the statsd client used to export cache hit, miss and stale counts
+    """
+    REFRESH_QUEUE_SIZE = 64
+
+    def __init__(self, statsd=None, ttl=60, stale_ttl=300, max_entries=1024, resolver='nss'):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.resolver = resolver
+        self.statsd = statsd
+
+        self._cache = LRUCache(max_entries=max_entries)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self._queue = None
+        self._refresh_pid = None
+
+    def init_app(self, app):
+        """
+        Configures the cache from the Flask application's configuration.
+        """
+        self.ttl = app.config.get('GROUP_CACHE_TTL', self.ttl)
+        self.stale_ttl = app.config.get('GROUP_CACHE_STALE_TTL', self.stale_ttl)
+        self.resolver = app.config.get('GROUP_RESOLVER', self.resolver)
+        self._cache.max_entries = app.config.get('GROUP_CACHE_MAX_ENTRIES', self._cache.max_entries)
+        self._cache.clear()
+
+    def get(self, username):
+        """
+        Returns a list of groups the user is a member of.
+
+        Arguments
+        ----------
+        username : string
+          the username to get group membership for
+        """
+        if self.ttl <= 0:
+            return get_group_membership(username, resolver=self.resolver)
+
+        now = time.time()
+        entry = self._cache.get(username, now=now)
+
+        if entry is None:
+            self._incr("group_cache_miss")
+            return list(self._load(username, now))
+
+        groups, fresh_until = entry
+
+        if fresh_until <= now:
+            self._incr("group_cache_stale")
+            self._refresh(username)
+        else:
+            self._incr("group_cache_hit")
+
+        return list(groups)
+
+    def preload(self, usernames):
+        """
+        Looks up and caches the groups of each user, up to the maximum number of entries.
+        Returns the number of users whose groups were cached.
+
+        Arguments
+        ----------
+        usernames : iterable
+          the usernames to cache group membership for
+        """
+        if self.ttl <= 0:
+            return 0
+
+        count = 0
+        now = time.time()
+
+        for username in usernames:
+            if count >= self._cache.max_entries:
+                break
+
+            self._load(username, now)
+            count += 1
+
+        return count
+
+    def _load(self, username, now):
+        groups = get_group_membership(username, resolver=self.resolver)
+        self._cache.set(username, (groups, now + self.ttl), now + self.ttl + self.stale_ttl)
+        return groups
+
+    def _refresh(self, username):
+        # only a single background refresh is queued per user
+        with self._lock:
+            if username in self._refreshing:
+                return
+
+            # the refresh thread is started in each worker, the thread of the parent process isn't running after fork
+            if self._refresh_pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.REFRESH_QUEUE_SIZE)
+                self._refreshing.clear()
+                self._refresh_pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,), daemon=True).start()
+
+            try:
+                self._queue.put_nowait(username)
+            except queue.Full:
+                self._incr("group_cache_refresh_dropped")
+                return
+
+            self._refreshing.add(username)
+
+    def _run(self, refresh_queue):
+        while True:
+            username = refresh_queue.get()
+
+            try:
+                self._load(username, time.time())
+            except Exception as err:
+                structured_log(level='warning', msg="Failed to refresh group membership", user=f"'{username}'", error=err)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(username)
+
+    def _incr(self, stat):
+        if self.statsd is not None:
+            self.statsd.incr(stat)
+
+
+class KeyCache(object):
+    """
+    Per-worker cache of the secret keys derived from the master key for each JWT.
+    Entries are evicted once the token they were derived for has expired.
+
+    Attributes
+    ----------
+    statsd : StatsClient object
+      the statsd client used to export cache hit and miss counts
+    """
+    def __init__(self, statsd=None, max_entries=4096):
+        self.statsd = statsd
+
+        self._cache = LRUCache(max_entries=max_entries)
+
+    def init_app(self, app):
+        """
+        Configures the cache from the Flask application's configuration.
+        """
+        self._cache.max_entries = app.config.get('KEY_CACHE_MAX_ENTRIES', self._cache.max_entries)
+        self._cache.clear()
+
+    def get(self, master_key, salt, subject, expires_at):
+        """
+        Returns the secret key for a JWT as a string, deriving and caching it if it is not cached.
+        Only used for JWTs issued by this service, use lookup() and set() when verifying a JWT.
+
+        Arguments
+        ----------
+        master_key : bytes
+          the master key used to derive the secret key
+
+        salt : bytes
+          the unique salt of the JWT
+
+        subject : bytes
+          the subject of the JWT
+
+        expires_at : float
+          the expiry time of the JWT, the key is not cached if this is invalid or has passed
+        """
+        secret_key = self.lookup(master_key, salt, subject)
+        if secret_key is not None:
+            return secret_key
+
+        secret_key = self.derive(master_key, salt, subject)
+        self.set(master_key, salt, subject, secret_key, expires_at)
+
+        return secret_key
+
+    def lookup(self, master_key, salt, subject):
+        """
+        Returns the cached secret key for a JWT as a string, otherwise None.
+
+        Arguments
+        ----------
+        master_key : bytes
+          the master key used to derive the secret key
+
+        salt : bytes
+          the unique salt of the JWT
+
+        subject : bytes
+          the subject of the JWT
+        """
+        secret_key = self._cache.get((master_key, subject, salt))
+
+        if secret_key is None:
+            self._incr("key_cache_miss")
+        else:
+            self._incr("key_cache_hit")
+
+        return secret_key
+
+    def set(self, master_key, salt, subject, secret_key, expires_at):
+        """
+        Stores the secret key for a JWT until it expires. When verifying a JWT, the key
+        must only be stored once its signature has been verified, so that the cache can't
+        be filled with the keys of forged tokens.
+
+        Arguments
+        ----------
+        master_key : bytes
+          the master key used to derive the secret key
+
+        salt : bytes
+          the unique salt of the JWT
+
+        subject : bytes
+          the subject of the JWT
+
+        secret_key : string
+          the secret key derived for the JWT
+
+        expires_at : float
+          the expiry time of the JWT, the key is not cached if this is invalid or has passed
+        """
+        try:
+            expires_at = float(expires_at)
+        except (TypeError, ValueError):
+            return
+
+        if expires_at > time.time():
+            self._cache.set((master_key, subject, salt), secret_key, expires_at)
+
+    @staticmethod
+    def derive(master_key, salt, subject):
+        """
+        Returns the secret key for a JWT as a string, derived from the master key with blake2b.
+
+        Arguments
+        ----------
+        master_key : bytes
+          the master key used to derive the secret key
+
+        salt : bytes
+          the unique salt of the JWT
+
+        subject : bytes
+          the subject of the JWT
+        """
+        return blake2b(b'', key=master_key, salt=salt, person=subject).decode('utf-8')
+
+    def _incr(self, stat):
+        if self.statsd is not None:
+            self.statsd.incr(stat)
+
+
+class TokenCache(object):
+    """
+    Per-worker cache of successfully verified JWTs, keyed by a SHA256 digest of the token.
+    Entries are evicted once the token has expired. Only tokens that passed signature
+    verification are stored, so the cache can't be filled with forged tokens.
+
+    Attributes
+    ----------
+    statsd : StatsClient object
+      the statsd client used to export cache hit and miss counts
+    """
+    def __init__(self, statsd=None, max_entries=4096):
+        self.statsd = statsd
+
+        self._cache = LRUCache(max_entries=max_entries)
+
+    def init_app(self, app):
+        """
+        Configures the cache from the Flask application's configuration.
+        """
+        self._cache.max_entries = app.config.get('TOKEN_CACHE_MAX_ENTRIES', self._cache.max_entries)
+        self._cache.clear()
+
+    def get(self, token):
+        """
+        Returns the subject of the JWT if it has been verified and has not expired, otherwise None.
+
+        Arguments
+        ----------
+        token : string
+          the JWT to look up
+        """
+        subject = self._cache.get(self._digest(token))
+
+        if subject is None:
+            self._incr("token_cache_miss")
+        else:
+            self._incr("token_cache_hit")
+
+        return subject
+
+    def set(self, token, subject, expires_at):
+        """
+        Stores a verified JWT until it expires.
+
+        Arguments
+        ----------
+        token : string
+          the verified JWT
+
+        subject : object
+          the subject of the JWT
+
+        expires_at : float
+          the expiry time of the JWT
+        """
+        try:
+            expires_at = float(expires_at)
+        except (TypeError, ValueError):
+            return
+
+        self._cache.set(self._digest(token), subject, expires_at)
+
+    def clear(self):
+        """
+        Removes all verified JWTs from the cache.
+        """
+        self._cache.clear()
+
+    @staticmethod
+    def _digest(token):
+        return sha256(token.encode('utf-8')).digest()
+
+    def _incr(self, stat):
+        if self.statsd is not None:
+            self.statsd.incr(stat)
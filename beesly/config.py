@@ -1,13 +1,14 @@
-from distutils.spawn import find_executable
-from distutils.util import strtobool
 from urllib.parse import urlparse
+import ipaddress
 import os
 import os.path
-import socket
+import re
 
-from statsd import StatsClient
-
-from beesly._logging import structured_log
+from beesly._env import strtobool
+from beesly._logging import LOG_LEVELS, structured_log
+from beesly.keys import KeySet, SIGNING_ALGORITHMS
+from beesly.metrics import BufferedStatsClient, DeferredStatsClient
+from beesly.utils import find_executable
 from beesly.version import __app__, __version__
 
 
@@ -17,6 +18,9 @@ class ConfigError(Exception):
     """
 
 
+HOSTNAME_REGEX = re.compile(r'^(?=.{1,253}$)[a-zA-Z0-9_]([-a-zA-Z0-9_]{0,61}[a-zA-Z0-9_])?(\.[a-zA-Z0-9_]([-a-zA-Z0-9_]{0,61}[a-zA-Z0-9_])?)*\.?$')
+
+
 class StatsdConfig(object):
     """
     Manages statsd settings for exporting metrics.
@@ -32,6 +36,15 @@ class StatsdConfig(object):
     port : integer
       the UDP port of the statsd collector
 
+    buffered : boolean
+      if True, metrics are buffered and sent in batches from a background thread
+
+    flush_interval : float
+      the number of seconds between sends of buffered metrics
+
+    max_packet_size : integer
+      the maximum size in bytes of a datagram of buffered metrics
+
     client : StatsClient object
       the initialized statsd client
     """
@@ -44,21 +57,97 @@ class StatsdConfig(object):
         except ValueError:
             self.port = 8125
 
-        # check that STATSD_HOST is a valid hostname or IPv4 address
-        if self.host != "localhost":
-            try:
-                socket.gethostbyname(self.host)
-            except:
-                try:
-                    socket.inet_aton(self.host)
-                except:
-                    structured_log(level='error', msg="Invalid value provided for STATSD_HOST. Defaulting to localhost")
-                    self.host = "localhost"
+        # check that STATSD_HOST is a valid hostname or IPv4 address. It's resolved in the
+        # background by the client, so that a slow or failing DNS lookup doesn't delay startup
+        if not HOSTNAME_REGEX.match(self.host):
+            structured_log(level='error', msg="Invalid value provided for STATSD_HOST. Defaulting to localhost")
+            self.host = "localhost"
 
-        self.client = StatsClient(host=self.host, port=self.port, prefix=self.prefix)
+        try:
+            self.buffered = strtobool(os.environ.get("STATSD_BUFFERED", 'False'))
+        except ValueError:
+            structured_log(level='error', msg="Invalid value provided for STATSD_BUFFERED. Defaulting to False")
+            self.buffered = False
+
+        self.flush_interval = max(get_int_setting("STATSD_FLUSH_INTERVAL", 1000), 1) / 1000
+        self.max_packet_size = get_int_setting("STATSD_MAX_PACKET_SIZE", 1432)
+
+        if self.buffered:
+            self.client = BufferedStatsClient(host=self.host, port=self.port, prefix=self.prefix,
+                                              flush_interval=self.flush_interval, max_packet_size=self.max_packet_size)
+        else:
+            self.client = DeferredStatsClient(host=self.host, port=self.port, prefix=self.prefix)
 
         structured_log(level='info', msg=f"Statsd client configured to export metrics to {self.host}:{self.port}")
 
+    def flush(self):
+        """
+        Sends any buffered metrics.
+        """
+        if self.buffered:
+            self.client.flush()
+
+
+def get_int_setting(name, default):
+    """
+    Returns the value of the environment variable as a non-negative integer.
+    The default is returned if the variable is unset or its value is invalid.
+
+    Arguments
+    ----------
+    name : string
+      the name of the environment variable
+
+    default : integer
+      the value to use when the environment variable is unset or invalid
+    """
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError:
+        structured_log(level='error', msg=f"Invalid value provided for {name}. Defaulting to {default}")
+        return default
+
+    if value < 0:
+        structured_log(level='error', msg=f"Invalid value provided for {name}. Defaulting to {default}")
+        return default
+
+    return value
+
+
+def get_sample_rates_setting(name):
+    """
+    Returns the log sample rates in the environment variable as a dictionary. The
+    variable contains comma separated `<message or level>=<rate>` pairs, where the
+    rate is between 0 and 1, eg. `JWT successfully verified=0.01,info=0.5`.
+    Invalid pairs are ignored, as are warning and error levels, which are never sampled.
+
+    Arguments
+    ----------
+    name : string
+      the name of the environment variable
+    """
+    rates = {}
+
+    for pair in os.environ.get(name, '').split(','):
+        if not pair.strip():
+            continue
+
+        (event, _, rate) = pair.rpartition('=')
+        event = event.strip()
+
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = -1
+
+        if not event or not 0 <= rate <= 1 or event.upper() in ['WARNING', 'ERROR', 'CRITICAL']:
+            structured_log(level='error', msg=f"Invalid value provided for {name}. Ignoring '{pair.strip()}'")
+            continue
+
+        rates[event.lower() if event.upper() in LOG_LEVELS else event] = rate
+
+    return rates
+
 
 def initialize_config():
     """
@@ -68,13 +157,6 @@ def initialize_config():
     """
     settings = {}
 
-    # ensure that all dependencies used exist
-    dependencies = ['id']
-    for binary in dependencies:
-        if find_executable(binary) is None:
-            structured_log(level='critical', msg="Failed to locate required dependency", dependency=binary)
-            raise ConfigError()
-
     settings['APP_NAME']    = __app__
     settings['APP_VERSION'] = __version__
     settings['DEV']         = strtobool(os.environ.get("DEV", 'False'))
@@ -89,7 +171,9 @@ def initialize_config():
     if settings["RATELIMIT_ENABLED"]:
 
         rate_limit_strategies       = ['fixed-window', 'fixed-window-elastic-expiry', 'moving-window']
-        rate_limit_storage_schemes  = ['memory', 'memcached', 'redis', 'rediss', 'redis+sentinel', 'redis_cluster']
+        rate_limit_storage_schemes  = ['memory', 'shm', 'memcached', 'redis', 'rediss', 'redis+sentinel', 'redis_cluster']
+        # hybrid storage in front of in-memory storage wouldn't share counters between workers, so it isn't accepted
+        hybrid_storage_schemes      = ['hybrid+memcached', 'hybrid+redis', 'hybrid+rediss']
 
         storage_scheme = urlparse(settings["RATELIMIT_STORAGE_URL"]).scheme
 
@@ -97,7 +181,7 @@ def initialize_config():
             structured_log(level='error', msg="Invalid value provided for RATELIMIT_STRATEGY")
             raise ConfigError()
 
-        if storage_scheme not in rate_limit_storage_schemes:
+        if storage_scheme not in rate_limit_storage_schemes + hybrid_storage_schemes:
             structured_log(level='error', msg="Invalid value provided for RATELIMIT_STORAGE_URL")
             raise ConfigError()
 
@@ -105,6 +189,36 @@ def initialize_config():
             structured_log(level='error', msg="Invalid value provided for RATELIMIT_STORAGE_URL. moving-window can't be used with memcached")
             raise ConfigError()
 
+        # shared memory storage is created before gunicorn forks so that all workers share the same counters
+        if storage_scheme == 'shm':
+            settings["RATELIMIT_STORAGE_OPTIONS"] = {
+                'slots': get_int_setting("RATELIMIT_SHM_SLOTS", 65536),
+            }
+
+        # hybrid storage counts hits per worker and syncs them to the shared storage in batches
+        if storage_scheme in hybrid_storage_schemes:
+            if settings["RATELIMIT_STRATEGY"] != 'fixed-window':
+                structured_log(level='error', msg="Invalid value provided for RATELIMIT_STORAGE_URL. Hybrid storage can only be used with fixed-window")
+                raise ConfigError()
+
+            settings["RATELIMIT_STORAGE_OPTIONS"] = {
+                'sync_interval': get_int_setting("RATELIMIT_SYNC_INTERVAL", 100) / 1000,
+                'max_delta': get_int_setting("RATELIMIT_MAX_DELTA", 10),
+            }
+
+    # health checks from load balancers are exempt from rate limiting
+    settings["HEALTHCHECK_SOURCE_RANGES"] = []
+
+    for source_range in os.environ.get("HEALTHCHECK_SOURCE_RANGES", '').split(','):
+        if not source_range.strip():
+            continue
+
+        try:
+            settings["HEALTHCHECK_SOURCE_RANGES"].append(ipaddress.ip_network(source_range.strip(), strict=False))
+        except ValueError:
+            structured_log(level='error', msg=f"Invalid value provided for HEALTHCHECK_SOURCE_RANGES. '{source_range.strip()}' is not a valid CIDR")
+            raise ConfigError()
+
     # python-pam module allows specfiying which PAM service by name to authenticate against
     settings['PAM_SERVICE'] = os.environ.get("PAM_SERVICE", 'login')
 
@@ -113,6 +227,42 @@ def initialize_config():
         structured_log(level='error', msg=f"Invalid value provided for PAM_SERVICE. The pam configuration file '{pam_file}' does not exist")
         raise ConfigError()
 
+    # PAM authentications are dispatched to a bounded pool to limit how long a worker is held
+    settings['PAM_POOL_TYPE']       = os.environ.get("PAM_POOL_TYPE", 'thread')
+    settings['PAM_POOL_SIZE']       = get_int_setting("PAM_POOL_SIZE", 2)
+    settings['PAM_POOL_QUEUE_SIZE'] = get_int_setting("PAM_POOL_QUEUE_SIZE", 4)
+    settings['PAM_TIMEOUT']         = get_int_setting("PAM_TIMEOUT", 5)
+
+    # the number of threads used by the ASGI application for group lookups and routes other than /auth
+    settings['ASGI_THREADS']        = max(get_int_setting("ASGI_THREADS", 32), 1)
+
+    if settings['PAM_POOL_TYPE'] not in ['thread', 'process']:
+        structured_log(level='error', msg="Invalid value provided for PAM_POOL_TYPE. Defaulting to thread")
+        settings['PAM_POOL_TYPE'] = 'thread'
+
+    # group membership is resolved in-process through NSS, the `id` command is available as a fallback
+    settings['GROUP_RESOLVER'] = os.environ.get("GROUP_RESOLVER", 'nss')
+
+    if settings['GROUP_RESOLVER'] not in ['nss', 'id']:
+        structured_log(level='error', msg="Invalid value provided for GROUP_RESOLVER. Defaulting to nss")
+        settings['GROUP_RESOLVER'] = 'nss'
+
+    # group membership is cached per worker, stale entries are served while being refreshed
+    settings['GROUP_CACHE_TTL']         = get_int_setting("GROUP_CACHE_TTL", 60)
+    settings['GROUP_CACHE_STALE_TTL']   = get_int_setting("GROUP_CACHE_STALE_TTL", 300)
+    settings['GROUP_CACHE_MAX_ENTRIES'] = get_int_setting("GROUP_CACHE_MAX_ENTRIES", 1024)
+
+    # state is built before gunicorn forks workers, optionally including the group membership of every user
+    settings['WARMUP']                  = strtobool(os.environ.get("WARMUP", 'True'))
+    settings['WARMUP_GROUPS']           = strtobool(os.environ.get("WARMUP_GROUPS", 'False'))
+
+    # ensure that all dependencies used exist
+    dependencies = ['id'] if settings['GROUP_RESOLVER'] == 'id' else []
+    for binary in dependencies:
+        if find_executable(binary) is None:
+            structured_log(level='critical', msg="Failed to locate required dependency", dependency=binary)
+            raise ConfigError()
+
     # configure JWT, by default it's disabled
     settings["JWT"] = False
 
@@ -124,7 +274,27 @@ def initialize_config():
     except ValueError:
         settings["JWT_VALIDITY_PERIOD"] = 900
 
-    if settings["JWT_MASTER_KEY"] is not None:
+    # JWTs can be signed with asymmetric keys instead of secret keys derived from the master key
+    settings["JWT_SIGNING_KEYS_DIR"]    = os.environ.get('JWT_SIGNING_KEYS_DIR', None)
+    settings["JWT_SIGNING_KEY_ID"]      = os.environ.get('JWT_SIGNING_KEY_ID', None)
+    settings["JWT_SIGNING_KEYS"]        = None
+    settings["JWKS_MAX_AGE"]            = get_int_setting("JWKS_MAX_AGE", 300)
+
+    if settings["JWT_ALGORITHM"] in SIGNING_ALGORITHMS:
+        if settings["JWT_SIGNING_KEYS_DIR"] is None or settings["JWT_SIGNING_KEY_ID"] is None:
+            structured_log(level='error', msg=f"JWT_SIGNING_KEYS_DIR and JWT_SIGNING_KEY_ID must be provided to use {settings['JWT_ALGORITHM']}")
+            raise ConfigError()
+
+        try:
+            settings["JWT_SIGNING_KEYS"] = KeySet.load(settings["JWT_SIGNING_KEYS_DIR"], settings["JWT_ALGORITHM"], settings["JWT_SIGNING_KEY_ID"])
+        except (OSError, ValueError) as err:
+            structured_log(level='error', msg="Failed to load JWT signing keys", error=err)
+            raise ConfigError()
+
+        settings["JWT"] = True
+        structured_log(level='info', msg=f"Signing JWTs with {settings['JWT_ALGORITHM']}", kid=settings["JWT_SIGNING_KEY_ID"])
+
+    elif settings["JWT_MASTER_KEY"] is not None:
         if len(settings["JWT_MASTER_KEY"]) < 10 or len(settings["JWT_MASTER_KEY"]) > 64:
             structured_log(level='error', msg="Invalid value provided for JWT_MASTER_KEY. Must be between 10 - 64 characters")
             raise ConfigError()
@@ -136,4 +306,56 @@ def initialize_config():
         settings["JWT"] = True
         settings["JWT_MASTER_KEY"] = bytes(settings["JWT_MASTER_KEY"], encoding='utf-8')
 
+    # secret keys derived for each JWT and successfully verified JWTs are cached until the JWT expires
+    settings["KEY_CACHE_MAX_ENTRIES"]   = get_int_setting("KEY_CACHE_MAX_ENTRIES", 4096)
+    settings["TOKEN_CACHE_MAX_ENTRIES"] = get_int_setting("TOKEN_CACHE_MAX_ENTRIES", 4096)
+
+    # information returned by /service is cached and refreshed in the background
+    settings["SYSINFO_REFRESH_INTERVAL"]    = get_int_setting("SYSINFO_REFRESH_INTERVAL", 60)
+    settings["EC2_METADATA_RETRY_INTERVAL"] = get_int_setting("EC2_METADATA_RETRY_INTERVAL", 3600)
+
+    # request bodies larger than this are rejected before they are parsed
+    settings["REQUEST_MAX_BODY_SIZE"] = get_int_setting("REQUEST_MAX_BODY_SIZE", 65536)
+
+    # the maximum number of JWTs that can be verified in a single request to /verify/batch
+    settings["VERIFY_BATCH_MAX_SIZE"] = get_int_setting("VERIFY_BATCH_MAX_SIZE", 100)
+
+    # the time taken by each stage of a request is returned in a Server-Timing header and sent as statsd timers
+    settings["SERVER_TIMING"] = strtobool(os.environ.get("SERVER_TIMING", 'False'))
+
+    # Prometheus metrics are written by each worker to PROMETHEUS_MULTIPROC_DIR and aggregated on /metrics
+    settings["PROMETHEUS"] = strtobool(os.environ.get("PROMETHEUS", 'False'))
+
+    if settings["PROMETHEUS"]:
+        multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+        if multiproc_dir is None or not os.path.isdir(multiproc_dir):
+            structured_log(level='error', msg="PROMETHEUS_MULTIPROC_DIR must be set to an existing directory to use PROMETHEUS")
+            raise ConfigError()
+
+        try:
+            import prometheus_client  # noqa: F401
+        except ImportError:
+            structured_log(level='critical', msg="Failed to locate required dependency", dependency='prometheus_client')
+            raise ConfigError()
+
+    # high-volume info logs can be sampled and summarized periodically
+    settings["LOG_SAMPLE_RATES"]        = get_sample_rates_setting("LOG_SAMPLE_RATES")
+    settings["LOG_SUMMARY_INTERVAL"]    = get_int_setting("LOG_SUMMARY_INTERVAL", 10)
+
+    # workers can be profiled on demand, profiles are written to PROFILER_DIR
+    settings["PROFILER_DIR"]            = os.environ.get("PROFILER_DIR")
+    settings["PROFILER_MODE"]           = os.environ.get("PROFILER_MODE", "sampling")
+    settings["PROFILER_REQUESTS"]       = get_int_setting("PROFILER_REQUESTS", 100)
+    settings["PROFILER_SECONDS"]        = get_int_setting("PROFILER_SECONDS", 30)
+    settings["PROFILER_SAMPLE_INTERVAL"] = get_int_setting("PROFILER_SAMPLE_INTERVAL", 5) / 1000
+
+    if settings["PROFILER_DIR"] is not None and not os.path.isdir(settings["PROFILER_DIR"]):
+        structured_log(level='error', msg="Invalid value provided for PROFILER_DIR. The directory does not exist")
+        raise ConfigError()
+
+    if settings["PROFILER_MODE"] not in ['requests', 'sampling']:
+        structured_log(level='error', msg="Invalid value provided for PROFILER_MODE")
+        raise ConfigError()
+
     return settings
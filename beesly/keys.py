@@ -0,0 +1,224 @@
+import os
+import os.path
+
+from nacl.encoding import URLSafeBase64Encoder
+from nacl.exceptions import BadSignatureError
+from nacl.signing import SigningKey
+
+from beesly import _json
+from beesly.tokens import TokenError, base64url_encode, validate_claims
+
+
+SIGNING_ALGORITHMS = ['EdDSA', 'ES256']
+
+
+class Ed25519Key(object):
+    """
+    An Ed25519 key used to sign JWTs with the EdDSA algorithm.
+
+    Attributes
+    ----------
+    kid : string
+      the ID of the key
+
+    can_sign : boolean
+      True if the key can sign JWTs
+    """
+    algorithm = 'EdDSA'
+
+    def __init__(self, kid, data):
+        self.kid = kid
+        self.can_sign = True
+
+        # the key file contains the base64url encoded 32 byte seed of the private key
+        self._signing_key = SigningKey(data.strip(), encoder=URLSafeBase64Encoder)
+        self._verify_key = self._signing_key.verify_key
+
+    def sign(self, msg):
+        return self._signing_key.sign(msg).signature
+
+    def verify(self, msg, signature):
+        try:
+            self._verify_key.verify(msg, signature)
+        except BadSignatureError:
+            return False
+
+        return True
+
+    def public_jwk(self):
+        return {
+            'kty': 'OKP',
+            'crv': 'Ed25519',
+            'x': base64url_encode(bytes(self._verify_key)).decode('utf-8'),
+        }
+
+
+class ECP256Key(object):
+    """
+    A P-256 elliptic curve key used to sign JWTs with the ES256 algorithm.
+    Key files containing only a public key can verify, but not sign, JWTs.
+
+    Attributes
+    ----------
+    kid : string
+      the ID of the key
+
+    can_sign : boolean
+      True if the key can sign JWTs
+    """
+    algorithm = 'ES256'
+
+    def __init__(self, kid, data):
+        from jose import jwk
+        from jose.exceptions import JWKError
+
+        self.kid = kid
+
+        try:
+            self._key = jwk.construct(data, 'ES256')
+        except JWKError as err:
+            raise ValueError(err)
+
+        self.can_sign = not self._key.is_public()
+        self._public_key = self._key.public_key() if self.can_sign else self._key
+
+    def sign(self, msg):
+        return self._key.sign(msg)
+
+    def verify(self, msg, signature):
+        try:
+            return self._public_key.verify(msg, signature)
+        except Exception:
+            return False
+
+    def public_jwk(self):
+        jwk = self._public_key.to_dict()
+
+        return {
+            'kty': jwk['kty'],
+            'crv': jwk['crv'],
+            'x': jwk['x'],
+            'y': jwk['y'],
+        }
+
+
+KEY_TYPES = {
+    'EdDSA': Ed25519Key,
+    'ES256': ECP256Key,
+}
+
+
+class KeySet(object):
+    """
+    The set of asymmetric keys used to sign and verify JWTs. The active key signs
+    new JWTs, while all keys remain available to verify JWTs and are published as
+    a JWKS so that JWTs can be verified without calling beesly.
+
+    Attributes
+    ----------
+    algorithm : string
+      the algorithm used to sign JWTs, either EdDSA or ES256
+
+    active_kid : string
+      the ID of the key that signs new JWTs
+
+    jwks : dict
+      the JSON Web Key Set containing the public keys
+    """
+    def __init__(self, algorithm, keys, active_kid):
+        self.algorithm = algorithm
+        self.active_kid = active_kid
+
+        self._keys = {key.kid: key for key in keys}
+
+        if active_kid not in self._keys or not self._keys[active_kid].can_sign:
+            raise ValueError(f"No private key found for the active key ID '{active_kid}'")
+
+        self._active_key = self._keys[active_kid]
+
+        # the header is identical for every JWT signed with the active key, so it's only encoded once
+        self._header = base64url_encode(_json.dumps({'alg': algorithm, 'kid': active_kid, 'typ': 'JWT'}, sort_keys=True))
+
+        self.jwks = {
+            'keys': [
+                dict(key.public_jwk(), kid=kid, alg=algorithm, use='sig') for (kid, key) in sorted(self._keys.items())
+            ]
+        }
+
+    @classmethod
+    def load(cls, directory, algorithm, active_kid):
+        """
+        Returns a KeySet containing every key in the directory. Each key is stored in
+        a file named `<kid>.key`. ValueError is raised if a key can't be loaded.
+
+        Arguments
+        ----------
+        directory : string
+          the directory containing the keys
+
+        algorithm : string
+          the algorithm used to sign JWTs, either EdDSA or ES256
+
+        active_kid : string
+          the ID of the key that signs new JWTs
+        """
+        key_type = KEY_TYPES[algorithm]
+
+        keys = []
+        for filename in sorted(os.listdir(directory)):
+            kid, extension = os.path.splitext(filename)
+            if extension != '.key':
+                continue
+
+            with open(os.path.join(directory, filename), 'rb') as f:
+                data = f.read()
+
+            try:
+                keys.append(key_type(kid, data))
+            except Exception as err:
+                raise ValueError(f"Failed to load key '{filename}': {err}")
+
+        return cls(algorithm, keys, active_kid)
+
+    def encode(self, claims):
+        """
+        Returns a JWT containing the claims signed with the active key.
+
+        Arguments
+        ----------
+        claims : dict
+          the claims to include in the JWT
+        """
+        payload = base64url_encode(_json.dumps(claims))
+        signing_input = self._header + b'.' + payload
+        signature = base64url_encode(self._active_key.sign(signing_input))
+
+        return (signing_input + b'.' + signature).decode('utf-8')
+
+    def verify(self, token, issuer=None):
+        """
+        Verifies the signature and registered claims of a parsed JWT, returning its claims.
+        TokenError is raised if the key is unknown, the signature is invalid, the JWT has expired, etc.
+
+        Arguments
+        ----------
+        token : Token
+          the JWT returned by beesly.tokens.parse()
+
+        issuer : string
+          the expected issuer of the JWT
+        """
+        if token.header.get('alg') != self.algorithm:
+            raise TokenError("The specified alg value is not allowed")
+
+        kid = token.header.get('kid')
+        key = self._keys.get(kid) if isinstance(kid, str) else None
+        if key is None:
+            raise TokenError("Unknown key ID")
+
+        if not key.verify(token.signing_input, token.signature):
+            raise TokenError("Signature verification failed")
+
+        validate_claims(token.claims, issuer=issuer)
+
+        return token.claims
@@ -0,0 +1,388 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import atexit
+import os
+import socket
+import threading
+import time
+
+from flask import current_app, g, request
+from statsd import StatsClient
+
+from beesly._logging import structured_log
+
+
+class DeferredStatsClient(StatsClient):
+    """
+    statsd client that resolves the hostname of the statsd collector in a background
+    thread instead of blocking in its constructor, so that a slow or failing DNS lookup
+    doesn't delay startup. The lookup is retried every `retry_interval` seconds, doubling
+    up to `max_retry_interval`, and metrics are dropped until it succeeds. IP addresses
+    are used immediately.
+
+    Attributes
+    ----------
+    retry_interval : float
+      the number of seconds to wait before retrying the first failed lookup
+
+    max_retry_interval : float
+      the maximum number of seconds between retries
+    """
+    def __init__(self, host='localhost', port=8125, prefix=None, maxudpsize=512, ipv6=False, retry_interval=1, max_retry_interval=60):
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._host = host
+        self._port = port
+        self._family = socket.AF_INET6 if ipv6 else socket.AF_INET
+        self._prefix = prefix
+        self._maxudpsize = maxudpsize
+
+        self._addr = None
+        self._sock = None
+        self._resolve_pid = None
+        self._resolve_lock = threading.Lock()
+
+        try:
+            self._connect(socket.AI_NUMERICHOST)
+        except OSError:
+            pass
+
+    def _send(self, data):
+        if self._addr is None:
+            self._resolve()
+            return
+
+        try:
+            self._sock.sendto(data.encode('ascii'), self._addr)
+        except (socket.error, RuntimeError):
+            pass
+
+    def _connect(self, flags=0):
+        family, _, _, _, addr = socket.getaddrinfo(self._host, self._port, self._family, socket.SOCK_DGRAM, 0, flags)[0]
+
+        # the socket is set before the address, which is checked before sending
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        self._addr = addr
+
+    def _resolve(self):
+        # the lookup is started lazily so that it doesn't run in the gunicorn master while it forks workers
+        pid = os.getpid()
+
+        with self._resolve_lock:
+            if self._resolve_pid == pid:
+                return
+            self._resolve_pid = pid
+
+        thread = threading.Thread(target=self._run_resolver, args=(pid,), daemon=True)
+        thread.start()
+
+    def _run_resolver(self, pid):
+        interval = self.retry_interval
+
+        while self._resolve_pid == pid and self._addr is None:
+            try:
+                self._connect()
+            except OSError as err:
+                structured_log(level='warning', msg="Failed to resolve the statsd host. Retrying", host=self._host,
+                               retry_interval=f"{interval}s", error=err)
+                time.sleep(interval)
+                interval = min(interval * 2, self.max_retry_interval)
+
+
+class BufferedStatsClient(DeferredStatsClient):
+    """
+    statsd client that buffers metrics in memory and sends them from a background
+    thread every `flush_interval` seconds, instead of sending a datagram on the
+    request thread for every metric. Counters are summed and gauges keep their last
+    value between flushes, while timers and all other metrics are sent as recorded.
+    Metrics are packed into as few datagrams as possible of up to `max_packet_size` bytes.
+
+    Attributes
+    ----------
+    flush_interval : float
+      the number of seconds between flushes
+
+    max_packet_size : integer
+      the maximum size of a datagram in bytes
+    """
+    def __init__(self, host='localhost', port=8125, prefix=None, flush_interval=1, max_packet_size=1432):
+        super(BufferedStatsClient, self).__init__(host=host, port=port, prefix=prefix, maxudpsize=max_packet_size)
+
+        self.flush_interval = flush_interval
+        self.max_packet_size = max_packet_size
+
+        self._counters = OrderedDict()
+        self._gauges = OrderedDict()
+        self._stats = []
+        self._lock = threading.Lock()
+        self._flush_pid = None
+
+        atexit.register(self.flush)
+
+    def incr(self, stat, count=1, rate=1):
+        """
+        Increments a counter by `count`.
+        """
+        if rate != 1:
+            return super(BufferedStatsClient, self).incr(stat, count, rate)
+
+        with self._lock:
+            self._start()
+            self._counters[stat] = self._counters.get(stat, 0) + count
+
+    def gauge(self, stat, value, rate=1, delta=False):
+        """
+        Sets a gauge to `value`.
+        """
+        if rate != 1 or delta or value < 0:
+            return super(BufferedStatsClient, self).gauge(stat, value, rate, delta)
+
+        with self._lock:
+            self._start()
+            self._gauges[stat] = value
+
+    def flush(self):
+        """
+        Sends all buffered metrics.
+        """
+        with self._lock:
+            # metrics buffered by the parent process before it forked are sent by the parent
+            if self._flush_pid != os.getpid():
+                return
+
+            counters, self._counters = self._counters, OrderedDict()
+            gauges, self._gauges = self._gauges, OrderedDict()
+            stats, self._stats = self._stats, []
+
+        prepared = [self._prepare(stat, f'{count}|c', 1) for (stat, count) in counters.items()]
+        prepared.extend(self._prepare(stat, f'{value}|g', 1) for (stat, value) in gauges.items())
+        prepared.extend(stats)
+        stats = prepared
+
+        if not stats:
+            return
+
+        data = stats[0]
+        for stat in stats[1:]:
+            if len(data) + len(stat) + 1 > self.max_packet_size:
+                self._send(data)
+                data = stat
+            else:
+                data += '\n' + stat
+
+        self._send(data)
+
+    def _after(self, data):
+        if data is None:
+            return
+
+        with self._lock:
+            self._start()
+            self._stats.append(data)
+
+    def _start(self):
+        # the flush thread is started lazily so that each forked gunicorn worker gets its own
+        pid = os.getpid()
+        if self._flush_pid == pid:
+            return
+
+        if self._flush_pid is not None:
+            self._counters.clear()
+            self._gauges.clear()
+            self._stats.clear()
+
+        self._flush_pid = pid
+
+        thread = threading.Thread(target=self._run, args=(pid,), daemon=True)
+        thread.start()
+
+    def _run(self, pid):
+        while self._flush_pid == pid:
+            time.sleep(self.flush_interval)
+
+            try:
+                self.flush()
+            except Exception as err:
+                structured_log(level='warning', msg="Failed to send metrics", error=err)
+
+
+# buckets in seconds for request and stage latency histograms
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+if hasattr(time, 'perf_counter_ns'):
+    _perf_counter_ns = time.perf_counter_ns
+else:
+    def _perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """
+    Times a stage of handling a request with the RequestMetrics of the current application.
+    Does nothing if the application has no RequestMetrics.
+
+    Arguments
+    ----------
+    name : string
+      the name of the stage, eg. json_parse
+    """
+    metrics = current_app.extensions.get('request_metrics')
+    if metrics is None:
+        return _NULL_STAGE
+
+    return metrics.stage(name)
+
+
+class RequestMetrics(object):
+    """
+    Records per-endpoint request counts and latencies, and the time taken by each stage
+    of handling a request, eg. PAM authentication or JWT signing.
+
+    If PROMETHEUS is enabled they're exported on /metrics. Each gunicorn worker writes its
+    metrics to files in PROMETHEUS_MULTIPROC_DIR, which are aggregated across all workers
+    when scraped. If SERVER_TIMING is enabled, the stages of each request are returned in
+    a Server-Timing header and sent as statsd timers.
+
+    Attributes
+    ----------
+    prometheus : boolean
+      True if metrics are exported on /metrics
+
+    server_timing : boolean
+      True if stages are returned in a Server-Timing header
+
+    statsd : StatsClient object
+      the statsd client used to export stage timers
+    """
+    def __init__(self, statsd=None):
+        self.prometheus = False
+        self.server_timing = False
+        self.statsd = statsd
+
+        self._enabled = False
+        self._requests = None
+        self._request_latency = None
+        self._stage_latency = None
+        self._apps = set()
+
+    def init_app(self, app):
+        """
+        Configures metrics from the Flask application's configuration and adds the /metrics endpoint.
+        """
+        self.prometheus = app.config.get('PROMETHEUS', False)
+        self.server_timing = app.config.get('SERVER_TIMING', False)
+        self._enabled = self.prometheus or self.server_timing
+
+        app.extensions['request_metrics'] = self
+
+        if not self._enabled or app in self._apps:
+            return
+
+        # the request is timed from before any other before request function runs
+        app.before_request_funcs.setdefault(None, []).insert(0, self._before_request)
+        app.after_request(self._after_request)
+
+        if self.prometheus:
+            self._init_prometheus(app)
+
+        self._apps.add(app)
+
+    def stage(self, name):
+        """
+        Times a stage of handling a request. Returns a context manager that does nothing
+        if neither PROMETHEUS nor SERVER_TIMING is enabled.
+
+        Arguments
+        ----------
+        name : string
+          the name of the stage, eg. pam_auth
+        """
+        if not self._enabled:
+            return _NULL_STAGE
+
+        return self._timed_stage(name)
+
+    @contextmanager
+    def _timed_stage(self, name):
+        start = _perf_counter_ns()
+        try:
+            yield
+        finally:
+            self._record(name, _perf_counter_ns() - start)
+
+    def metrics_endpoint(self):
+        """
+        Returns the metrics of all gunicorn workers in the Prometheus text format.
+        """
+        from prometheus_client import CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
+        from prometheus_client.multiprocess import MultiProcessCollector
+
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+
+        return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+    def _init_prometheus(self, app):
+        from prometheus_client import Counter, Histogram
+
+        # metrics are not added to the default registry, the multiprocess collector reads them from disk
+        if self._requests is None:
+            self._requests = Counter('beesly_requests_total', 'Number of HTTP requests',
+                                     ['endpoint', 'method', 'status'], registry=None)
+            self._request_latency = Histogram('beesly_request_duration_seconds', 'Time taken to handle HTTP requests',
+                                              ['endpoint', 'method'], buckets=LATENCY_BUCKETS, registry=None)
+            self._stage_latency = Histogram('beesly_stage_duration_seconds', 'Time taken by each stage of handling a request',
+                                            ['stage'], buckets=LATENCY_BUCKETS, registry=None)
+
+        app.add_url_rule("/metrics", endpoint="metrics", view_func=self.metrics_endpoint, methods=["GET"])
+
+    def _record(self, name, duration):
+        if self.prometheus and self._stage_latency is not None:
+            self._stage_latency.labels(name).observe(duration / 1e9)
+
+        if self.server_timing:
+            stages = g.get('request_stages')
+            if stages is None:
+                stages = g.request_stages = []
+            stages.append((name, duration))
+
+            if self.statsd is not None:
+                self.statsd.timing(f"stage_{name}", duration / 1e6)
+
+    def _before_request(self):
+        g.request_start = _perf_counter_ns()
+
+    def _after_request(self, resp):
+        start = g.get('request_start')
+        if start is None:
+            return resp
+
+        duration = _perf_counter_ns() - start
+
+        if self.prometheus and self._requests is not None:
+            # the route's rule is used instead of the path to bound the number of label values
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+            self._requests.labels(endpoint, request.method, str(resp.status_code)).inc()
+            self._request_latency.labels(endpoint, request.method).observe(duration / 1e9)
+
+        if self.server_timing:
+            stages = g.get('request_stages', [])
+            resp.headers['Server-Timing'] = ', '.join(
+                [f'{name};dur={stage_duration / 1e6:.3f}' for (name, stage_duration) in stages] + [f'total;dur={duration / 1e6:.3f}']
+            )
+
+        return resp
@@ -0,0 +1,243 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError
+import os
+import threading
+
+from pam import pam
+
+
+class PamPoolFullError(Exception):
+    """
+    Exception raised when the PAM worker pool can't accept any more authentications.
+    """
+
+
+class PamTimeoutError(Exception):
+    """
+    Exception raised when a PAM authentication does not complete within the timeout.
+    """
+
+
+_handles = threading.local()
+
+
+def get_pam_handle(service):
+    """
+    Returns a PAM authenticator object for the service. Authenticator objects are
+    created once per thread and service, and reused for all subsequent authentications.
+
+    Arguments
+    ----------
+    service : string
+      the name of the PAM service to authenticate against
+    """
+    handles = getattr(_handles, 'handles', None)
+    if handles is None:
+        handles = _handles.handles = {}
+
+    handle = handles.get(service)
+    if handle is None:
+        handle = handles[service] = pam()
+
+    return handle
+
+
+def pam_authenticate(username, password, service):
+    """
+    Authenticates a user with the given PAM service. Returns True if
+    authentication is successful, otherwise False.
+
+    Arguments
+    ----------
+    username : string
+      the username of the user to authenticate
+
+    password : string
+      the password of the user to authenticate
+
+    service : string
+      the name of the PAM service to authenticate against
+    """
+    return get_pam_handle(service).authenticate(username, password, service=service)
+
+
+class PamPool(object):
+    """
+    Dispatches PAM authentications to a bounded thread or process pool so that
+    slow PAM modules can't hold a gunicorn worker for longer than `timeout` seconds.
+    Authentications are rejected immediately once `size` authentications are
+    in flight and `queue_size` more are waiting. Each gunicorn worker has its own pool,
+    and a sync worker only handles one request at a time, so the queue only sheds load
+    with threaded workers.
+
+    Attributes
+    ----------
+    size : integer
+      the number of threads or processes, 0 authenticates in the request thread
+
+    queue_size : integer
+      the number of authentications that can wait for a free thread or process
+
+    timeout : float
+      the number of seconds to wait for an authentication to complete
+
+    pool_type : string
+      the type of pool to use, either `thread` or `process`
+
+    statsd : StatsClient object
+      the statsd client used to export queue depth and in flight gauges
+    """
+    def __init__(self, statsd=None, size=2, queue_size=4, timeout=5, pool_type='thread'):
+        self.size = size
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.pool_type = pool_type
+        self.statsd = statsd
+
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the pool from the Flask application's configuration.
+        """
+        self.size = app.config.get('PAM_POOL_SIZE', self.size)
+        self.queue_size = app.config.get('PAM_POOL_QUEUE_SIZE', self.queue_size)
+        self.timeout = app.config.get('PAM_TIMEOUT', self.timeout)
+        self.pool_type = app.config.get('PAM_POOL_TYPE', self.pool_type)
+        self.shutdown()
+
+    def authenticate(self, username, password, service):
+        """
+        Authenticates a user with the given PAM service. Returns True if authentication
+        is successful, otherwise False. PamPoolFullError is raised if the pool is full
+        and PamTimeoutError is raised if authentication does not complete in time.
+
+        Arguments
+        ----------
+        username : string
+          the username of the user to authenticate
+
+        password : string
+          the password of the user to authenticate
+
+        service : string
+          the name of the PAM service to authenticate against
+        """
+        if self.size <= 0:
+            return pam_authenticate(username, password, service)
+
+        future = self.submit(username, password, service)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PamTimeoutError()
+
+    async def authenticate_async(self, username, password, service):
+        """
+        Authenticates a user like authenticate(), but waits for the authentication
+        without blocking the event loop. Authentications waiting for a free thread
+        or process don't hold a thread of their own.
+
+        Arguments
+        ----------
+        username : string
+          the username of the user to authenticate
+
+        password : string
+          the password of the user to authenticate
+
+        service : string
+          the name of the PAM service to authenticate against
+        """
+        loop = asyncio.get_event_loop()
+
+        if self.size <= 0:
+            return await loop.run_in_executor(None, pam_authenticate, username, password, service)
+
+        future = asyncio.wrap_future(self.submit(username, password, service))
+
+        # the authentication is cancelled if it times out while waiting for a free thread or process
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise PamTimeoutError()
+
+    def submit(self, username, password, service):
+        """
+        Submits an authentication to the pool, returning a Future of its result.
+        PamPoolFullError is raised if the pool is full.
+
+        Arguments
+        ----------
+        username : string
+          the username of the user to authenticate
+
+        password : string
+          the password of the user to authenticate
+
+        service : string
+          the name of the PAM service to authenticate against
+        """
+        with self._lock:
+            # the pool is created lazily so that each forked gunicorn worker gets its own
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._create_executor()
+
+            if self._pending >= self.size + self.queue_size:
+                raise PamPoolFullError()
+
+            self._pending += 1
+            executor = self._executor
+
+        self._report()
+
+        try:
+            future = executor.submit(pam_authenticate, username, password, service)
+        except Exception:
+            self._release(None)
+            raise
+
+        # the slot is released when the authentication completes, even if it has timed out
+        future.add_done_callback(self._release)
+
+        return future
+
+    def shutdown(self):
+        """
+        Shuts down the pool without waiting for running authentications to complete.
+        """
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+
+            self._executor = None
+            self._executor_pid = None
+            self._pending = 0
+
+    def _create_executor(self):
+        if self.pool_type == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=self.size)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.size)
+
+        self._executor_pid = os.getpid()
+        self._pending = 0
+
+    def _release(self, future):
+        with self._lock:
+            self._pending = max(self._pending - 1, 0)
+
+        self._report()
+
+    def _report(self):
+        if self.statsd is None:
+            return
+
+        pending = self._pending
+        self.statsd.gauge("pam_pool_in_flight", min(pending, self.size))
+        self.statsd.gauge("pam_pool_queue_depth", max(pending - self.size, 0))
@@ -0,0 +1,217 @@
+from collections import Counter
+import cProfile
+import os
+import os.path
+import signal
+import sys
+import threading
+import time
+
+from flask import jsonify, request
+
+from beesly._logging import structured_log
+
+
+class Profiler(object):
+    """
+    Profiles a live worker on demand. In `requests` mode the next `requests` requests
+    handled by the worker are profiled with cProfile and written as a pstats file. In
+    `sampling` mode the stacks of all threads are sampled every `sample_interval` seconds
+    for `seconds` seconds and written as collapsed stacks, which can be rendered with
+    flamegraph.pl. Profiling is started by sending SIGUSR2 to a worker, or in DEV mode
+    by a request to /service/profile. Profiles are written to `directory`.
+
+    Attributes
+    ----------
+    directory : string
+      the directory profiles are written to, None disables profiling
+
+    mode : string
+      the type of profile started by SIGUSR2, either `requests` or `sampling`
+
+    requests : integer
+      the number of requests to profile in `requests` mode
+
+    seconds : integer
+      the number of seconds to profile in `sampling` mode
+
+    sample_interval : float
+      the number of seconds between samples in `sampling` mode
+    """
+    def __init__(self, directory=None, mode='sampling', requests=100, seconds=30, sample_interval=0.005):
+        self.directory = directory
+        self.mode = mode
+        self.requests = requests
+        self.seconds = seconds
+        self.sample_interval = sample_interval
+
+        self._profile = None
+        self._remaining = 0
+        self._lock = threading.Lock()
+        self._sampling_lock = threading.Lock()
+        self._apps = set()
+
+    def init_app(self, app):
+        """
+        Configures the profiler from the Flask application's configuration. The
+        /service/profile endpoint is added if the application is running in DEV mode.
+        """
+        self.directory = app.config.get('PROFILER_DIR', self.directory)
+        self.mode = app.config.get('PROFILER_MODE', self.mode)
+        self.requests = app.config.get('PROFILER_REQUESTS', self.requests)
+        self.seconds = app.config.get('PROFILER_SECONDS', self.seconds)
+        self.sample_interval = app.config.get('PROFILER_SAMPLE_INTERVAL', self.sample_interval)
+
+        if self.directory is None or app in self._apps:
+            return
+
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+        if app.config.get('DEV', False):
+            app.add_url_rule("/service/profile", endpoint="/service/profile", view_func=self.profile_endpoint, methods=["POST"])
+
+        self._apps.add(app)
+
+    def install_signal_handler(self):
+        """
+        Starts profiling in the configured mode when the process receives SIGUSR2.
+        Must be called from the main thread of each gunicorn worker, eg. in post_worker_init.
+        """
+        if self.directory is None:
+            return
+
+        signal.signal(signal.SIGUSR2, self._handle_signal)
+
+    def profile_requests(self, count):
+        """
+        Profiles the next `count` requests handled by this process. Returns False if a profile is already running.
+        """
+        # locks are never waited for, the signal handler may interrupt the thread holding them
+        if not self._lock.acquire(blocking=False):
+            return False
+
+        try:
+            if self._remaining > 0:
+                return False
+
+            self._profile = cProfile.Profile()
+            self._remaining = count
+        finally:
+            self._lock.release()
+
+        structured_log(level='info', msg="Profiling requests", requests=count)
+        return True
+
+    def profile_seconds(self, seconds):
+        """
+        Samples the stacks of this process for `seconds` seconds. Returns False if sampling is already running.
+        """
+        if not self._sampling_lock.acquire(blocking=False):
+            return False
+
+        thread = threading.Thread(target=self._sample, args=(seconds,), daemon=True)
+        thread.start()
+
+        structured_log(level='info', msg="Profiling with sampling", seconds=seconds)
+        return True
+
+    def profile_endpoint(self):
+        """
+        Starts profiling the worker that handles the request.
+        """
+        request_json = request.get_json(force=True, silent=True) or {}
+
+        mode = request_json.get('mode', self.mode)
+
+        try:
+            if mode == 'requests':
+                started = self.profile_requests(int(request_json.get('requests', self.requests)))
+            elif mode == 'sampling':
+                started = self.profile_seconds(int(request_json.get('seconds', self.seconds)))
+            else:
+                return jsonify(message="Invalid profiling mode"), 400
+        except (TypeError, ValueError):
+            return jsonify(message="Invalid profiling duration"), 400
+
+        if not started:
+            return jsonify(message="Profiling is already running", pid=os.getpid()), 409
+
+        return jsonify(message="Profiling started", pid=os.getpid()), 202
+
+    def _handle_signal(self, signum, frame):
+        if self.mode == 'requests':
+            self.profile_requests(self.requests)
+        else:
+            self.profile_seconds(self.seconds)
+
+    def _before_request(self):
+        if self._remaining <= 0:
+            return
+
+        # requests are profiled one at a time, concurrent requests aren't profiled
+        if not self._lock.acquire(blocking=False):
+            return
+
+        if self._remaining <= 0:
+            self._lock.release()
+            return
+
+        request.environ['beesly.profiling'] = True
+        self._profile.enable()
+
+    def _teardown_request(self, exc):
+        if not request.environ.pop('beesly.profiling', False):
+            return
+
+        self._profile.disable()
+        self._remaining -= 1
+
+        profile = self._profile if self._remaining <= 0 else None
+        self._lock.release()
+
+        if profile is not None:
+            self._write(profile.dump_stats, 'pstats')
+
+    def _sample(self, seconds):
+        stacks = Counter()
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+
+        try:
+            while time.monotonic() < deadline:
+                for (thread_id, frame) in sys._current_frames().items():
+                    if thread_id != own_thread:
+                        stacks[self._collapse(frame)] += 1
+
+                time.sleep(self.sample_interval)
+
+            def write(path):
+                with open(path, 'w') as f:
+                    for (stack, count) in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+
+            self._write(write, 'collapsed')
+        finally:
+            self._sampling_lock.release()
+
+    @staticmethod
+    def _collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+
+        return ';'.join(reversed(stack))
+
+    def _write(self, dump, extension):
+        path = os.path.join(self.directory, f"beesly-{os.getpid()}-{int(time.time())}.{extension}")
+
+        try:
+            dump(path)
+        except OSError as err:
+            structured_log(level='error', msg="Failed to write profile", path=path, error=err)
+            return
+
+        structured_log(level='info', msg="Wrote profile", path=path)
@@ -0,0 +1,556 @@
+from contextlib import contextmanager
+from hashlib import blake2b
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from limits.storage import MemcachedStorage, RedisStorage, Storage, storage_from_string
+
+from beesly._logging import structured_log
+
+
+SCRIPT_INCRBY_EXPIRE = """
+    local current = redis.call("incrby", KEYS[1], ARGV[2])
+    if tonumber(current) == tonumber(ARGV[2]) then
+        redis.call("expire", KEYS[1], ARGV[1])
+    end
+    return {current, redis.call("pttl", KEYS[1])}
+"""
+
+
+class _Counter(object):
+    __slots__ = ['remote', 'pending', 'expiry', 'expires_at']
+
+    def __init__(self, expiry):
+        self.remote = 0
+        self.pending = 0
+        self.expiry = expiry
+        self.expires_at = 0
+
+
+class HybridStorage(Storage):
+    """
+    Rate limit storage that counts hits in a per-worker counter in front of a shared
+    Redis or Memcached storage. The first hit on a key in each window is counted
+    remotely, after which hits are counted locally and synced to the remote storage
+    in batches every `sync_interval` seconds. A key is synced immediately once it
+    has `max_delta` unsynced hits, so each worker can overshoot a limit by at most
+    `max_delta` hits per sync. Only the fixed-window strategy is supported.
+
+    The remote storage is selected by the URL with the `hybrid+` prefix removed,
+    e.g. hybrid+redis://localhost:6379 counts hits in redis://localhost:6379.
+
+    Attributes
+    ----------
+    remote : Storage object
+      the shared storage hits are synced to
+
+    sync_interval : float
+      the number of seconds between syncs
+
+    max_delta : integer
+      the number of unsynced hits allowed per key, 0 counts every hit remotely
+
+    statsd : StatsClient object
+      the statsd client used to export sync latency and local and remote hit counts
+    """
+    STORAGE_SCHEME = 'hybrid+memory'
+
+    def __init__(self, uri, sync_interval=0.1, max_delta=10, statsd=None, **options):
+        self.remote = storage_from_string(uri.partition('+')[-1], **options)
+        self.sync_interval = sync_interval
+        self.max_delta = max_delta
+        self.statsd = statsd
+
+        self._counters = {}
+        self._sync_pid = None
+
+        self._lua_incrby_expire = None
+        if isinstance(self.remote, RedisStorage):
+            self._lua_incrby_expire = self.remote.storage.register_script(SCRIPT_INCRBY_EXPIRE)
+
+        super(HybridStorage, self).__init__(uri)
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        """
+        Increments the counter for a rate limit key, returning the number of hits in the current window.
+
+        Arguments
+        ----------
+        key : string
+          the rate limit key to increment
+
+        expiry : integer
+          the number of seconds until the window of the key expires
+        """
+        with self.lock:
+            self._start()
+
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > time.time() and counter.pending < self.max_delta:
+                counter.pending += 1
+                count = counter.remote + counter.pending
+            else:
+                count = None
+
+        if count is not None:
+            self._incr_stat("ratelimit_hybrid_local")
+            return count
+
+        self._incr_stat("ratelimit_hybrid_remote")
+        return self._sync([(key, expiry)], hits=1)[0]
+
+    def get(self, key):
+        """
+        Returns the number of hits on a rate limit key in the current window.
+        """
+        with self.lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > time.time():
+                return counter.remote + counter.pending
+
+        return self.remote.get(key)
+
+    def get_expiry(self, key):
+        """
+        Returns the time at which the current window of a rate limit key expires.
+        """
+        with self.lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter.expires_at > time.time():
+                return counter.expires_at
+
+        return self.remote.get_expiry(key)
+
+    def check(self):
+        """
+        Checks if the remote storage is healthy.
+        """
+        return self.remote.check()
+
+    def reset(self):
+        """
+        Clears the local counters and the remote storage.
+        """
+        with self.lock:
+            self._counters.clear()
+
+        return self.remote.reset()
+
+    def flush(self):
+        """
+        Syncs the unsynced hits of every key to the remote storage and evicts expired counters.
+        """
+        now = time.time()
+
+        with self.lock:
+            for key in [key for (key, counter) in self._counters.items() if counter.expires_at <= now]:
+                del self._counters[key]
+
+            keys = [(key, counter.expiry) for (key, counter) in self._counters.items() if counter.pending > 0]
+
+        if keys:
+            self._sync(keys)
+
+    def _start(self):
+        # the sync thread is started lazily so that each forked gunicorn worker gets its own
+        pid = os.getpid()
+        if self._sync_pid == pid:
+            return
+
+        self._sync_pid = pid
+        self._counters.clear()
+
+        thread = threading.Thread(target=self._run, args=(pid,), daemon=True)
+        thread.start()
+
+    def _run(self, pid):
+        while self._sync_pid == pid:
+            time.sleep(self.sync_interval)
+
+            try:
+                self.flush()
+            except Exception as err:
+                structured_log(level='warning', msg="Failed to sync rate limit counters", error=err)
+
+    def _sync(self, keys, hits=0):
+        now = time.time()
+        deltas = []
+
+        with self.lock:
+            for (key, expiry) in keys:
+                counter = self._counters.get(key)
+                pending = 0
+
+                # hits counted in a window that has since expired are dropped
+                if counter is not None:
+                    if counter.expires_at > now:
+                        pending = counter.pending
+                    counter.pending = 0
+
+                deltas.append((key, expiry, pending + hits))
+
+        try:
+            if self.statsd is not None:
+                with self.statsd.timer("ratelimit_hybrid_sync"):
+                    results = self._remote_incr(deltas, now)
+            else:
+                results = self._remote_incr(deltas, now)
+        except Exception:
+            # unsynced hits are kept so they're retried on the next sync
+            with self.lock:
+                for (key, _, amount) in deltas:
+                    counter = self._counters.get(key)
+                    if counter is not None:
+                        counter.pending += amount - hits
+            raise
+
+        with self.lock:
+            for ((key, expiry, _), (count, expires_at)) in zip(deltas, results):
+                counter = self._counters.get(key)
+                if counter is None:
+                    counter = self._counters[key] = _Counter(expiry)
+
+                counter.remote = count
+                counter.expires_at = expires_at
+
+        return [count for (count, _) in results]
+
+    def _remote_incr(self, deltas, now):
+        results = []
+
+        # all keys are incremented in a single round trip to Redis
+        if self._lua_incrby_expire is not None:
+            pipeline = self.remote.storage.pipeline(transaction=False)
+            for (key, expiry, amount) in deltas:
+                self._lua_incrby_expire(keys=[key], args=[expiry, amount], client=pipeline)
+
+            for (count, ttl) in pipeline.execute():
+                results.append((int(count), now + max(int(ttl), 0) / 1000))
+
+        elif isinstance(self.remote, MemcachedStorage):
+            client = self.remote.storage
+            for (key, expiry, amount) in deltas:
+                if client.add(key, amount, expiry, noreply=False):
+                    client.set(key + "/expires", now + expiry, expire=expiry, noreply=False)
+                    results.append((amount, now + expiry))
+                else:
+                    count = client.incr(key, amount)
+                    expires_at = client.get(key + "/expires")
+                    results.append((int(count or amount), float(expires_at or now + expiry)))
+
+        else:
+            for (key, expiry, amount) in deltas:
+                count = self.remote.get(key)
+                for _ in range(amount):
+                    count = self.remote.incr(key, expiry)
+                results.append((count, self.remote.get_expiry(key)))
+
+        return results
+
+    def _incr_stat(self, stat):
+        if self.statsd is not None:
+            self.statsd.incr(stat)
+
+
+class HybridRedisStorage(HybridStorage):
+    """
+    Hybrid rate limit storage in front of Redis.
+    """
+    STORAGE_SCHEME = 'hybrid+redis'
+
+
+class HybridRedisSSLStorage(HybridStorage):
+    """
+    Hybrid rate limit storage in front of Redis over TLS.
+    """
+    STORAGE_SCHEME = 'hybrid+rediss'
+
+
+class HybridMemcachedStorage(HybridStorage):
+    """
+    Hybrid rate limit storage in front of Memcached.
+    """
+    STORAGE_SCHEME = 'hybrid+memcached'
+
+
+class SharedMemoryStorage(Storage):
+    """
+    Rate limit storage that keeps counters in an anonymous shared memory map, so that
+    all gunicorn workers forked from the same master enforce a single limit. The storage
+    must be created before the workers are forked, i.e. when running gunicorn with --preload.
+
+    The counters are held in a fixed-size hash table divided into stripes, each protected
+    by its own lock. A key is only stored in one of the MAX_PROBE slots following its hash,
+    so that looking it up never scans a whole stripe of expired counters. When those slots
+    are all in use, the counter closest to expiring is evicted.
+    Stripes are locked between processes with a byte-range lock on the file backing the
+    table, which the kernel releases if a worker dies while holding it. If a stripe can't
+    be locked within LOCK_TIMEOUT seconds, the request is allowed.
+    The moving-window strategy is approximated with a sliding window counter, weighting the
+    hits in the previous fixed window by how much of it overlaps the moving window.
+
+    Attributes
+    ----------
+    slots : integer
+      the number of counters the table can hold
+
+    stripes : integer
+      the number of locks the table is divided between
+    """
+    STORAGE_SCHEME = 'shm'
+
+    # fingerprint, expires at, window start, hits in the current window, hits in the previous window
+    SLOT = struct.Struct('<Qddqq')
+
+    LOCK_TIMEOUT = 1
+
+    MAX_PROBE = 16
+
+    def __init__(self, uri=None, slots=65536, stripes=64, **_):
+        self.stripes = max(stripes, 1)
+        self.slots_per_stripe = max(slots // self.stripes, 1)
+        self.slots = self.stripes * self.slots_per_stripe
+
+        # the table is backed by an unlinked file that is shared with child processes after fork
+        self._file = tempfile.TemporaryFile(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self._file.truncate(self.slots * self.SLOT.size)
+        self._table = mmap.mmap(self._file.fileno(), self.slots * self.SLOT.size)
+
+        # byte-range locks are held by a process, so threads of the same process also take a thread lock
+        self._thread_locks = []
+        self._locks_pid = None
+        self._locks_lock = threading.Lock()
+
+        super(SharedMemoryStorage, self).__init__(uri)
+
+    def incr(self, key, expiry, elastic_expiry=False):
+        """
+        Increments the counter for a rate limit key, returning the number of hits in the current window.
+
+        Arguments
+        ----------
+        key : string
+          the rate limit key to increment
+
+        expiry : integer
+          the number of seconds until the window of the key expires
+
+        elastic_expiry : boolean
+          if True, the window is extended by every hit
+        """
+        now = time.time()
+
+        with self._slot(key, now) as (offset, slot):
+            if slot is None:
+                return 0
+
+            (fingerprint, expires_at, window_start, count, _) = slot
+
+            if expires_at <= now:
+                count = 0
+                expires_at = now + expiry
+
+            if elastic_expiry:
+                expires_at = now + expiry
+
+            count += 1
+            self.SLOT.pack_into(self._table, offset, fingerprint, expires_at, window_start, count, 0)
+
+        return count
+
+    def get(self, key):
+        """
+        Returns the number of hits on a rate limit key in the current window.
+        """
+        now = time.time()
+
+        with self._slot(key, now, insert=False) as (_, slot):
+            if slot is None or slot[1] <= now:
+                return 0
+            return slot[3]
+
+    def get_expiry(self, key):
+        """
+        Returns the time at which the current window of a rate limit key expires.
+        """
+        now = time.time()
+
+        with self._slot(key, now, insert=False) as (_, slot):
+            if slot is None or slot[1] <= now:
+                return int(now)
+            return int(slot[1])
+
+    def acquire_entry(self, key, limit, expiry, no_add=False):
+        """
+        Acquires an entry in the moving window of a rate limit key. Returns True if
+        the entry was acquired, or False if the limit has been reached.
+
+        Arguments
+        ----------
+        key : string
+          the rate limit key to acquire an entry in
+
+        limit : integer
+          the number of entries allowed in the moving window
+
+        expiry : integer
+          the length of the moving window in seconds
+
+        no_add : boolean
+          if True, the limit is checked without acquiring an entry
+        """
+        now = time.time()
+
+        with self._slot(key, now) as (offset, slot):
+            if slot is None:
+                return True
+
+            (window_start, count, previous) = self._slide(slot, now, expiry)
+            acquired = self._weighted(window_start, count, previous, now, expiry) < limit
+
+            if acquired and not no_add:
+                count += 1
+                self.SLOT.pack_into(self._table, offset, slot[0], window_start + 2 * expiry, window_start, count, previous)
+
+        return acquired
+
+    def get_moving_window(self, key, limit, expiry):
+        """
+        Returns the start of the current window and the number of entries in the moving window of a rate limit key.
+        """
+        now = time.time()
+
+        with self._slot(key, now, insert=False) as (_, slot):
+            if slot is None:
+                return (int(now), 0)
+
+            (window_start, count, previous) = self._slide(slot, now, expiry)
+
+        return (int(window_start), int(self._weighted(window_start, count, previous, now, expiry)))
+
+    def check(self):
+        """
+        Checks if the storage is healthy, shared memory is always available.
+        """
+        return True
+
+    def reset(self):
+        """
+        Clears all counters. RuntimeError is raised if a stripe can't be locked within LOCK_TIMEOUT seconds.
+        """
+        locked = []
+
+        try:
+            for stripe in range(self.stripes):
+                if not self._lock(stripe):
+                    raise RuntimeError("Timed out waiting for the rate limit storage lock")
+                locked.append(stripe)
+
+            self._table[:] = bytes(len(self._table))
+        finally:
+            for stripe in locked:
+                self._unlock(stripe)
+
+    @staticmethod
+    def _slide(slot, now, expiry):
+        (_, expires_at, window_start, count, previous) = slot
+
+        current_start = now - now % expiry
+        if expires_at <= now or window_start < current_start - expiry:
+            return (current_start, 0, 0)
+
+        if window_start < current_start:
+            return (current_start, 0, count)
+
+        return (window_start, count, previous)
+
+    @staticmethod
+    def _weighted(window_start, count, previous, now, expiry):
+        return previous * (1 - (now - window_start) / expiry) + count
+
+    @contextmanager
+    def _slot(self, key, now, insert=True):
+        """
+        Locks the stripe holding the slot for a key, yielding the offset and contents of the slot.
+        The slot is None if the key isn't in the table and `insert` is False, or if the stripe
+        couldn't be locked.
+        """
+        # the fingerprint is never 0, which marks an empty slot
+        fingerprint = int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        stripe = fingerprint % self.stripes
+        start = (fingerprint // self.stripes) % self.slots_per_stripe
+
+        if not self._lock(stripe):
+            structured_log(level='warning', msg="Timed out waiting for the rate limit storage lock. Allowing request", stripe=stripe)
+            yield (None, None)
+            return
+
+        try:
+            yield self._find(fingerprint, stripe, start, now, insert)
+        finally:
+            self._unlock(stripe)
+
+    def _lock(self, stripe):
+        """
+        Locks a stripe, returning True once it is locked or False after LOCK_TIMEOUT seconds.
+        """
+        # thread locks held by other threads of the parent process are not usable after fork
+        if self._locks_pid != os.getpid():
+            with self._locks_lock:
+                if self._locks_pid != os.getpid():
+                    self._thread_locks = [threading.Lock() for _ in range(self.stripes)]
+                    self._locks_pid = os.getpid()
+
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+
+        thread_lock = self._thread_locks[stripe]
+        if not thread_lock.acquire(timeout=self.LOCK_TIMEOUT):
+            return False
+
+        # the lock is polled so that waiting for it can time out, stripes are held for microseconds
+        delay = 0.00005
+        while True:
+            try:
+                fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+                return True
+            except OSError:
+                if time.monotonic() >= deadline:
+                    thread_lock.release()
+                    return False
+
+                time.sleep(delay)
+                delay = min(delay * 2, 0.005)
+
+    def _unlock(self, stripe):
+        fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN, 1, stripe)
+        self._thread_locks[stripe].release()
+
+    def _find(self, fingerprint, stripe, start, now, insert):
+        base = stripe * self.slots_per_stripe
+        reusable = None
+
+        for i in range(min(self.MAX_PROBE, self.slots_per_stripe)):
+            offset = (base + (start + i) % self.slots_per_stripe) * self.SLOT.size
+            slot = self.SLOT.unpack_from(self._table, offset)
+
+            if slot[0] == fingerprint:
+                return (offset, slot)
+
+            # an empty slot ends the probe, expired slots are probed past so later keys are still found.
+            # slots are never emptied, so a key is always stored before the first empty slot of its probe
+            if reusable is None or slot[1] < reusable[1]:
+                reusable = (offset, slot[1])
+
+            if slot[0] == 0:
+                break
+
+        if not insert:
+            return (None, None)
+
+        # an empty or expired slot is reused, otherwise the counter closest to expiring in the probe is evicted
+        return (reusable[0], (fingerprint, 0.0, 0.0, 0, 0))
@@ -0,0 +1,50 @@
+from flask import Response, jsonify
+
+
+class StaticResponses(object):
+    """
+    Serializes the bodies of responses that don't change once the application is configured,
+    so that they are served as prebuilt bytes instead of being rebuilt and re-serialized on
+    every request. Bodies are built by the functions registered with `body()` when `init_app()`
+    is called, which must happen after every route has been added to the application.
+
+    A body that hasn't been built, eg. when the application isn't configured with create_app(),
+    is built the first time it is requested.
+    """
+    def __init__(self):
+        self._builders = {}
+        self._bodies = {}
+
+    def init_app(self, app):
+        with app.app_context():
+            self._bodies = {name: self._serialize(build) for (name, build) in self._builders.items()}
+
+    def body(self, fn):
+        """
+        Decorator that registers a function returning a response body as a dictionary.
+        The body is served by `response()` under the name of the function.
+        """
+        self._builders[fn.__name__] = fn
+        return fn
+
+    def response(self, name):
+        """
+        Returns a new JSON response with the prebuilt body registered under `name`.
+
+        Arguments
+        ----------
+        name : string
+          the name of the function that builds the body
+        """
+        body = self._bodies.get(name)
+
+        if body is None:
+            body = self._bodies[name] = self._serialize(self._builders[name])
+
+        # responses are modified by after_request handlers, so only the body is shared
+        return Response(body, status=200, mimetype='application/json')
+
+    @staticmethod
+    def _serialize(build):
+        # jsonify() is used so that prebuilt bodies are serialized the same way as every other response
+        return jsonify(build()).get_data()
@@ -0,0 +1,138 @@
+import os
+import socket
+import threading
+import time
+
+from beesly._logging import structured_log
+from beesly.utils import get_ec2_metadata
+
+
+class SystemInfo(object):
+    """
+    Caches information about the system beesly is running on so that /service
+    is served from memory. Facts that don't change are collected once, while the
+    hostname, memory and EC2 metadata are refreshed by a background thread.
+    The EC2 metadata is first looked up by `preload()` when the application is
+    warmed up, so that it is included in each worker's first response. When not running on EC2, the failed metadata lookup is remembered and only
+    retried every `ec2_retry_interval` seconds.
+
+    Attributes
+    ----------
+    refresh_interval : integer
+      the number of seconds between refreshes of the hostname and memory
+
+    ec2_retry_interval : integer
+      the number of seconds to wait before retrying a failed EC2 metadata lookup
+    """
+    def __init__(self, refresh_interval=60, ec2_retry_interval=3600):
+        self.refresh_interval = refresh_interval
+        self.ec2_retry_interval = ec2_retry_interval
+
+        self._system = None
+        self._ec2_metadata = None
+        self._ec2_checked = 0
+        self._session = None
+        self._pid = None
+        self._create_time = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the refresh intervals from the Flask application's configuration.
+        The system facts are collected on first use.
+        """
+        self.refresh_interval = app.config.get('SYSINFO_REFRESH_INTERVAL', self.refresh_interval)
+        self.ec2_retry_interval = app.config.get('EC2_METADATA_RETRY_INTERVAL', self.ec2_retry_interval)
+
+    def preload(self):
+        """
+        Collects the system facts and looks up the EC2 metadata in the calling thread, without
+        starting the refresh thread. With --preload, this is done once in the gunicorn master
+        and the results are inherited by every worker.
+        """
+        with self._lock:
+            self._system = self._collect_system()
+            self._lookup_ec2_metadata()
+
+    def app_uptime(self):
+        """
+        Returns the number of seconds this process has been running.
+        """
+        self._start()
+        return round(time.time() - self._create_time, 3)
+
+    def system(self):
+        """
+        Returns a dictionary containing the hostname, number of processors,
+        total memory and uptime of the system.
+        """
+        self._start()
+
+        system = self._system
+        return {
+            'hostname': system['hostname'],
+            'processors': system['processors'],
+            'memory': system['memory'],
+            'uptime': round(time.time() - system['boot_time'], 3),
+        }
+
+    def ec2_metadata(self):
+        """
+        Returns the cached EC2 metadata or None if not running on EC2.
+        """
+        self._start()
+        return self._ec2_metadata
+
+    def _start(self):
+        # each forked gunicorn worker starts its own refresh thread
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            if self._system is None:
+                self._system = self._collect_system()
+
+            # psutil and requests are imported on first use to keep them off the startup path
+            import psutil
+            import requests
+
+            self._create_time = psutil.Process().create_time()
+            self._session = requests.Session()
+
+            thread = threading.Thread(target=self._refresh, daemon=True)
+            thread.start()
+
+            self._pid = os.getpid()
+
+    def _collect_system(self):
+        import psutil
+
+        return {
+            'hostname': socket.gethostname(),
+            'processors': psutil.cpu_count(),
+            'memory': "{} MB".format(psutil.virtual_memory().total / (1024 * 1024)),
+            'boot_time': psutil.boot_time(),
+        }
+
+    def _refresh(self):
+        while True:
+            try:
+                self._system = self._collect_system()
+            except Exception as err:
+                structured_log(level='warning', msg="Failed to refresh system information", error=err)
+
+            if self._ec2_metadata is None and time.time() - self._ec2_checked >= self.ec2_retry_interval:
+                self._lookup_ec2_metadata(session=self._session)
+
+            time.sleep(max(self.refresh_interval, 1))
+
+    def _lookup_ec2_metadata(self, session=None):
+        self._ec2_checked = time.time()
+
+        try:
+            self._ec2_metadata = get_ec2_metadata(session=session)
+        except Exception:
+            pass
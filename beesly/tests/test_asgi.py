@@ -0,0 +1,134 @@
+import unittest
+import asyncio
+import json
+import os
+import time
+from unittest import mock
+
+from beesly.asgi import AsgiApp
+from beesly.views import app, pam_pool
+from beesly.version import __app__
+
+
+class AsgiAppTests(unittest.TestCase):
+
+    def setUp(self):
+        app.config["APP_NAME"] = __app__
+        app.config["DEV"] = False
+        app.config["PAM_SERVICE"] = "login"
+        app.config["JWT"] = True
+        app.config["JWT_MASTER_KEY"] = "passwordpassword"
+        app.config["JWT_VALIDITY_PERIOD"] = 5
+        app.config["JWT_ALGORITHM"] = "HS256"
+
+        self.asgi = AsgiApp(app)
+        self.loop = asyncio.new_event_loop()
+
+        self.username = os.environ.get("TEST_USERNAME", "vagrant")
+        self.password = os.environ.get("TEST_PASSWORD", "vagrant")
+
+    def tearDown(self):
+        self.loop.close()
+        self.asgi.executor.shutdown()
+        pam_pool.shutdown()
+
+    async def request(self, method, path, body=b''):
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+            'client': ('127.0.0.1', 50000),
+            'server': ('127.0.0.1', 8000),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi(scope, receive, send)
+
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def post_auth(self, username, password):
+        body = json.dumps(dict(username=username, password=password)).encode('utf-8')
+        return self.loop.run_until_complete(self.request('POST', '/auth', body))
+
+    def test_auth_success(self):
+        status, headers, body = self.post_auth(self.username, self.password)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+
+        resp_body = json.loads(body)
+        self.assertEqual(resp_body["message"], 'Authentication successful')
+        self.assertIsNotNone(resp_body["jwt"])
+
+    def test_auth_failure(self):
+        status, _, body = self.post_auth(self.username, self.password + "nc8awdaw")
+
+        self.assertEqual(status, 401)
+        self.assertEqual(json.loads(body)["message"], 'Authentication failed')
+
+    def test_auth_invalid_body(self):
+        status, _, body = self.loop.run_until_complete(self.request('POST', '/auth', b'[]'))
+
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)["error"], 'Request body must be a JSON object')
+
+    def test_sync_routes(self):
+        status, _, body = self.loop.run_until_complete(self.request('GET', '/service/health'))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {__app__: "OK"})
+
+        # requests to /auth that don't match its route are handled by the Flask application
+        status, _, _ = self.loop.run_until_complete(self.request('GET', '/auth'))
+        self.assertEqual(status, app.test_client().get('/auth').status_code)
+
+    def test_concurrent_auth_holds_no_threads(self):
+        def slow_pam(username, password, service):
+            time.sleep(0.2)
+            return True
+
+        self.addCleanup(setattr, pam_pool, 'size', pam_pool.size)
+        self.addCleanup(setattr, pam_pool, 'queue_size', pam_pool.queue_size)
+        pam_pool.size = 8
+        pam_pool.queue_size = 0
+
+        # group lookups share a single thread, PAM authentications wait without holding it
+        app.config["ASGI_THREADS"] = 1
+        self.addCleanup(app.config.pop, "ASGI_THREADS")
+        self.asgi.executor.shutdown()
+        self.asgi = AsgiApp(app)
+
+        body = json.dumps(dict(username=self.username, password="password")).encode('utf-8')
+
+        async def requests():
+            return await asyncio.gather(*[self.request('POST', '/auth', body) for _ in range(8)])
+
+        start = time.monotonic()
+        with mock.patch('beesly.pamauth.pam_authenticate', slow_pam):
+            responses = self.loop.run_until_complete(requests())
+
+        self.assertEqual([status for (status, _, _) in responses], [200] * 8)
+        self.assertLess(time.monotonic() - start, 8 * 0.2)
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        self.loop.run_until_complete(self.asgi({'type': 'lifespan'}, receive, send))
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
@@ -56,3 +56,20 @@ class AuthEndpointTests(unittest.TestCase):
 
         resp_body = json.loads(resp.data)
         self.assertEqual(resp_body["message"], 'No username or password provided')
+
+    def test_auth_endpoint_non_object_body(self):
+        req_body = json.dumps([self.username, self.password])
+        resp = self.app.post('/auth', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+        resp_body = json.loads(resp.data)
+        self.assertEqual(resp_body["error"], 'Request body must be a JSON object')
+
+    def test_auth_endpoint_oversized_body(self):
+        app.config["REQUEST_MAX_BODY_SIZE"] = 64
+
+        req_body = json.dumps(dict(username=self.username, password="x" * 64))
+        resp = self.app.post('/auth', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 413)
+
+        app.config.pop("REQUEST_MAX_BODY_SIZE")
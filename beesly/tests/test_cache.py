@@ -0,0 +1,197 @@
+import unittest
+from unittest import mock
+import threading
+import time
+
+from nacl.hash import blake2b
+
+from beesly.cache import LRUCache, GroupCache, KeyCache, TokenCache
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(max_entries=2)
+
+    def tearDown(self):
+        pass
+
+    def test_get_set(self):
+        self.cache.set("a", 1, time.time() + 60)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_expired_entry_evicted(self):
+        self.cache.set("a", 1, time.time() - 1)
+
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        expires_at = time.time() + 60
+
+        self.cache.set("a", 1, expires_at)
+        self.cache.set("b", 2, expires_at)
+        self.cache.get("a")
+        self.cache.set("c", 3, expires_at)
+
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), 3)
+
+
+class GroupCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.statsd = mock.Mock()
+        self.cache = GroupCache(statsd=self.statsd, ttl=60, stale_ttl=300)
+
+    def tearDown(self):
+        pass
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    def test_group_cache_hit(self, lookup):
+        self.assertEqual(self.cache.get("dwight"), ["Sales"])
+        self.assertEqual(self.cache.get("dwight"), ["Sales"])
+
+        self.assertEqual(lookup.call_count, 1)
+        self.statsd.incr.assert_any_call("group_cache_miss")
+        self.statsd.incr.assert_any_call("group_cache_hit")
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    def test_group_cache_stale_refresh(self, lookup):
+        self.cache.get("dwight")
+
+        # expire the entry without removing it from the stale window
+        self.cache._cache.set("dwight", (["Sales"], time.time() - 1), time.time() + 60)
+        lookup.return_value = ["Sales", "Security"]
+
+        self.assertEqual(self.cache.get("dwight"), ["Sales"])
+        self.statsd.incr.assert_any_call("group_cache_stale")
+
+        for _ in range(100):
+            if not self.cache._refreshing:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.get("dwight"), ["Sales", "Security"])
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    def test_group_cache_refreshes_bounded(self, lookup):
+        self.cache.REFRESH_QUEUE_SIZE = 1
+        users = ["dwight", "jim", "pam", "stanley"]
+
+        for username in users:
+            self.cache._cache.set(username, (["Sales"], time.time() - 1), time.time() + 60)
+
+        # the refresh thread is blocked on the first user while the others are queued
+        refreshing = threading.Event()
+        release = threading.Event()
+
+        def blocked_lookup(username, resolver):
+            refreshing.set()
+            release.wait(5)
+            return ["Sales"]
+
+        lookup.side_effect = blocked_lookup
+
+        self.cache.get("dwight")
+        self.assertTrue(refreshing.wait(5))
+
+        threads = {thread.ident for thread in threading.enumerate()}
+
+        for username in users[1:]:
+            self.cache.get(username)
+
+        self.assertEqual(self.cache._refreshing, {"dwight", "jim"})
+        self.statsd.incr.assert_any_call("group_cache_refresh_dropped")
+        self.assertEqual({thread.ident for thread in threading.enumerate()}, threads)
+
+        release.set()
+
+        for _ in range(100):
+            if not self.cache._refreshing:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(lookup.call_count, 2)
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    def test_group_cache_disabled(self, lookup):
+        self.cache.ttl = 0
+
+        self.cache.get("dwight")
+        self.cache.get("dwight")
+
+        self.assertEqual(lookup.call_count, 2)
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    def test_group_cache_preload(self, lookup):
+        self.cache._cache.max_entries = 2
+
+        self.assertEqual(self.cache.preload(["dwight", "jim", "pam"]), 2)
+
+        self.assertEqual(self.cache.get("jim"), ["Sales"])
+        self.assertEqual(lookup.call_count, 2)
+        self.statsd.incr.assert_called_once_with("group_cache_hit")
+
+
+class KeyCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = KeyCache(max_entries=16)
+        self.master_key = b"passwordpassword"
+        self.salt = b"2soDlgCPC0RFuxR0"
+        self.subject = b"dwight"
+
+    def tearDown(self):
+        pass
+
+    def test_key_cache_matches_derivation(self):
+        expected = blake2b(b'', key=self.master_key, salt=self.salt, person=self.subject).decode('utf-8')
+
+        secret_key = self.cache.get(self.master_key, self.salt, self.subject, time.time() + 60)
+
+        self.assertEqual(secret_key, expected)
+        self.assertEqual(len(self.cache._cache), 1)
+
+    def test_key_cache_skips_expired_tokens(self):
+        self.cache.get(self.master_key, self.salt, self.subject, time.time() - 1)
+
+        self.assertEqual(len(self.cache._cache), 0)
+
+    def test_key_cache_skips_invalid_expiry(self):
+        self.cache.get(self.master_key, self.salt, self.subject, "blah")
+
+        self.assertEqual(len(self.cache._cache), 0)
+
+    def test_key_cache_derive_not_cached(self):
+        secret_key = self.cache.derive(self.master_key, self.salt, self.subject)
+
+        self.assertIsNone(self.cache.lookup(self.master_key, self.salt, self.subject))
+
+        self.cache.set(self.master_key, self.salt, self.subject, secret_key, time.time() + 60)
+        self.assertEqual(self.cache.lookup(self.master_key, self.salt, self.subject), secret_key)
+
+
+class TokenCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.statsd = mock.Mock()
+        self.cache = TokenCache(statsd=self.statsd, max_entries=16)
+
+    def tearDown(self):
+        pass
+
+    def test_token_cache_hit(self):
+        self.cache.set("header.payload.signature", b"dwight", time.time() + 60)
+
+        self.assertEqual(self.cache.get("header.payload.signature"), b"dwight")
+        self.statsd.incr.assert_called_with("token_cache_hit")
+
+    def test_token_cache_expired(self):
+        self.cache.set("header.payload.signature", b"dwight", time.time() - 1)
+
+        self.assertIsNone(self.cache.get("header.payload.signature"))
+        self.statsd.incr.assert_called_with("token_cache_miss")
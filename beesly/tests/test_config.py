@@ -1,15 +1,19 @@
 import unittest
+import ipaddress
 import os
+from unittest import mock
 
 from beesly import create_app
 from beesly.config import initialize_config, ConfigError, StatsdConfig
+from beesly.metrics import BufferedStatsClient
 
 
 class ConfigTests(unittest.TestCase):
 
     def setUp(self):
         env_vars = [
-            "DEV"
+            "DEV",
+            "GROUP_RESOLVER",
             "JWT_ALGORITHM",
             "JWT_MASTER_KEY",
             "JWT_VALIDITY_PERIOD",
@@ -51,6 +55,15 @@ class ConfigTests(unittest.TestCase):
         with self.assertRaises(ConfigError):
             initialize_config()
 
+    def test_invalid_group_resolver(self):
+        os.environ["GROUP_RESOLVER"] = "blah"
+
+        settings = initialize_config()
+
+        self.assertEqual(settings["GROUP_RESOLVER"], "nss")
+
+        del os.environ["GROUP_RESOLVER"]
+
     def test_invalid_rate_limit_strategy(self):
         os.environ["RATELIMIT_STRATEGY"] = "blah"
 
@@ -70,6 +83,19 @@ class ConfigTests(unittest.TestCase):
         with self.assertRaises(ConfigError):
             initialize_config()
 
+    def test_invalid_rate_limit_strategy_storage_hybrid(self):
+        os.environ["RATELIMIT_STRATEGY"] = "moving-window"
+        os.environ["RATELIMIT_STORAGE_URL"] = "hybrid+redis://localhost:6379"
+
+        with self.assertRaises(ConfigError):
+            initialize_config()
+
+    def test_invalid_rate_limit_storage_hybrid_memory(self):
+        os.environ["RATELIMIT_STORAGE_URL"] = "hybrid+memory://"
+
+        with self.assertRaises(ConfigError):
+            initialize_config()
+
     def test_invalid_jwt_master_key(self):
         os.environ["JWT_MASTER_KEY"] = "blah"
 
@@ -93,6 +119,46 @@ class ConfigTests(unittest.TestCase):
 
         self.assertEqual(settings["JWT_ALGORITHM"], "HS256")
 
+    def test_prometheus_without_multiproc_dir(self):
+        os.environ["PROMETHEUS"] = "True"
+        os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+        with self.assertRaises(ConfigError):
+            initialize_config()
+
+        del os.environ["PROMETHEUS"]
+
+    def test_profiler_dir_does_not_exist(self):
+        os.environ["PROFILER_DIR"] = "/nonexistent/profiles"
+
+        with self.assertRaises(ConfigError):
+            initialize_config()
+
+        del os.environ["PROFILER_DIR"]
+
+    def test_healthcheck_source_ranges(self):
+        os.environ["HEALTHCHECK_SOURCE_RANGES"] = "10.0.0.0/8, 192.168.1.10"
+
+        settings = initialize_config()
+
+        self.assertEqual(settings["HEALTHCHECK_SOURCE_RANGES"], [ipaddress.ip_network("10.0.0.0/8"), ipaddress.ip_network("192.168.1.10/32")])
+
+        os.environ["HEALTHCHECK_SOURCE_RANGES"] = "10.0.0.0/33"
+
+        with self.assertRaises(ConfigError):
+            initialize_config()
+
+        del os.environ["HEALTHCHECK_SOURCE_RANGES"]
+
+    def test_log_sample_rates(self):
+        os.environ["LOG_SAMPLE_RATES"] = "JWT successfully verified=0.01,INFO=0.5,error=0.1,blah"
+
+        settings = initialize_config()
+
+        self.assertEqual(settings["LOG_SAMPLE_RATES"], {"JWT successfully verified": 0.01, "info": 0.5})
+
+        del os.environ["LOG_SAMPLE_RATES"]
+
     def test_statsd_config(self):
         os.environ["STATSD_HOST"] = "A B C D"
         os.environ["STATSD_PORT"] = "abcd"
@@ -104,6 +170,23 @@ class ConfigTests(unittest.TestCase):
         self.assertEqual(statsd.port, 8125)
         self.assertEqual(statsd.prefix, "beesly")
 
+    def test_statsd_config_buffered(self):
+        os.environ["STATSD_BUFFERED"] = "True"
+
+        statsd = StatsdConfig()
+
+        self.assertIsInstance(statsd.client, BufferedStatsClient)
+
+        del os.environ["STATSD_BUFFERED"]
+
+    @mock.patch("beesly.config.structured_log")
+    def test_statsd_config_logged_once(self, structured_log):
+        statsd = StatsdConfig()
+        statsd.flush()
+
+        self.assertEqual(structured_log.call_count, 1)
+        self.assertEqual(structured_log.call_args[1]["msg"], "Statsd client configured to export metrics to localhost:8125")
+
 
 class CreateAppTest(unittest.TestCase):
 
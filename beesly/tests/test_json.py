@@ -0,0 +1,43 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from flask import Flask
+
+from beesly import _json
+
+
+class JsonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = {"sub": "dwight", "groups": ["sales", "safety"], "exp": 1520000000.5, "valid": True}
+
+    def test_dumps(self):
+        self.assertEqual(_json.dumps({"b": 1, "a": [1, 2]}), b'{"b":1,"a":[1,2]}')
+        self.assertEqual(_json.dumps({"b": 1, "a": [1, 2]}, sort_keys=True), b'{"a":[1,2],"b":1}')
+
+    def test_dumps_large_integer(self):
+        self.assertEqual(_json.dumps({"a": 2**70}), b'{"a":1180591620717411303424}')
+
+    def test_loads(self):
+        self.assertEqual(_json.loads(_json.dumps(self.obj)), self.obj)
+
+        with self.assertRaises(ValueError):
+            _json.loads(b'{"username": ')
+
+    def test_stdlib_fallback(self):
+        with mock.patch('beesly._json.orjson', None):
+            self.assertEqual(_json.dumps(self.obj), b'{"sub":"dwight","groups":["sales","safety"],"exp":1520000000.5,"valid":true}')
+            self.assertEqual(_json.loads(b'{"a":[1,2]}'), {"a": [1, 2]})
+
+    @unittest.skipIf(_json.DefaultJSONProvider is None, "Flask has no JSON providers")
+    def test_responses_match_default_provider(self):
+        app = Flask(__name__)
+        default = _json.DefaultJSONProvider(app)
+        _json.init_app(app)
+
+        obj = dict(self.obj, issued=datetime(2018, 3, 2, 12, 30))
+
+        with app.app_context():
+            self.assertEqual(app.json.response(obj).get_data(), default.response(obj).get_data())
+            self.assertEqual(app.json.loads(b'{"a":[1,2]}'), {"a": [1, 2]})
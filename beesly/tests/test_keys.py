@@ -0,0 +1,146 @@
+import unittest
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from nacl.encoding import URLSafeBase64Encoder
+from nacl.signing import SigningKey
+
+from beesly import tokens
+from beesly.keys import KeySet
+from beesly.tokens import TokenError
+from beesly.views import app
+
+
+class KeySetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keys_dir = tempfile.mkdtemp()
+
+        for kid in ["2018-02", "2018-03"]:
+            with open(os.path.join(self.keys_dir, f"{kid}.key"), 'wb') as f:
+                f.write(SigningKey.generate().encode(URLSafeBase64Encoder))
+
+        issue_time = time.time()
+        self.claims = {
+            "iss": "beesly",
+            "iat": issue_time,
+            "exp": issue_time + 60,
+            "sub": "dwight",
+            "groups": ["Sales"]
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.keys_dir)
+
+    def test_eddsa_sign_verify(self):
+        keyset = KeySet.load(self.keys_dir, 'EdDSA', '2018-03')
+
+        token = keyset.encode(self.claims)
+        parsed_token = tokens.parse(token)
+
+        self.assertEqual(parsed_token.header, {'alg': 'EdDSA', 'kid': '2018-03', 'typ': 'JWT'})
+        self.assertEqual(keyset.verify(parsed_token, issuer="beesly"), self.claims)
+
+    def test_key_rotation(self):
+        old_keyset = KeySet.load(self.keys_dir, 'EdDSA', '2018-02')
+        new_keyset = KeySet.load(self.keys_dir, 'EdDSA', '2018-03')
+
+        token = old_keyset.encode(self.claims)
+
+        self.assertEqual(new_keyset.verify(tokens.parse(token)), self.claims)
+        self.assertEqual([key["kid"] for key in new_keyset.jwks["keys"]], ["2018-02", "2018-03"])
+
+    def test_unknown_key_id(self):
+        keyset = KeySet.load(self.keys_dir, 'EdDSA', '2018-03')
+        token = keyset.encode(self.claims)
+
+        os.remove(os.path.join(self.keys_dir, "2018-03.key"))
+        with open(os.path.join(self.keys_dir, "2018-04.key"), 'wb') as f:
+            f.write(SigningKey.generate().encode(URLSafeBase64Encoder))
+
+        with self.assertRaises(TokenError):
+            KeySet.load(self.keys_dir, 'EdDSA', '2018-04').verify(tokens.parse(token))
+
+    def test_invalid_signature(self):
+        keyset = KeySet.load(self.keys_dir, 'EdDSA', '2018-03')
+        header, payload, signature = keyset.encode(self.claims).split('.')
+
+        forged_claims = dict(self.claims, groups=["Regional_Manager"])
+        forged_payload = tokens.base64url_encode(json.dumps(forged_claims).encode('utf-8')).decode('utf-8')
+
+        with self.assertRaises(TokenError):
+            keyset.verify(tokens.parse(f"{header}.{forged_payload}.{signature}"))
+
+    def test_missing_active_key(self):
+        with self.assertRaises(ValueError):
+            KeySet.load(self.keys_dir, 'EdDSA', '2018-05')
+
+    def test_es256_sign_verify(self):
+        key_file = os.path.join(self.keys_dir, "ec.key")
+        subprocess.run(['openssl', 'ecparam', '-name', 'prime256v1', '-genkey', '-noout', '-out', key_file], check=True)
+
+        for kid in ["2018-02", "2018-03"]:
+            os.remove(os.path.join(self.keys_dir, f"{kid}.key"))
+
+        keyset = KeySet.load(self.keys_dir, 'ES256', 'ec')
+
+        token = keyset.encode(self.claims)
+
+        self.assertEqual(keyset.verify(tokens.parse(token)), self.claims)
+        self.assertEqual(keyset.jwks["keys"][0]["crv"], "P-256")
+
+
+class JWKSEndpointTests(unittest.TestCase):
+
+    def setUp(self):
+        self.keys_dir = tempfile.mkdtemp()
+
+        with open(os.path.join(self.keys_dir, "2018-03.key"), 'wb') as f:
+            f.write(SigningKey.generate().encode(URLSafeBase64Encoder))
+
+        app.config["DEV"] = False
+        app.config["JWT_SIGNING_KEYS"] = KeySet.load(self.keys_dir, 'EdDSA', '2018-03')
+
+        self.app = app.test_client()
+
+    def tearDown(self):
+        app.config["JWT_SIGNING_KEYS"] = None
+        shutil.rmtree(self.keys_dir)
+
+    def test_jwks_endpoint(self):
+        resp = self.app.get('/.well-known/jwks.json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], 'public, max-age=300')
+
+        resp_body = json.loads(resp.data)
+        self.assertEqual(resp_body["keys"][0]["kid"], "2018-03")
+        self.assertEqual(resp_body["keys"][0]["crv"], "Ed25519")
+
+    def test_jwks_endpoint_disabled(self):
+        app.config["JWT_SIGNING_KEYS"] = None
+
+        resp = self.app.get('/.well-known/jwks.json')
+        self.assertEqual(resp.status_code, 501)
+
+    def test_verify_eddsa_token(self):
+        app.config["JWT"] = True
+        app.config["APP_NAME"] = "beesly"
+        app.config["JWT_VALIDITY_PERIOD"] = 10
+        app.config["PAM_SERVICE"] = "login"
+
+        username = os.environ.get("TEST_USERNAME", "vagrant")
+        password = os.environ.get("TEST_PASSWORD", "vagrant")
+
+        req_body = json.dumps(dict(username=username, password=password))
+        resp = self.app.post('/auth', data=req_body, content_type='application/json')
+        token = json.loads(resp.data)["jwt"]
+
+        self.assertNotIn("x", tokens.parse(token).claims)
+
+        req_body = json.dumps(dict(jwt=token))
+        resp = self.app.post('/verify', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
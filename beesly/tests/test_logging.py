@@ -0,0 +1,122 @@
+import unittest
+import io
+import logging
+import threading
+
+from beesly._logging import APP_LOGGER, KeyValueFormatter, QueueLogHandler, log_sampler, structured_log
+
+
+class StructuredLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        APP_LOGGER.addHandler(self.handler)
+        APP_LOGGER.setLevel(logging.INFO)
+
+    def tearDown(self):
+        APP_LOGGER.removeHandler(self.handler)
+
+    def test_structured_log(self):
+        structured_log(level='warning', msg="Failed to refresh group membership", user="'dwight'", error="timeout")
+
+        self.assertEqual(self.stream.getvalue(), "Failed to refresh group membership\",error=timeout,user='dwight'\n")
+
+    def test_key_value_formatter(self):
+        formatter = logging.Formatter('{"timestamp":"%(asctime)s.%(msecs).03d","loglevel":"%(levelname)s","app":"%(app)s",'
+                                      '"pid":"%(process)d","message":"%(message)s"}', '%Y-%m-%d %H:%M:%S')
+
+        record = logging.LogRecord(APP_LOGGER.name, logging.INFO, __file__, 1, "Booting worker with pid: %s", (1234,), None)
+        record.app = "beesly"
+
+        self.assertEqual(KeyValueFormatter().format(record), formatter.format(record))
+
+    def test_structured_log_below_level(self):
+        APP_LOGGER.setLevel(logging.ERROR)
+
+        structured_log(level='info', msg="Successfully loaded configuration")
+
+        self.assertEqual(self.stream.getvalue(), "")
+
+
+class QueueLogHandlerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueLogHandler(self.stream)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+        self.logger = logging.getLogger('beesly.tests.queue')
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_logs_formatted_by_background_thread(self):
+        threads = []
+
+        class ThreadFormatter(logging.Formatter):
+            def format(self, record):
+                threads.append(threading.current_thread())
+                return super(ThreadFormatter, self).format(record)
+
+        self.handler.setFormatter(ThreadFormatter('%(message)s'))
+
+        self.logger.warning("Rate limit exceeded")
+        self.handler.close()
+
+        self.assertEqual(self.stream.getvalue(), "Rate limit exceeded\n")
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_queued_logs_written_on_close(self):
+        for i in range(100):
+            self.logger.warning(f"log {i}")
+
+        self.handler.close()
+
+        self.assertEqual(len(self.stream.getvalue().splitlines()), 100)
+
+
+class LogSamplerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rates = dict(log_sampler.rates)
+        log_sampler.rates = {"JWT successfully verified": 0, "info": 1}
+        log_sampler.summary_interval = 3600
+        log_sampler.summarize()
+
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        APP_LOGGER.addHandler(self.handler)
+        APP_LOGGER.setLevel(logging.INFO)
+
+    def tearDown(self):
+        log_sampler.rates = self.rates
+        APP_LOGGER.removeHandler(self.handler)
+
+    def test_sampled_by_message(self):
+        for _ in range(5):
+            structured_log(level='info', msg="JWT successfully verified", user="'dwight'")
+        structured_log(level='info', msg="JWT successfully renewed", user="'dwight'")
+
+        self.assertEqual(self.stream.getvalue(), "JWT successfully renewed\",user='dwight'\n")
+
+    def test_warnings_never_sampled(self):
+        log_sampler.rates = {"info": 0, "JWT successfully verified": 0}
+
+        structured_log(level='warning', msg="JWT successfully verified")
+
+        self.assertEqual(self.stream.getvalue(), "JWT successfully verified\n")
+
+    def test_summary(self):
+        for _ in range(3):
+            structured_log(level='info', msg="JWT successfully verified")
+        structured_log(level='info', msg="Failed to verify JWT", error="Signature has expired.")
+
+        log_sampler.summarize()
+
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines[1], "Log summary\",count=3,event='JWT successfully verified',interval=0s,logged=0")
+        self.assertEqual(lines[2], "Log summary\",count=1,errors={'Signature has expired.': 1},event='Failed to verify JWT',interval=0s,logged=1")
@@ -0,0 +1,200 @@
+import unittest
+import importlib.util
+import os
+import shutil
+import socket
+import tempfile
+import time
+from unittest import mock
+
+from flask import Flask
+
+from beesly.metrics import BufferedStatsClient, DeferredStatsClient, RequestMetrics
+from beesly.utils import get_request_json
+
+# prometheus_client isn't imported here, multiprocess mode is enabled if PROMETHEUS_MULTIPROC_DIR is set when it's imported
+prometheus_client = importlib.util.find_spec("prometheus_client")
+
+
+class BufferedStatsClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(1)
+
+        port = self.sock.getsockname()[1]
+        self.client = BufferedStatsClient(host='127.0.0.1', port=port, prefix='beesly', flush_interval=60, max_packet_size=64)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def receive(self):
+        packets = []
+        self.sock.settimeout(0.2)
+        try:
+            while True:
+                packets.append(self.sock.recv(65535).decode('ascii'))
+        except socket.timeout:
+            return packets
+
+    def test_counters_and_gauges_aggregated(self):
+        for _ in range(3):
+            self.client.incr("jwt_verified")
+        self.client.gauge("pam_pool_in_flight", 1)
+        self.client.gauge("pam_pool_in_flight", 2)
+
+        self.client.flush()
+
+        self.assertEqual(self.receive(), ["beesly.jwt_verified:3|c\nbeesly.pam_pool_in_flight:2|g"])
+
+    def test_timers_sent_as_recorded(self):
+        self.client.timing("pam_auth", 1)
+        self.client.timing("pam_auth", 2)
+
+        self.client.flush()
+
+        self.assertEqual(self.receive(), ["beesly.pam_auth:1.000000|ms\nbeesly.pam_auth:2.000000|ms"])
+
+    def test_datagrams_limited_to_max_packet_size(self):
+        for i in range(10):
+            self.client.incr(f"counter{i}")
+
+        self.client.flush()
+
+        packets = self.receive()
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(packet) <= 64 for packet in packets))
+        self.assertEqual(sum(packet.count('\n') + 1 for packet in packets), 10)
+
+    def test_nothing_sent_before_flush(self):
+        self.client.incr("jwt_verified")
+
+        self.assertEqual(self.receive(), [])
+
+
+class DeferredStatsClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(1)
+        self.port = self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_ip_address_used_immediately(self):
+        with mock.patch("beesly.metrics.threading.Thread") as thread:
+            client = DeferredStatsClient(host='127.0.0.1', port=self.port, prefix='beesly')
+            client.incr("auth_success")
+
+        self.assertFalse(thread.called)
+        self.assertEqual(self.sock.recv(65535), b"beesly.auth_success:1|c")
+
+    def test_hostname_resolved_with_retries(self):
+        getaddrinfo = socket.getaddrinfo
+        lookups = []
+
+        def flaky_getaddrinfo(host, *args):
+            lookups.append(host)
+            if len(lookups) < 3:
+                raise socket.gaierror("Temporary failure in name resolution")
+            return getaddrinfo('127.0.0.1', *args)
+
+        with mock.patch("beesly.metrics.socket.getaddrinfo", side_effect=flaky_getaddrinfo):
+            client = DeferredStatsClient(host='statsd.example.com', port=self.port, prefix='beesly', retry_interval=0.01)
+
+            # metrics are dropped until the hostname is resolved
+            client.incr("auth_success")
+
+            for _ in range(100):
+                if client._addr is not None:
+                    break
+                time.sleep(0.01)
+
+        client.incr("auth_failed")
+
+        self.assertEqual(lookups, ['statsd.example.com'] * 3)
+        self.assertEqual(self.sock.recv(65535), b"beesly.auth_failed:1|c")
+
+
+class RequestMetricsTests(unittest.TestCase):
+
+    def test_stage_disabled(self):
+        metrics = RequestMetrics()
+
+        with metrics.stage("pam_auth"):
+            pass
+
+        self.assertFalse(metrics.prometheus)
+
+        # no context manager is created for each stage while metrics are disabled
+        self.assertIs(metrics.stage("pam_auth"), metrics.stage("jwt_decode"))
+
+    def test_server_timing(self):
+        app = Flask(__name__)
+        app.config["SERVER_TIMING"] = True
+
+        @app.before_request
+        def check_rate_limits():
+            with metrics.stage("ratelimit"):
+                get_request_json()
+
+        @app.route("/auth", methods=["POST"])
+        def auth():
+            with metrics.stage("pam_auth"):
+                return "", 200
+
+        statsd = mock.Mock()
+        metrics = RequestMetrics(statsd=statsd)
+        metrics.init_app(app)
+
+        resp = app.test_client().post("/auth", data='{"username": "dwight"}')
+
+        stages = [timing.split(';')[0] for timing in resp.headers['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ["json_parse", "ratelimit", "pam_auth", "total"])
+
+        timers = [c[0][0] for c in statsd.timing.call_args_list]
+        self.assertEqual(timers, ["stage_json_parse", "stage_ratelimit", "stage_pam_auth"])
+
+    def test_server_timing_disabled(self):
+        app = Flask(__name__)
+
+        @app.route("/auth", methods=["POST"])
+        def auth():
+            return "", 200
+
+        RequestMetrics().init_app(app)
+
+        resp = app.test_client().post("/auth")
+
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    @unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+    def test_metrics_endpoint(self):
+        multiproc_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, multiproc_dir)
+
+        environ = mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": multiproc_dir})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        app = Flask(__name__)
+        app.config["PROMETHEUS"] = True
+
+        @app.route("/verify", methods=["POST"])
+        def verify():
+            with metrics.stage("jwt_decode"):
+                return "", 200
+
+        metrics = RequestMetrics()
+        metrics.init_app(app)
+
+        client = app.test_client()
+        client.post("/verify")
+
+        body = client.get("/metrics").data.decode('utf-8')
+
+        self.assertIn('beesly_requests_total{endpoint="/verify",method="POST",status="200"} 1.0', body)
+        self.assertIn('beesly_stage_duration_seconds_count{stage="jwt_decode"} 1.0', body)
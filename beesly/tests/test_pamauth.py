@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+import threading
+import time
+
+from beesly.pamauth import PamPool, PamPoolFullError, PamTimeoutError, get_pam_handle
+
+
+class PamPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.statsd = mock.Mock()
+        self.pool = PamPool(statsd=self.statsd, size=1, queue_size=0, timeout=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    @mock.patch("beesly.pamauth.pam_authenticate", return_value=True)
+    def test_pam_pool_authenticate(self, authenticate):
+        self.assertTrue(self.pool.authenticate("dwight", "beets", "login"))
+
+        authenticate.assert_called_once_with("dwight", "beets", "login")
+        self.statsd.gauge.assert_any_call("pam_pool_in_flight", 1)
+
+    @mock.patch("beesly.pamauth.pam_authenticate", return_value=False)
+    def test_pam_pool_inline(self, authenticate):
+        self.pool.size = 0
+
+        self.assertFalse(self.pool.authenticate("dwight", "beets", "login"))
+        self.statsd.gauge.assert_not_called()
+
+    def test_pam_pool_timeout(self):
+        release = threading.Event()
+        self.pool.timeout = 0.05
+
+        with mock.patch("beesly.pamauth.pam_authenticate", side_effect=lambda *args: release.wait()):
+            with self.assertRaises(PamTimeoutError):
+                self.pool.authenticate("dwight", "beets", "login")
+
+            # the timed out authentication still occupies the only slot in the pool
+            with self.assertRaises(PamPoolFullError):
+                self.pool.authenticate("dwight", "beets", "login")
+
+            release.set()
+
+            for _ in range(100):
+                if self.pool._pending == 0:
+                    break
+                time.sleep(0.01)
+
+        self.assertEqual(self.pool._pending, 0)
+
+
+class PamHandleTests(unittest.TestCase):
+
+    def test_pam_handle_reused(self):
+        self.assertIs(get_pam_handle("login"), get_pam_handle("login"))
+
+    def test_pam_handle_per_service(self):
+        self.assertIsNot(get_pam_handle("login"), get_pam_handle("other"))
+
+    def test_pam_handle_per_thread(self):
+        handles = []
+        thread = threading.Thread(target=lambda: handles.append(get_pam_handle("login")))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(handles[0], get_pam_handle("login"))
@@ -0,0 +1,103 @@
+import unittest
+import os
+import os.path
+import pstats
+import shutil
+import signal
+import tempfile
+import time
+
+from flask import Flask
+
+from beesly.profiler import Profiler
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        self.app = Flask(__name__)
+        self.app.config["PROFILER_DIR"] = self.directory
+        self.app.config["PROFILER_SAMPLE_INTERVAL"] = 0.001
+
+        @self.app.route("/auth", methods=["POST"])
+        def auth():
+            return "", 200
+
+        self.profiler = Profiler()
+        self.profiler.init_app(self.app)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for_profile(self, extension):
+        for _ in range(100):
+            profiles = [f for f in os.listdir(self.directory) if f.endswith(extension)]
+            if profiles:
+                return os.path.join(self.directory, profiles[0])
+            time.sleep(0.05)
+
+        self.fail(f"No {extension} profile was written")
+
+    def test_profile_requests(self):
+        client = self.app.test_client()
+
+        self.assertTrue(self.profiler.profile_requests(2))
+        self.assertFalse(self.profiler.profile_requests(2))
+
+        client.post("/auth")
+        self.assertEqual(os.listdir(self.directory), [])
+
+        client.post("/auth")
+        stats = pstats.Stats(self.wait_for_profile('.pstats'))
+
+        self.assertTrue(any(func[2] == 'auth' for func in stats.stats))
+
+    def test_profile_seconds(self):
+        self.assertTrue(self.profiler.profile_seconds(0.1))
+        self.assertFalse(self.profiler.profile_seconds(0.1))
+
+        with open(self.wait_for_profile('.collapsed')) as f:
+            stacks = [line.rsplit(' ', 1) for line in f.read().splitlines()]
+
+        # threads started by other tests are sampled too, so the test's stack may not be the most frequent
+        self.assertTrue(all(int(count) > 0 for (_, count) in stacks))
+        self.assertTrue(any('wait_for_profile' in stack for (stack, _) in stacks))
+
+    def test_signal_handler(self):
+        self.profiler.mode = 'requests'
+        self.profiler.install_signal_handler()
+        self.addCleanup(signal.signal, signal.SIGUSR2, signal.SIG_DFL)
+
+        os.kill(os.getpid(), signal.SIGUSR2)
+
+        self.assertFalse(self.profiler.profile_requests(1))
+
+    def test_endpoint_dev_only(self):
+        resp = self.app.test_client().post("/service/profile")
+        self.assertEqual(resp.status_code, 404)
+
+        app = Flask(__name__)
+        app.config["DEV"] = True
+        app.config["PROFILER_DIR"] = self.directory
+        Profiler().init_app(app)
+
+        client = app.test_client()
+
+        resp = client.post("/service/profile", data='{"mode": "requests", "requests": 5}')
+        self.assertEqual(resp.status_code, 202)
+
+        resp = client.post("/service/profile", data='{"mode": "requests"}')
+        self.assertEqual(resp.status_code, 409)
+
+        resp = client.post("/service/profile", data='{"mode": "tracing"}')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_disabled(self):
+        app = Flask(__name__)
+        app.config["DEV"] = True
+        Profiler().init_app(app)
+
+        resp = app.test_client().post("/service/profile")
+        self.assertEqual(resp.status_code, 404)
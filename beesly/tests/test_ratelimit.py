@@ -0,0 +1,195 @@
+import unittest
+import os
+import signal
+import time
+from unittest import mock
+
+from limits.storage import MemoryStorage, storage_from_string
+
+from beesly.ratelimit import HybridStorage
+
+
+class HybridStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.statsd = mock.MagicMock()
+        self.storage = storage_from_string("hybrid+memory://", sync_interval=60, max_delta=5, statsd=self.statsd)
+
+    def tearDown(self):
+        self.storage.reset()
+
+    def test_remote_storage_from_url(self):
+        self.assertIsInstance(self.storage, HybridStorage)
+        self.assertIsInstance(self.storage.remote, MemoryStorage)
+
+    def test_hits_counted_locally_after_first_hit(self):
+        for i in range(1, 4):
+            self.assertEqual(self.storage.incr("key", 60), i)
+
+        self.assertEqual(self.storage.get("key"), 3)
+        self.assertEqual(self.storage.remote.get("key"), 1)
+
+        stats = [c[0][0] for c in self.statsd.incr.call_args_list]
+        self.assertEqual(stats, ["ratelimit_hybrid_remote", "ratelimit_hybrid_local", "ratelimit_hybrid_local"])
+
+    def test_flush_syncs_pending_hits(self):
+        for _ in range(3):
+            self.storage.incr("key", 60)
+
+        self.storage.flush()
+
+        self.assertEqual(self.storage.remote.get("key"), 3)
+        self.assertEqual(self.storage.get("key"), 3)
+        self.assertTrue(self.statsd.timer.called)
+
+    def test_max_delta_syncs_immediately(self):
+        for _ in range(7):
+            count = self.storage.incr("key", 60)
+
+        # the first hit and the hit after 5 unsynced hits were counted remotely
+        self.assertEqual(count, 7)
+        self.assertEqual(self.storage.remote.get("key"), 7)
+
+    def test_remote_hits_from_other_workers(self):
+        self.storage.incr("key", 60)
+        self.storage.remote.incr("key", 60)
+        self.storage.incr("key", 60)
+
+        self.storage.flush()
+
+        self.assertEqual(self.storage.get("key"), 3)
+
+    def test_zero_max_delta_counts_every_hit_remotely(self):
+        self.storage.max_delta = 0
+
+        for _ in range(3):
+            self.storage.incr("key", 60)
+
+        self.assertEqual(self.storage.remote.get("key"), 3)
+
+
+class SharedMemoryStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = storage_from_string("shm://", slots=64, stripes=4)
+
+    def tearDown(self):
+        pass
+
+    def test_fixed_window(self):
+        for i in range(1, 4):
+            self.assertEqual(self.storage.incr("key", 60), i)
+
+        self.assertEqual(self.storage.get("key"), 3)
+        self.assertEqual(self.storage.get("other"), 0)
+        self.assertGreater(self.storage.get_expiry("key"), time.time() + 58)
+
+    def test_fixed_window_expired(self):
+        self.storage.incr("key", 60)
+
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(self.storage.get("key"), 0)
+            self.assertEqual(self.storage.incr("key", 60), 1)
+
+    def test_counters_shared_with_child_process(self):
+        self.storage.incr("key", 60)
+
+        pid = os.fork()
+        if pid == 0:
+            self.storage.incr("key", 60)
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        self.assertEqual(self.storage.get("key"), 2)
+
+    def test_lock_released_when_holder_dies(self):
+        self.storage.incr("key", 60)
+        self.storage.LOCK_TIMEOUT = 0.1
+
+        read_fd, write_fd = os.pipe()
+
+        # the child locks every stripe and is killed without releasing them
+        pid = os.fork()
+        if pid == 0:
+            for stripe in range(self.storage.stripes):
+                self.storage._lock(stripe)
+            os.write(write_fd, b'x')
+            time.sleep(60)
+            os._exit(0)
+
+        os.read(read_fd, 1)
+
+        # requests are allowed while the stripe is locked
+        self.assertEqual(self.storage.incr("key", 60), 0)
+        self.assertTrue(self.storage.acquire_entry("key", 1, 60))
+
+        with self.assertRaises(RuntimeError):
+            self.storage.reset()
+
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(self.storage.incr("key", 60), 2)
+
+    def test_moving_window(self):
+        for _ in range(3):
+            self.assertTrue(self.storage.acquire_entry("key", 3, 60))
+
+        self.assertFalse(self.storage.acquire_entry("key", 3, 60))
+        self.assertEqual(self.storage.get_moving_window("key", 3, 60)[1], 3)
+
+    def test_moving_window_weights_previous_window(self):
+        now = 6000.0
+
+        with mock.patch('time.time', return_value=now):
+            for _ in range(4):
+                self.storage.acquire_entry("key", 4, 60)
+
+        # half of the previous window overlaps the moving window
+        with mock.patch('time.time', return_value=now + 90):
+            self.assertEqual(self.storage.get_moving_window("key", 4, 60), (6060, 2))
+            self.assertTrue(self.storage.acquire_entry("key", 4, 60))
+            self.assertTrue(self.storage.acquire_entry("key", 4, 60))
+            self.assertFalse(self.storage.acquire_entry("key", 4, 60))
+
+    def test_full_stripe_evicts_counter_closest_to_expiring(self):
+        storage = storage_from_string("shm://", slots=16, stripes=1)
+
+        for i in range(16):
+            storage.incr(f"key{i}", 60 + i)
+
+        storage.incr("new", 600)
+
+        self.assertEqual(storage.get("new"), 1)
+        self.assertEqual(storage.get("key0"), 0)
+        self.assertEqual(sum(storage.get(f"key{i}") for i in range(1, 16)), 15)
+
+    def test_probe_bounded_after_counters_expire(self):
+        storage = storage_from_string("shm://", slots=256, stripes=1)
+        slot_struct = storage.SLOT
+        now = 6000.0
+
+        # every slot is filled, so probes for keys that aren't in the table only end at MAX_PROBE
+        with mock.patch('time.time', return_value=now):
+            for i in range(4096):
+                storage.incr(f"key{i}", 60)
+
+        self.assertTrue(all(storage.SLOT.unpack_from(storage._table, i * storage.SLOT.size)[0] for i in range(256)))
+
+        with mock.patch('time.time', return_value=now + 61), mock.patch.object(storage, 'SLOT') as slot:
+            slot.size = slot_struct.size
+            slot.unpack_from.side_effect = slot_struct.unpack_from
+            slot.pack_into.side_effect = slot_struct.pack_into
+
+            self.assertEqual(storage.get("new"), 0)
+            self.assertEqual(storage.incr("new", 60), 1)
+            self.assertEqual(storage.get("new"), 1)
+
+        self.assertLessEqual(slot.unpack_from.call_count, 3 * storage.MAX_PROBE)
+
+    def test_reset(self):
+        self.storage.incr("key", 60)
+        self.storage.reset()
+
+        self.assertEqual(self.storage.get("key"), 0)
@@ -1,7 +1,14 @@
 import unittest
+from unittest import mock
+import ipaddress
 import json
+import time
 
-from beesly.views import app
+from flask import Flask
+
+from beesly.responses import StaticResponses
+from beesly.sysinfo import SystemInfo
+from beesly.views import app, exempt_health_checks, system_info
 from beesly.version import __app__, __version__
 
 
@@ -39,6 +46,65 @@ class ServiceEndpointsTests(unittest.TestCase):
         resp_body = json.loads(resp.data)
         self.assertEqual(resp_body["beesly"], 'OK')
 
+    def test_static_responses_built_once(self):
+        responses = StaticResponses()
+        build = mock.Mock(return_value={"app": "beesly"})
+        build.__name__ = "build"
+        responses.body(build)
+
+        responses.init_app(Flask(__name__))
+
+        for _ in range(3):
+            resp = responses.response("build")
+
+            self.assertEqual(resp.mimetype, "application/json")
+            self.assertEqual(json.loads(resp.get_data()), {"app": "beesly"})
+
+        self.assertEqual(build.call_count, 1)
+
+    def test_health_check_source_ranges_exempt(self):
+        app.config["HEALTHCHECK_SOURCE_RANGES"] = [ipaddress.ip_network("10.0.0.0/8")]
+        self.addCleanup(app.config.pop, "HEALTHCHECK_SOURCE_RANGES")
+
+        with app.test_request_context('/service/health', environ_base={'REMOTE_ADDR': '10.1.2.3'}):
+            self.assertTrue(exempt_health_checks())
+
+        with app.test_request_context('/service/health', environ_base={'REMOTE_ADDR': '192.168.1.1'}):
+            self.assertFalse(exempt_health_checks())
+
+        with app.test_request_context('/service/version', environ_base={'REMOTE_ADDR': '10.1.2.3'}):
+            self.assertFalse(exempt_health_checks())
+
     def test_nonexistant_endpoint(self):
         resp = self.app.get('/service/bar')
         self.assertEqual(resp.status_code, 404)
+
+    def test_service_endpoint_cached(self):
+        resp = self.app.get('/service')
+        resp_body = json.loads(resp.data)
+
+        self.assertEqual(resp_body["system"]["processors"], system_info.system()["processors"])
+        self.assertGreater(resp_body["app"]["uptime"], 0)
+
+    @mock.patch("beesly.sysinfo.get_ec2_metadata", side_effect=Exception("not running on EC2"))
+    def test_ec2_metadata_negative_result(self, get_ec2_metadata):
+        info = SystemInfo(refresh_interval=1, ec2_retry_interval=3600)
+
+        self.assertIsNone(info.ec2_metadata())
+
+        for _ in range(100):
+            if get_ec2_metadata.called:
+                break
+            time.sleep(0.01)
+
+        self.assertIsNone(info.ec2_metadata())
+        self.assertEqual(get_ec2_metadata.call_count, 1)
+
+    @mock.patch("beesly.sysinfo.get_ec2_metadata", return_value={"region": "us-east-1"})
+    def test_ec2_metadata_preloaded(self, get_ec2_metadata):
+        info = SystemInfo(refresh_interval=1, ec2_retry_interval=3600)
+        info.preload()
+
+        self.assertIsNone(info._pid)
+        self.assertEqual(info.ec2_metadata(), {"region": "us-east-1"})
+        self.assertEqual(get_ec2_metadata.call_count, 1)
@@ -0,0 +1,69 @@
+import unittest
+import time
+
+from jose import jwt as jose_jwt
+
+from beesly import tokens
+from beesly.tokens import TokenError
+
+
+class TokensTests(unittest.TestCase):
+
+    def setUp(self):
+        issue_time = time.time()
+
+        self.key = "2fb0a9fb6a4bd4d9d2bd1e3c6a2b8a8c"
+        self.claims = {
+            "iss": "beesly",
+            "iat": issue_time,
+            "exp": issue_time + 60,
+            "sub": "dwight",
+            "groups": ["Sales"],
+            "x": "2soDlgCPC0RFuxR0"
+        }
+
+    def tearDown(self):
+        pass
+
+    def test_encode_matches_jose(self):
+        for algorithm in ["HS256", "HS384", "HS512"]:
+            expected = jose_jwt.encode(claims=self.claims, key=self.key, algorithm=algorithm)
+
+            self.assertEqual(tokens.encode(self.claims, self.key, algorithm=algorithm), expected)
+
+    def test_decode_jose_token(self):
+        token = jose_jwt.encode(claims=self.claims, key=self.key, algorithm="HS384")
+
+        claims = tokens.decode(token, self.key, algorithms="HS384", issuer="beesly")
+
+        self.assertEqual(claims, self.claims)
+
+    def test_decode_invalid_signature(self):
+        token = tokens.encode(self.claims, "notthepassword")
+
+        with self.assertRaises(TokenError):
+            tokens.decode(token, self.key, algorithms="HS256")
+
+    def test_decode_disallowed_algorithm(self):
+        token = tokens.encode(self.claims, self.key, algorithm="HS512")
+
+        with self.assertRaises(TokenError):
+            tokens.decode(token, self.key, algorithms="HS256")
+
+    def test_decode_expired(self):
+        self.claims["exp"] = time.time() - 1
+        token = tokens.encode(self.claims, self.key)
+
+        with self.assertRaises(TokenError):
+            tokens.decode(token, self.key, algorithms="HS256")
+
+    def test_decode_invalid_issuer(self):
+        token = tokens.encode(self.claims, self.key)
+
+        with self.assertRaises(TokenError):
+            tokens.decode(token, self.key, algorithms="HS256", issuer="notbeesly")
+
+    def test_parse_invalid_token(self):
+        for token in ["INVALID", "a.b.c", 1234, None]:
+            with self.assertRaises(TokenError):
+                tokens.parse(token)
@@ -0,0 +1,64 @@
+import unittest
+import os
+from unittest import mock
+
+from beesly.utils import find_executable, get_group_membership, get_request_ip_username, validate_username
+from beesly.views import app
+
+
+class GroupMembershipTests(unittest.TestCase):
+
+    def setUp(self):
+        self.username = os.environ.get("TEST_USERNAME", "vagrant")
+
+    def tearDown(self):
+        pass
+
+    def test_group_membership_resolvers_match(self):
+        nss_groups = get_group_membership(self.username, resolver='nss')
+        id_groups = get_group_membership(self.username, resolver='id')
+
+        self.assertEqual(nss_groups, id_groups)
+
+    def test_group_membership_excludes_user_private_group(self):
+        groups = get_group_membership(self.username)
+
+        self.assertNotIn(self.username, groups)
+
+    def test_group_membership_unknown_user(self):
+        groups = get_group_membership("doesnotexist9f3a", resolver='nss')
+
+        self.assertEqual(groups, [])
+
+
+class ValidateUsernameTests(unittest.TestCase):
+
+    def test_valid_username(self):
+        self.assertTrue(validate_username("dwight.schrute@dundermifflin.com"))
+
+    def test_invalid_username(self):
+        self.assertFalse(validate_username("dwight schrute"))
+
+
+class RequestIpUsernameTests(unittest.TestCase):
+
+    def test_key_includes_valid_username(self):
+        with app.test_request_context('/auth', method='POST', data='{"username": "dwight"}',
+                                      environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+            self.assertEqual(get_request_ip_username(), '10.0.0.1/dwight')
+
+    def test_key_excludes_invalid_username(self):
+        with app.test_request_context('/auth', method='POST', data='{"username": "dwight schrute"}',
+                                      environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+            self.assertEqual(get_request_ip_username(), '10.0.0.1/')
+
+
+class FindExecutableTests(unittest.TestCase):
+
+    @mock.patch.dict("beesly.utils._executables", clear=True)
+    @mock.patch("beesly.utils.shutil.which", return_value="/usr/bin/id")
+    def test_path_is_cached(self, which):
+        self.assertEqual(find_executable("id"), "/usr/bin/id")
+        self.assertEqual(find_executable("id"), "/usr/bin/id")
+
+        self.assertEqual(which.call_count, 1)
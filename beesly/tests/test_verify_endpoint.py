@@ -4,7 +4,8 @@ import os
 
 from jose import jwt
 
-from beesly.views import app
+from beesly import tokens
+from beesly.views import app, key_cache, token_cache
 from beesly.version import __app__
 
 
@@ -48,6 +49,32 @@ class VerifyEndpointTests(unittest.TestCase):
         resp_body = json.loads(resp.data)
         self.assertEqual(resp_body["message"], 'JWT successfully verified')
 
+    def test_verify_endpoint_cached(self):
+        req_body = json.dumps(dict(jwt=self.token, username=self.username))
+        self.app.post('/verify', data=req_body, content_type='application/json')
+
+        self.assertIsNotNone(token_cache.get(self.token))
+
+        resp = self.app.post('/verify', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+
+        resp_body = json.loads(resp.data)
+        self.assertEqual(resp_body["message"], 'JWT successfully verified')
+
+    def test_verify_endpoint_without_expiry(self):
+        salt = b'bm9leHBpcnlzYWx0'
+        claims = dict(iss=__app__, sub=self.username, x=salt.decode('utf-8'))
+
+        secret_key = key_cache.get(app.config["JWT_MASTER_KEY"], salt, self.username.encode('utf-8'), None)
+        token = tokens.encode(claims=claims, key=secret_key, algorithm="HS256")
+
+        req_body = json.dumps(dict(jwt=token))
+        resp = self.app.post('/verify', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+
+        # JWTs without an expiry time are never cached
+        self.assertIsNone(token_cache.get(token))
+
     def test_verify_endpoint_failure(self):
 
         claims = jwt.get_unverified_claims(self.token)
@@ -60,6 +87,19 @@ class VerifyEndpointTests(unittest.TestCase):
         resp_body = json.loads(resp.data)
         self.assertEqual(resp_body["message"], 'Failed to verify JWT')
 
+    def test_verify_endpoint_failure_not_cached(self):
+        salt = b'Zm9yZ2VkdG9rZW5zYWx0'
+        claims = jwt.get_unverified_claims(self.token)
+        claims["x"] = salt.decode('utf-8')
+        new_token = jwt.encode(claims=claims, key='notthepassword', algorithm=app.config["JWT_ALGORITHM"])
+
+        req_body = json.dumps(dict(jwt=new_token, username=self.username))
+        resp = self.app.post('/verify', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 401)
+
+        # keys are only cached once the signature of a JWT is verified
+        self.assertIsNone(key_cache.lookup(app.config["JWT_MASTER_KEY"], salt, self.username.encode('utf-8')))
+
     def test_verify_endpoint_invalid_token(self):
         req_body = json.dumps(dict(jwt="INVALID", username=self.username))
         resp = self.app.post('/verify', data=req_body, content_type='application/json')
@@ -88,3 +128,28 @@ class VerifyEndpointTests(unittest.TestCase):
 
         resp_body = json.loads(resp.data)
         self.assertEqual(resp_body["message"], 'No JWT provided')
+
+    def test_verify_batch_endpoint_success(self):
+        req_body = json.dumps(dict(jwts=[self.token, "INVALID", self.token]))
+        resp = self.app.post('/verify/batch', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+
+        resp_body = json.loads(resp.data)
+        self.assertEqual([result["valid"] for result in resp_body["results"]], [True, False, True])
+        self.assertEqual(resp_body["results"][1]["message"], 'Invalid JWT')
+
+    def test_verify_batch_endpoint_missing_tokens(self):
+        req_body = json.dumps(dict(jwt=self.token))
+        resp = self.app.post('/verify/batch', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+        resp_body = json.loads(resp.data)
+        self.assertEqual(resp_body["message"], 'No JWTs provided')
+
+    def test_verify_batch_endpoint_too_many_tokens(self):
+        app.config["VERIFY_BATCH_MAX_SIZE"] = 2
+        self.addCleanup(app.config.pop, "VERIFY_BATCH_MAX_SIZE")
+
+        req_body = json.dumps(dict(jwts=[self.token] * 3))
+        resp = self.app.post('/verify/batch', data=req_body, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
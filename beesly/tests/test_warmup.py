@@ -0,0 +1,47 @@
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from beesly.views import app, group_cache
+from beesly.version import __app__
+from beesly.warmup import warm_up
+
+
+Passwd = namedtuple('Passwd', ['pw_name'])
+
+
+class WarmUpTests(unittest.TestCase):
+
+    def setUp(self):
+        app.config["APP_NAME"] = __app__
+        app.config["JWT"] = True
+        app.config["JWT_MASTER_KEY"] = b"passwordpassword"
+        app.config["JWT_ALGORITHM"] = "HS256"
+        app.config["WARMUP_GROUPS"] = False
+
+        group_cache._cache.clear()
+
+        get_ec2_metadata = mock.patch("beesly.sysinfo.get_ec2_metadata", side_effect=Exception("not running on EC2"))
+        get_ec2_metadata.start()
+        self.addCleanup(get_ec2_metadata.stop)
+
+    def tearDown(self):
+        group_cache._cache.clear()
+        app.config.pop("WARMUP_GROUPS")
+
+    def test_warm_up(self):
+        with mock.patch("beesly.warmup.structured_log") as log:
+            warm_up(app)
+
+        self.assertEqual(log.call_args[1]["cached_groups"], 0)
+        self.assertEqual(len(group_cache._cache), 0)
+
+    @mock.patch("beesly.cache.get_group_membership", return_value=["Sales"])
+    @mock.patch("beesly.warmup.pwd.getpwall", return_value=[Passwd("dwight"), Passwd("jim"), Passwd("_invalid")])
+    def test_warm_up_groups(self, getpwall, lookup):
+        app.config["WARMUP_GROUPS"] = True
+
+        warm_up(app)
+
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(group_cache.get("dwight"), ["Sales"])
@@ -0,0 +1,240 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+import hashlib
+import hmac
+import time
+
+from beesly import _json
+
+
+ALGORITHMS = {
+    'HS256': 'sha256',
+    'HS384': 'sha384',
+    'HS512': 'sha512',
+}
+
+
+class TokenError(Exception):
+    """
+    Exception raised when a JWT is malformed or fails verification.
+    """
+
+
+Token = namedtuple('Token', ['header', 'claims', 'signing_input', 'signature'])
+
+
+def base64url_encode(data):
+    """
+    Returns the unpadded base64url encoding of the bytes.
+    """
+    return urlsafe_b64encode(data).rstrip(b'=')
+
+
+def base64url_decode(data):
+    """
+    Returns the bytes decoded from unpadded base64url encoded bytes.
+    """
+    return urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _encode_header(algorithm):
+    return base64url_encode(_json.dumps({'alg': algorithm, 'typ': 'JWT'}, sort_keys=True))
+
+
+# the header is identical for every JWT signed with an algorithm, so it's only encoded once
+HEADERS = {algorithm: _encode_header(algorithm) for algorithm in ALGORITHMS}
+
+
+if hasattr(hmac, 'digest'):
+    def _sign(key, msg, digest):
+        return hmac.digest(key, msg, digest)
+else:
+    def _sign(key, msg, digest):
+        return hmac.new(key, msg, getattr(hashlib, digest)).digest()
+
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return key.encode('utf-8')
+    return key
+
+
+def encode(claims, key, algorithm='HS256'):
+    """
+    Returns a JWT containing the claims signed with HMAC. The JWT is byte-for-byte
+    identical to the one python-jose generates for the same claims and key, unless
+    the claims contain non-ASCII characters, which orjson doesn't escape.
+
+    Arguments
+    ----------
+    claims : dict
+      the claims to include in the JWT
+
+    key : string or bytes
+      the secret key used to sign the JWT
+
+    algorithm : string
+      the HMAC algorithm to sign the JWT with, one of HS256, HS384 or HS512
+    """
+    try:
+        digest = ALGORITHMS[algorithm]
+    except KeyError:
+        raise TokenError(f"Algorithm not supported: {algorithm}")
+
+    payload = base64url_encode(_json.dumps(claims))
+    signing_input = HEADERS[algorithm] + b'.' + payload
+    signature = base64url_encode(_sign(_encode_key(key), signing_input, digest))
+
+    return (signing_input + b'.' + signature).decode('utf-8')
+
+
+def parse(token):
+    """
+    Parses a JWT without verifying it. Returns a Token containing the header,
+    the claims, the signed portion of the JWT and the signature.
+    TokenError is raised if the JWT is malformed.
+
+    Arguments
+    ----------
+    token : string
+      the JWT to parse
+    """
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+
+    if not isinstance(token, bytes):
+        raise TokenError("Invalid JWT")
+
+    try:
+        signing_input, signature = token.rsplit(b'.', 1)
+        header_segment, claims_segment = signing_input.split(b'.', 1)
+    except ValueError:
+        raise TokenError("Not enough segments")
+
+    try:
+        # tokens issued by beesly have a known header, so decoding it can be skipped
+        for algorithm, encoded_header in HEADERS.items():
+            if header_segment == encoded_header:
+                header = {'alg': algorithm, 'typ': 'JWT'}
+                break
+        else:
+            header = _json.loads(base64url_decode(header_segment))
+
+        claims = _json.loads(base64url_decode(claims_segment))
+        signature = base64url_decode(signature)
+    except (ValueError, TypeError):
+        raise TokenError("Invalid JWT encoding")
+
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise TokenError("Invalid JWT encoding")
+
+    return Token(header, claims, signing_input, signature)
+
+
+def verify(token, key, algorithms, issuer=None):
+    """
+    Verifies the signature and registered claims of a parsed JWT, returning its claims.
+    TokenError is raised if the signature is invalid, the JWT has expired, etc.
+
+    Arguments
+    ----------
+    token : Token
+      the JWT returned by parse()
+
+    key : string or bytes
+      the secret key the JWT was signed with
+
+    algorithms : string or list
+      the HMAC algorithms the JWT is allowed to be signed with
+
+    issuer : string
+      the expected issuer of the JWT
+    """
+    if isinstance(algorithms, str):
+        algorithms = [algorithms]
+
+    algorithm = token.header.get('alg')
+    if algorithm not in algorithms or algorithm not in ALGORITHMS:
+        raise TokenError("The specified alg value is not allowed")
+
+    expected = _sign(_encode_key(key), token.signing_input, ALGORITHMS[algorithm])
+    if not hmac.compare_digest(expected, token.signature):
+        raise TokenError("Signature verification failed")
+
+    validate_claims(token.claims, issuer=issuer)
+
+    return token.claims
+
+
+def decode(token, key, algorithms, issuer=None):
+    """
+    Parses and verifies a JWT, returning its claims.
+    TokenError is raised if the JWT is malformed or fails verification.
+
+    Arguments
+    ----------
+    token : string
+      the JWT to decode
+
+    key : string or bytes
+      the secret key the JWT was signed with
+
+    algorithms : string or list
+      the HMAC algorithms the JWT is allowed to be signed with
+
+    issuer : string
+      the expected issuer of the JWT
+    """
+    return verify(parse(token), key, algorithms, issuer=issuer)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_claims(claims, issuer=None, now=None):
+    """
+    Validates the registered claims of a JWT the same way python-jose does.
+    TokenError is raised if a claim is invalid.
+
+    Arguments
+    ----------
+    claims : dict
+      the claims of the JWT
+
+    issuer : string
+      the expected issuer of the JWT
+
+    now : float
+      the current time, defaults to time.time()
+    """
+    if now is None:
+        now = time.time()
+
+    if 'iat' in claims and not _is_number(claims['iat']):
+        raise TokenError("Issued At claim (iat) must be an integer.")
+
+    if 'nbf' in claims:
+        if not _is_number(claims['nbf']):
+            raise TokenError("Not Before claim (nbf) must be an integer.")
+        if claims['nbf'] > now:
+            raise TokenError("The token is not yet valid (nbf)")
+
+    if 'exp' in claims:
+        if not _is_number(claims['exp']):
+            raise TokenError("Expiration Time claim (exp) must be an integer.")
+        if claims['exp'] < now:
+            raise TokenError("Signature has expired.")
+
+    # no audience is expected, so any JWT with an audience is rejected
+    if 'aud' in claims:
+        raise TokenError("Invalid audience")
+
+    if issuer is not None and claims.get('iss') != issuer:
+        raise TokenError("Invalid issuer")
+
+    if 'sub' in claims and not isinstance(claims['sub'], str):
+        raise TokenError("Subject must be a string.")
+
+    if 'jti' in claims and not isinstance(claims['jti'], str):
+        raise TokenError("JWT ID must be a string.")
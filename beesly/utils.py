@@ -1,13 +1,17 @@
-from hashlib import sha256
-from distutils.spawn import find_executable
+import grp
+import os
+import pwd
 import re
+import shutil
 import subprocess
 
-from flask import request
-import requests
+from flask import abort, current_app, g, request
 
+from beesly import _json
+from beesly.metrics import stage
 
-def get_ec2_metadata():
+
+def get_ec2_metadata(session=None):
     """
     Returns the following AWS EC2 metadata as a dictionary:
       * region
@@ -15,10 +19,19 @@ def get_ec2_metadata():
       * image id
       * instance type
       * instance id
+
+    Arguments
+    ----------
+    session : requests.Session object
+      the session used to reuse connections to the metadata service
     """
+    if session is None:
+        import requests
+        session = requests
+
     metadata_url = 'http://169.254.169.254/latest/dynamic/instance-identity/document/'
 
-    resp = requests.get(metadata_url, timeout=0.250)
+    resp = session.get(metadata_url, timeout=0.250)
 
     json_body = resp.json()
 
@@ -43,20 +56,55 @@ def get_real_source_ip():
         return request.environ['REMOTE_ADDR']
 
 
+def get_request_json():
+    """
+    Returns the JSON request body as a dictionary. The body is parsed once per request
+    and shared between the rate limiter and the view. Responds with HTTP 413 if the body
+    is larger than REQUEST_MAX_BODY_SIZE and HTTP 400 if it is not a JSON object.
+    """
+    if 'request_json' in g:
+        return g.request_json
+
+    max_body_size = current_app.config.get('REQUEST_MAX_BODY_SIZE', 65536)
+
+    # oversized bodies are rejected before they are read or parsed
+    if request.content_length is not None and request.content_length > max_body_size:
+        abort(413, "Request body is too large")
+
+    body = request.stream.read(max_body_size + 1)
+
+    if len(body) > max_body_size:
+        abort(413, "Request body is too large")
+
+    try:
+        with stage("json_parse"):
+            request_json = _json.loads(body)
+    except ValueError:
+        abort(400, "Request body must be a JSON object")
+
+    if not isinstance(request_json, dict):
+        abort(400, "Request body must be a JSON object")
+
+    g.request_json = request_json
+
+    return request_json
+
+
 def get_request_ip_username():
     """
-    Returns a unique key for rate limiting by extracting the username from the
-    JSON request body, combining it with the remote address of the HTTP request
-    and hashing it using SHA256.
+    Returns a unique key for rate limiting by combining the remote address of
+    the HTTP request with the username from the JSON request body. Requests with
+    a missing or invalid username share a single key for each remote address.
     """
-    request_json = request.get_json(force=True)
+    username = get_request_json().get('username')
+
+    if not isinstance(username, str) or not validate_username(username):
+        username = ''
 
-    rlimiting_key = get_real_source_ip()
+    return f'{get_real_source_ip()}/{username}'
 
-    if request_json is not None:
-        rlimiting_key += request_json.get('username', 'None')
 
-    return sha256(rlimiting_key.encode('utf-8')).hexdigest()
+USERNAME_REGEX = re.compile('^[a-zA-Z][-_.@a-z0-9]{1,32}$')
 
 
 def validate_username(username):
@@ -69,18 +117,92 @@ def validate_username(username):
     username : string
       the username to check
     """
-    regex = '^[a-zA-Z][-_.@a-z0-9]{1,32}$'
-    if not re.match(regex, username):
+    if not USERNAME_REGEX.match(username):
         return False
     else:
         return True
 
 
-def get_group_membership(username):
+_executables = {}
+
+
+def find_executable(name):
+    """
+    Returns the path of an executable found in PATH, or None if it doesn't exist.
+    PATH is only searched the first time each executable is found.
+
+    Arguments
+    ----------
+    name : string
+      the name of the executable
+    """
+    path = _executables.get(name)
+
+    if path is None:
+        path = shutil.which(name)
+        if path is not None:
+            _executables[name] = path
+
+    return path
+
+
+def get_group_membership(username, resolver='nss'):
     """
     Returns a list of groups the user is a member of to support Role-Based Access Control.
-    The `id` command is used because it reports all (POSIX) groups that the user
-    is a member of including external groups from Identity Management systems (AD, IdM, FreeIPA).
+    The user's private group (the group with the same name as the user) is not included.
+
+    Arguments
+    ----------
+    username : string
+      the username to get group membership for
+
+    resolver : string
+      the method used to look up groups, either `nss` or `id`
+    """
+    if resolver == 'id':
+        groups = get_group_membership_id(username)
+    else:
+        groups = get_group_membership_nss(username)
+
+    if username in groups:
+        groups.remove(username)
+
+    return groups
+
+
+def get_group_membership_nss(username):
+    """
+    Returns a list of all groups the user is a member of by querying NSS in-process.
+    Like `id -Gn`, this includes external groups from Identity Management systems
+    (AD, IdM, FreeIPA) provided through sssd. Returns an empty list if the user does not exist.
+
+    Arguments
+    ----------
+    username : string
+      the username to get group membership for
+    """
+    try:
+        primary_gid = pwd.getpwnam(username).pw_gid
+    except KeyError:
+        return []
+
+    groups = []
+    for gid in os.getgrouplist(username, primary_gid):
+        try:
+            group = grp.getgrgid(gid).gr_name
+        except KeyError:
+            # `id` reports the numeric ID for groups that have no name
+            group = str(gid)
+
+        if group not in groups:
+            groups.append(group)
+
+    return groups
+
+
+def get_group_membership_id(username):
+    """
+    Returns a list of all groups the user is a member of using the `id` command.
 
     Arguments
     ----------
@@ -89,6 +211,4 @@ def get_group_membership(username):
     """
     exe = find_executable('id')
     process = subprocess.run([exe, '-Gn', username], stdout=subprocess.PIPE)
-    groups = [group.decode('utf-8') for group in process.stdout.split()]
-    groups.remove(username)
-    return groups
+    return [group.decode('utf-8') for group in process.stdout.split()]
@@ -1,3 +1,4 @@
+import ipaddress
 import socket
 import time
 import traceback
@@ -5,25 +6,51 @@ import traceback
 from flask import Flask, request, jsonify, escape
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from pam import pam
-from jose import jwt, JWTError
 from nacl.encoding import URLSafeBase64Encoder
-from nacl.hash import blake2b
 import nacl.utils
-import psutil
 
+from beesly import _json
 from beesly._logging import structured_log
+from beesly.cache import GroupCache, KeyCache, TokenCache
 from beesly.config import StatsdConfig
-from beesly.utils import get_ec2_metadata, get_request_ip_username, get_real_source_ip
-from beesly.utils import validate_username, get_group_membership
+from beesly.metrics import RequestMetrics
+from beesly.pamauth import PamPool, PamPoolFullError, PamTimeoutError
+from beesly.profiler import Profiler
+from beesly.ratelimit import HybridStorage, SharedMemoryStorage  # noqa: F401 registers the hybrid+ and shm storage schemes
+from beesly.responses import StaticResponses
+from beesly.sysinfo import SystemInfo
+from beesly.tokens import TokenError
+from beesly import tokens as jwt
+from beesly.utils import get_request_ip_username, get_request_json, get_real_source_ip
+from beesly.utils import validate_username
 
 
 app = Flask(__name__, static_folder=None, static_url_path=None)
 
-rlimiter = Limiter(key_func=get_remote_address, headers_enabled=True)
+# request bodies and responses are encoded with orjson if it is installed
+_json.init_app(app)
+
+# rate limits are checked by check_rate_limits() so that the check can be timed
+rlimiter = Limiter(key_func=get_remote_address, headers_enabled=True, auto_check=False)
 
 statsd = StatsdConfig()
 
+group_cache = GroupCache(statsd=statsd.client)
+
+key_cache = KeyCache(statsd=statsd.client)
+
+token_cache = TokenCache(statsd=statsd.client)
+
+pam_pool = PamPool(statsd=statsd.client)
+
+system_info = SystemInfo()
+
+request_metrics = RequestMetrics(statsd=statsd.client)
+
+profiler = Profiler()
+
+static_responses = StaticResponses()
+
 
 @app.route("/", methods=["GET"])
 @rlimiter.limit("10/second")
@@ -32,6 +59,11 @@ def index():
     Returns information about this microservice such as name, version,
     what endpoints are available and which HTTP methods they support.
     """
+    return static_responses.response('index_body')
+
+
+@static_responses.body
+def index_body():
     response_body = {
         "hostname": socket.gethostname(),
         "app": app.config['APP_NAME'],
@@ -45,7 +77,7 @@ def index():
             'methods': sorted(rule.methods)
         })
 
-    return jsonify(response_body), 200
+    return response_body
 
 
 @app.route("/service", methods=["GET"])
@@ -55,29 +87,19 @@ def service_info():
     Returns information about this microservice such as name, version,
     and metadata about the server it is running on.
     """
-
-    total_memory_mb = "{} MB".format(psutil.virtual_memory().total / (1024 * 1024))
-    system_uptime = round((time.time() - psutil.boot_time()), 3)
-    app_uptime = round((time.time() - psutil.Process().create_time()), 3)
-
     response_body = {
         'app': {
             'name': app.config['APP_NAME'],
             'version': app.config['APP_VERSION'],
-            'uptime': app_uptime
+            'uptime': system_info.app_uptime()
         },
-        'system': {
-            "hostname": socket.gethostname(),
-            'processors': psutil.cpu_count(),
-            'memory': total_memory_mb,
-            'uptime': system_uptime,
-        }
+        'system': system_info.system()
     }
 
-    try:
-        response_body["aws"] = get_ec2_metadata()
-    except Exception:
-        pass
+    ec2_metadata = system_info.ec2_metadata()
+
+    if ec2_metadata is not None:
+        response_body["aws"] = ec2_metadata
 
     return jsonify(response_body), 200
 
@@ -88,13 +110,16 @@ def service_version():
     """
     Returns the name and version of this microservice.
     """
-    response_body = {
+    return static_responses.response('service_version_body')
+
+
+@static_responses.body
+def service_version_body():
+    return {
         'app': app.config['APP_NAME'],
         'version': app.config['APP_VERSION'],
     }
 
-    return jsonify(response_body), 200
-
 
 @app.route("/service/health", methods=["GET"])
 @rlimiter.limit("10/second")
@@ -102,87 +127,220 @@ def service_health():
     """
     Health check endpoint for load balancers and monitoring systems.
     """
+    return static_responses.response('service_health_body')
+
+
+@static_responses.body
+def service_health_body():
     app_name = app.config['APP_NAME']
 
-    response_body = {
+    return {
         app_name: "OK"
     }
 
-    return jsonify(response_body), 200
 
+def sign_token(claims):
+    """
+    Returns a JWT containing the claims. The JWT is signed with the active signing key
+    if asymmetric signing is configured. Otherwise a unique salt is added to the claims
+    and used with the master key to derive a unique secret key for the JWT.
 
-@app.route("/auth", methods=["POST"])
-@rlimiter.limit("10/second", methods=["POST"], key_func=get_request_ip_username)
-def auth_endpoint():
+    Arguments
+    ----------
+    claims : dict
+      the claims to include in the JWT
     """
-    Authenticates users using PAM.
-    If authentication is successful, returns a list of groups the user is a member of.
-    Returns a short-lived JSON Web Token if JWT_MASTER_KEY is set.
+    signing_keys = app.config.get("JWT_SIGNING_KEYS")
+
+    if signing_keys is not None:
+        claims.pop("x", None)
+        with request_metrics.stage("jwt_encode"):
+            return signing_keys.encode(claims)
+
+    master_key  = app.config["JWT_MASTER_KEY"]
+    algorithm   = app.config["JWT_ALGORITHM"]
+    subject     = claims["sub"].encode('utf-8')
+
+    # generate a unique salt for each JWT, needs to be encoded to include as a claim
+    salt = URLSafeBase64Encoder.encode(nacl.utils.random(12))
+    claims["x"] = salt.decode('utf-8')
+
+    # generate a unique secret key for each JWT
+    with request_metrics.stage("key_derivation"):
+        secret_key = key_cache.get(master_key, salt, subject, claims["exp"])
+
+    with request_metrics.stage("jwt_encode"):
+        return jwt.encode(claims=claims, key=secret_key, algorithm=algorithm)
+
+
+def verify_signature(parsed_token, subject, salt):
     """
-    if request.method == 'POST':
-        request_json = request.get_json(force=True, cache=False)
+    Verifies the signature and claims of a JWT, returning its claims. TokenError is
+    raised if the JWT has expired, signature verification fails, etc.
 
-        username = request_json.get('username', None)
-        password = request_json.get('password', None)
+    Arguments
+    ----------
+    parsed_token : beesly.tokens.Token
+      the parsed JWT
 
-        if username is None or password is None:
-            return jsonify(message="No username or password provided"), 400
+    subject : bytes
+      the subject of the JWT
 
-        sanitized_username = str(escape(username))
+    salt : bytes
+      the unique salt of the JWT, not used if asymmetric signing is configured
+    """
+    signing_keys = app.config.get("JWT_SIGNING_KEYS")
+    issuer = app.config['APP_NAME']
 
-        if not validate_username(sanitized_username):
-            structured_log(level='warning', msg="Invalid username provided", user=f"'{sanitized_username}'")
-            return jsonify(message="Invalid username provided"), 400
+    if signing_keys is not None:
+        with request_metrics.stage("jwt_decode"):
+            return signing_keys.verify(parsed_token, issuer=issuer)
 
-        pam_service = app.config['PAM_SERVICE']
+    master_key  = app.config["JWT_MASTER_KEY"]
+    algorithm   = app.config["JWT_ALGORITHM"]
 
-        with statsd.client.timer("pam_auth"):
-            if pam().authenticate(sanitized_username, password, service=pam_service):
-                authenticated = True
-                auth_message = "Authentication successful"
-                statsd.client.incr("auth_success")
-            else:
-                authenticated = False
-                auth_message = "Authentication failed"
-                statsd.client.incr("auth_failed")
+    with request_metrics.stage("key_derivation"):
+        secret_key = key_cache.lookup(master_key, salt, subject)
+        cached = secret_key is not None
+        if not cached:
+            secret_key = key_cache.derive(master_key, salt, subject)
 
-        structured_log(level='info', msg=auth_message, user=f"'{sanitized_username}'")
+    with request_metrics.stage("jwt_decode"):
+        claims = jwt.verify(parsed_token, key=secret_key, algorithms=algorithm, issuer=issuer)
 
-        if authenticated:
-            groups = get_group_membership(sanitized_username)
+    # the key is only cached once the signature is verified, so forged tokens can't fill the cache
+    if not cached:
+        key_cache.set(master_key, salt, subject, secret_key, claims.get("exp"))
+
+    return claims
+
+
+def parse_credentials(request_json):
+    """
+    Returns the sanitized username and the password from the JSON request body of /auth.
+    ValueError is raised if either is missing or the username is invalid.
 
-            token = None
+    Arguments
+    ----------
+    request_json : dict
+      the JSON request body
+    """
+    username = request_json.get('username', None)
+    password = request_json.get('password', None)
 
-            if app.config["JWT"]:
-                issuer      = app.config['APP_NAME']
-                issue_time  = time.time()
-                expiry_time = issue_time + app.config['JWT_VALIDITY_PERIOD']
-                subject     = sanitized_username.encode('utf-8')
+    if username is None or password is None:
+        raise ValueError("No username or password provided")
 
-                # generate a unique salt for each JWT, needs to be encoded to include as a claim
-                salt = URLSafeBase64Encoder.encode(nacl.utils.random(12))
+    sanitized_username = str(escape(username))
 
-                claims = {
-                    "iss": issuer,
-                    "iat": issue_time,
-                    "exp": expiry_time,
-                    "sub": sanitized_username,
-                    "groups": groups,
-                    "x": salt.decode('utf-8')
-                }
+    if not validate_username(sanitized_username):
+        structured_log(level='warning', msg="Invalid username provided", user=f"'{sanitized_username}'")
+        raise ValueError("Invalid username provided")
 
-                master_key  = app.config["JWT_MASTER_KEY"]
-                algorithm   = app.config["JWT_ALGORITHM"]
+    return sanitized_username, password
 
-                # generate a unique secret key for each JWT
-                secret_key = blake2b(b'', key=master_key, salt=salt, person=subject).decode('utf-8')
 
-                token = jwt.encode(claims=claims, key=secret_key, algorithm=algorithm)
-                statsd.client.incr("jwt_generated")
+def pam_error(err, username):
+    """
+    Returns the response body as a dictionary and the HTTP status code for
+    a PAM authentication that was rejected by the pool or timed out.
 
-            return jsonify(message=f"{auth_message}", auth=True, groups=groups, jwt=token), 200
-        else:
-            return jsonify(message=f"{auth_message}", auth=False), 401
+    Arguments
+    ----------
+    err : PamPoolFullError or PamTimeoutError
+      the error raised by the PAM pool
+
+    username : string
+      the sanitized username of the user
+    """
+    if isinstance(err, PamPoolFullError):
+        statsd.client.incr("pam_rejected")
+        structured_log(level='warning', msg="PAM worker pool is full", user=f"'{username}'")
+        return dict(message="Authentication service is busy"), 503
+
+    statsd.client.incr("pam_timeout")
+    structured_log(level='warning', msg="PAM authentication timed out", user=f"'{username}'")
+    return dict(message="Authentication timed out"), 503
+
+
+def auth_result(username, authenticated, groups=None):
+    """
+    Returns the response body as a dictionary and the HTTP status code of /auth once
+    the user has been authenticated with PAM. A JWT is included if JWT is enabled.
+
+    Arguments
+    ----------
+    username : string
+      the sanitized username of the user
+
+    authenticated : boolean
+      True if PAM authentication was successful
+
+    groups : list
+      the groups the user is a member of, if authentication was successful
+    """
+    if not authenticated:
+        statsd.client.incr("auth_failed")
+        structured_log(level='info', msg="Authentication failed", user=f"'{username}'")
+        return dict(message="Authentication failed", auth=False), 401
+
+    statsd.client.incr("auth_success")
+    structured_log(level='info', msg="Authentication successful", user=f"'{username}'")
+
+    token = None
+
+    if app.config["JWT"]:
+        issue_time  = time.time()
+        expiry_time = issue_time + app.config['JWT_VALIDITY_PERIOD']
+
+        claims = {
+            "iss": app.config['APP_NAME'],
+            "iat": issue_time,
+            "exp": expiry_time,
+            "sub": username,
+            "groups": groups
+        }
+
+        token = sign_token(claims)
+        statsd.client.incr("jwt_generated")
+
+    return dict(message="Authentication successful", auth=True, groups=groups, jwt=token), 200
+
+
+@app.route("/auth", methods=["POST"])
+@rlimiter.limit("10/second", methods=["POST"], key_func=get_request_ip_username)
+def auth_endpoint():
+    """
+    Authenticates users using PAM.
+    If authentication is successful, returns a list of groups the user is a member of.
+    Returns a short-lived JSON Web Token if JWT_MASTER_KEY is set.
+    """
+    if request.method == 'POST':
+        request_json = get_request_json()
+
+        try:
+            username, password = parse_credentials(request_json)
+        except ValueError as err:
+            return jsonify(message=str(err)), 400
+
+        pam_service = app.config['PAM_SERVICE']
+
+        try:
+            with statsd.client.timer("pam_auth"), request_metrics.stage("pam_auth"):
+                authenticated = pam_pool.authenticate(username, password, service=pam_service)
+        except (PamPoolFullError, PamTimeoutError) as err:
+            response_body, status_code = pam_error(err, username)
+            return jsonify(response_body), status_code
+
+        groups = None
+
+        if authenticated:
+            with request_metrics.stage("group_lookup"):
+                groups = group_cache.get(username)
+
+        response_body, status_code = auth_result(username, authenticated, groups)
+
+        return jsonify(response_body), status_code
 
 
 @app.route("/renew", methods=["POST"])
@@ -196,7 +354,7 @@ def renew_endpoint():
         if not app.config["JWT"]:
             return jsonify(message="JWT renewal is not enabled"), 501
 
-        request_json = request.get_json(force=True, cache=False)
+        request_json = get_request_json()
 
         token       = request_json.get('jwt', None)
         username    = request_json.get('username', None)
@@ -211,29 +369,24 @@ def renew_endpoint():
             return jsonify(message="Invalid username provided"), 400
 
         try:
-            claims = jwt.get_unverified_claims(token)
-        except JWTError:
+            parsed_token = jwt.parse(token)
+        except TokenError:
             return jsonify(message="Invalid JWT"), 400
 
+        claims = parsed_token.claims
+
         try:
             subject = claims["sub"].encode('utf-8')
-            salt    = claims["x"].encode('utf-8')
+            salt    = None if app.config.get("JWT_SIGNING_KEYS") else claims["x"].encode('utf-8')
         except KeyError:
             return jsonify(message="Invalid claims in JWT"), 401
 
         if sanitized_username != claims["sub"]:
             return jsonify(message="Invalid subject in JWT claim"), 400
 
-        master_key  = app.config["JWT_MASTER_KEY"]
-        algorithm   = app.config["JWT_ALGORITHM"]
-        issuer      = app.config['APP_NAME']
-
-        # jwt.decode() requires secret_key to be a str, so it must be decoded
-        secret_key = blake2b(b'', key=master_key, salt=salt, person=subject).decode('utf-8')
-
         # exception is raised if token has expired, signature verification fails, etc.
         try:
-            payload = jwt.decode(token=token, key=secret_key, algorithms=algorithm, issuer=issuer)
+            payload = verify_signature(parsed_token, subject, salt)
         except Exception as err:
             structured_log(level='info', msg="Failed to renew JWT", error=err)
             return jsonify(message="Failed to renew invalid JWT"), 401
@@ -241,21 +394,62 @@ def renew_endpoint():
         issue_time  = time.time()
         expiry_time = issue_time + app.config['JWT_VALIDITY_PERIOD']
 
-        salt = URLSafeBase64Encoder.encode(nacl.utils.random(12))
-
         payload['iat']  = issue_time
         payload['exp']  = expiry_time
-        payload['x']    = salt.decode('utf-8')
 
-        # compute a new secret key for the regenerated JWT
-        new_secret_key  = blake2b(b'', key=master_key, salt=salt, person=subject).decode('utf-8')
-        new_token       = jwt.encode(claims=payload, key=new_secret_key, algorithm=algorithm)
+        new_token = sign_token(payload)
 
         statsd.client.incr("jwt_renewed")
         structured_log(level='info', msg="JWT successfully renewed", user="'{}'".format(sanitized_username))
         return jsonify(message="JWT successfully renewed", jwt=new_token), 200
 
 
+def verify_token(token):
+    """
+    Verifies if a JWT is valid. Returns a tuple of the response body as
+    a dictionary and the HTTP status code.
+
+    Arguments
+    ----------
+    token : string
+      the JWT to verify
+    """
+    # JWTs that were already verified are served from the cache until they expire
+    if isinstance(token, str):
+        subject = token_cache.get(token)
+
+        if subject is not None:
+            statsd.client.incr("jwt_verified")
+            structured_log(level='info', msg="JWT successfully verified", user=f"'{subject}'")
+            return dict(message="JWT successfully verified", valid=True), 200
+
+    try:
+        parsed_token = jwt.parse(token)
+    except TokenError:
+        return dict(message="Invalid JWT"), 400
+
+    claims = parsed_token.claims
+
+    try:
+        subject = claims["sub"].encode('utf-8')
+        salt    = None if app.config.get("JWT_SIGNING_KEYS") else claims["x"].encode('utf-8')
+    except KeyError:
+        return dict(message="Invalid claims in JWT", valid=False), 401
+
+    # exception is raised if token has expired, signature verification fails, etc.
+    try:
+        verify_signature(parsed_token, subject, salt)
+    except Exception as err:
+        structured_log(level='info', msg="Failed to verify JWT", error=err)
+        return dict(message="Failed to verify JWT", valid=False), 401
+
+    token_cache.set(token, subject, claims.get("exp"))
+
+    statsd.client.incr("jwt_verified")
+    structured_log(level='info', msg="JWT successfully verified", user=f"'{subject}'")
+    return dict(message="JWT successfully verified", valid=True), 200
+
+
 @app.route("/verify", methods=["POST"])
 @rlimiter.limit("500/second")
 def verify_endpoint():
@@ -267,41 +461,96 @@ def verify_endpoint():
         if not app.config["JWT"]:
             return jsonify(message="JWT verification is not enabled"), 501
 
-        request_json = request.get_json(force=True, cache=False)
+        request_json = get_request_json()
 
         token = request_json.get('jwt', None)
 
         if token is None:
             return jsonify(message="No JWT provided"), 400
 
-        try:
-            claims = jwt.get_unverified_claims(token)
-        except:
-            return jsonify(message="Invalid JWT"), 400
+        response_body, status_code = verify_token(token)
 
-        master_key  = app.config["JWT_MASTER_KEY"]
-        algorithm   = app.config["JWT_ALGORITHM"]
-        issuer      = app.config['APP_NAME']
+        return jsonify(response_body), status_code
 
-        try:
-            subject = claims["sub"].encode('utf-8')
-            salt    = claims["x"].encode('utf-8')
-        except KeyError:
-            return jsonify(message="Invalid claims in JWT", valid=False), 401
 
-        # jwt.decode() requires secret_key to be a str, so it must be decoded
-        secret_key = blake2b(b'', key=master_key, salt=salt, person=subject).decode('utf-8')
+@app.route("/verify/batch", methods=["POST"])
+@rlimiter.limit("50/second")
+def verify_batch_endpoint():
+    """
+    Verifies if each JWT in a list is valid. Results are returned in the same order
+    as the JWTs were provided. The whole batch counts as a single request for rate limiting.
+    """
+    if request.method == 'POST':
 
-        # exception is raised if token has expired, signature verification fails, etc.
-        try:
-            jwt.decode(token=token, key=secret_key, algorithms=algorithm, issuer=issuer)
-        except Exception as err:
-            structured_log(level='info', msg="Failed to verify JWT", error=err)
-            return jsonify(message="Failed to verify JWT", valid=False), 401
+        if not app.config["JWT"]:
+            return jsonify(message="JWT verification is not enabled"), 501
+
+        request_json = get_request_json()
+
+        tokens = request_json.get('jwts', None)
+
+        if not isinstance(tokens, list) or not tokens:
+            return jsonify(message="No JWTs provided"), 400
+
+        max_batch_size = app.config.get('VERIFY_BATCH_MAX_SIZE', 100)
+
+        if len(tokens) > max_batch_size:
+            return jsonify(message=f"Too many JWTs provided. The maximum is {max_batch_size}"), 400
+
+        results = []
+        for token in tokens:
+            response_body, _ = verify_token(token)
+            response_body.setdefault('valid', False)
+            results.append(response_body)
+
+        return jsonify(message="JWTs processed", results=results), 200
+
+
+@app.route("/.well-known/jwks.json", methods=["GET"])
+@rlimiter.limit("10/second")
+def jwks_endpoint():
+    """
+    Returns the public keys used to sign JWTs as a JSON Web Key Set
+    so that JWTs can be verified without calling /verify.
+    """
+    signing_keys = app.config.get("JWT_SIGNING_KEYS")
+
+    if signing_keys is None:
+        return jsonify(message="JWT signing keys are not published"), 501
 
-        statsd.client.incr("jwt_verified")
-        structured_log(level='info', msg="JWT successfully verified", user=f"'{subject}'")
-        return jsonify(message="JWT successfully verified", valid=True), 200
+    resp = jsonify(signing_keys.jwks)
+    resp.headers['Cache-Control'] = f"public, max-age={app.config.get('JWKS_MAX_AGE', 300)}"
+
+    return resp, 200
+
+
+@rlimiter.request_filter
+def exempt_health_checks():
+    """
+    Exempts health checks from the load balancer source ranges in HEALTHCHECK_SOURCE_RANGES
+    from rate limiting, so that they never reach the rate limit storage.
+    """
+    source_ranges = app.config.get('HEALTHCHECK_SOURCE_RANGES')
+
+    if request.endpoint != 'service_health' or not source_ranges:
+        return False
+
+    # the address of the connection is used, X-Forwarded-For can be set by any client
+    try:
+        source_ip = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        return False
+
+    return any(source_ip in source_range for source_range in source_ranges)
+
+
+@app.before_request
+def check_rate_limits():
+    """
+    Checks the rate limits of the requested endpoint.
+    """
+    with request_metrics.stage("ratelimit"):
+        rlimiter.check()
 
 
 @app.after_request
@@ -314,7 +563,8 @@ def after_request(resp):
     resp : flask.Response object
       the Flask response object
     """
-    resp.headers['Cache-Control'] = 'no-cache'
+    if 'Cache-Control' not in resp.headers:
+        resp.headers['Cache-Control'] = 'no-cache'
 
     if app.config['DEV']:
         resp.headers['Access-Control-Allow-Origin'] = '*'
@@ -337,6 +587,14 @@ def after_request(resp):
     return resp
 
 
+@app.errorhandler(400)
+def http_400_handler(err):
+    """
+    Catches any 400 errors and responds with a custom error message.
+    """
+    return jsonify(error=err.description), 400
+
+
 @app.errorhandler(404)
 def http_404_handler(err):
     """
@@ -345,6 +603,14 @@ def http_404_handler(err):
     return jsonify(error="The requested endpoint does not exist"), 404
 
 
+@app.errorhandler(413)
+def http_413_handler(err):
+    """
+    Catches any 413 errors and responds with a custom error message.
+    """
+    return jsonify(error=err.description), 413
+
+
 @app.errorhandler(429)
 def rate_limit_handler(err):
     """
@@ -0,0 +1,84 @@
+import pwd
+import time
+
+from flask import jsonify
+
+from beesly._logging import structured_log
+from beesly.cache import KeyCache
+from beesly import tokens as jwt
+from beesly.utils import validate_username
+from beesly.views import group_cache, system_info
+
+
+def warm_up(app):
+    """
+    Builds state that each worker would otherwise build lazily while handling its first
+    requests: the compiled URL map, the JSON response machinery, and the libraries and key
+    material used to sign and verify JWTs, and the system facts and EC2 metadata served
+    by /service. The groups of every user are optionally cached
+    if WARMUP_GROUPS is enabled.
+
+    When gunicorn is run with --preload, this is done once in the master process and the
+    memory is shared copy-on-write by every worker. gconfig.py freezes the garbage collector
+    before each fork, so that collections in workers don't write to the shared pages.
+
+    Arguments
+    ----------
+    app : Flask object
+      the configured application
+    """
+    start = time.time()
+
+    app.url_map.update()
+
+    with app.app_context():
+        jsonify(message="warm up")
+
+    validate_username("warmup")
+
+    system_info.preload()
+
+    if app.config.get("JWT"):
+        _warm_up_jwt(app)
+
+    if app.config.get("PROMETHEUS"):
+        from prometheus_client import CollectorRegistry, generate_latest  # noqa: F401
+        from prometheus_client.multiprocess import MultiProcessCollector  # noqa: F401
+
+    groups = 0
+    if app.config.get("WARMUP_GROUPS"):
+        groups = group_cache.preload(user.pw_name for user in pwd.getpwall() if validate_username(user.pw_name))
+
+    structured_log(level='info', msg="Warmed up application", duration=f"{(time.time() - start) * 1000:.1f}ms", cached_groups=groups)
+
+
+def _warm_up_jwt(app):
+    # a JWT is signed and verified once so that the libraries behind them are loaded and initialized
+    issuer = app.config['APP_NAME']
+    now = time.time()
+
+    claims = {
+        "iss": issuer,
+        "iat": now,
+        "exp": now + 60,
+        "sub": "warmup",
+        "groups": [],
+    }
+
+    signing_keys = app.config.get("JWT_SIGNING_KEYS")
+
+    if signing_keys is not None:
+        token = signing_keys.encode(claims)
+        signing_keys.verify(jwt.parse(token), issuer=issuer)
+        return
+
+    master_key = app.config["JWT_MASTER_KEY"]
+    algorithm = app.config["JWT_ALGORITHM"]
+    salt = b'd2FybXVwd2FybXVw'
+
+    # the key is derived without the application's cache and statsd client, so that nothing is cached
+    # and no metrics are sent, which would start threads in the gunicorn master before it forks
+    secret_key = KeyCache().get(master_key, salt, b'warmup', None)
+
+    token = jwt.encode(claims=claims, key=secret_key, algorithm=algorithm)
+    jwt.decode(token, key=secret_key, algorithms=algorithm, issuer=issuer)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of the code on the hot paths of /auth, /verify and /renew. Results
+are written as JSON and can be compared against the results of a previous run:
+
+    $ python benchmarks/bench_hot_paths.py --output baseline.json
+    $ python benchmarks/bench_hot_paths.py --baseline baseline.json
+
+Group membership is looked up from an in-memory NSS stand-in, so no local users are needed.
+"""
+import argparse
+import sys
+import time
+import timeit
+
+from flask import Flask, jsonify
+
+from common import USERNAME, add_output_arguments, discard_logs, install_fakes, write_results
+
+from beesly import _json
+from beesly._logging import structured_log
+from beesly.cache import KeyCache
+from beesly import tokens as jwt
+from beesly.utils import get_group_membership, validate_username
+
+
+MASTER_KEY = b'0123456789abcdef0123456789abcdef'
+SALT = b'bWFkZWJ5YmVlc2x5'
+
+
+def get_benchmarks():
+    """
+    Returns a dict of benchmark names and the function they time.
+    """
+    key_cache = KeyCache()
+    key_cache.get(MASTER_KEY, SALT, USERNAME.encode('utf-8'), time.time() + 3600)
+
+    claims = {
+        'iss': 'beesly',
+        'iat': time.time(),
+        'exp': time.time() + 3600,
+        'sub': USERNAME,
+        'groups': ['sales', 'safety', 'volunteer-sheriffs'],
+        'x': SALT.decode('utf-8'),
+    }
+    secret_key = key_cache.get(MASTER_KEY, SALT, USERNAME.encode('utf-8'), None)
+    token = jwt.encode(claims=claims, key=secret_key, algorithm='HS256')
+    body = _json.dumps({'jwt': token})
+
+    # responses are encoded by the JSON provider of the application, which requires an application context
+    app = Flask(__name__)
+    _json.init_app(app)
+    app.app_context().push()
+
+    return {
+        # derive() never reads or writes the cache, so the key is derived with blake2b on every call
+        'key_derivation': lambda: KeyCache.derive(MASTER_KEY, SALT, USERNAME.encode('utf-8')),
+        'key_cache_hit': lambda: key_cache.get(MASTER_KEY, SALT, USERNAME.encode('utf-8'), claims['exp']),
+        'jwt_encode': lambda: jwt.encode(claims=claims, key=secret_key, algorithm='HS256'),
+        'jwt_decode': lambda: jwt.decode(token, key=secret_key, algorithms='HS256', issuer='beesly'),
+        'json_parse': lambda: _json.loads(body),
+        'json_response': lambda: jsonify(message="JWT successfully verified", claims=claims),
+        'structured_log': lambda: structured_log(level='info', msg="JWT successfully verified", user=f"'{USERNAME}'"),
+        'validate_username': lambda: validate_username(USERNAME),
+        'get_group_membership': lambda: get_group_membership(USERNAME),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--benchmark', action='append', help='only run the named benchmark, can be repeated')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    install_fakes()
+    discard_logs()
+
+    benchmarks = get_benchmarks()
+    selected = args.benchmark or sorted(benchmarks)
+
+    results = {}
+    for name in selected:
+        # the fastest run is reported, slower runs are caused by noise from the rest of the system
+        seconds = min(timeit.repeat(benchmarks[name], number=args.iterations, repeat=args.repeat))
+        results[name] = {'ns_per_call': round(seconds / args.iterations * 1e9, 1)}
+
+    sys.exit(write_results(results, args.output, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
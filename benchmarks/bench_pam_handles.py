@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark comparing the per-call overhead of constructing a new PAM
+authenticator object for every authentication with reusing a per-thread handle.
+
+    $ python benchmarks/bench_pam_handles.py --iterations 100000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pam import pam  # noqa: E402
+
+from beesly.pamauth import get_pam_handle  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--service', default='login')
+    args = parser.parse_args()
+
+    service = args.service
+
+    # the authenticate method is looked up as it would be for every login
+    results = {
+        'pam_per_call': timeit.timeit(lambda: pam().authenticate, number=args.iterations),
+        'pam_pooled_handle': timeit.timeit(lambda: get_pam_handle(service).authenticate, number=args.iterations),
+    }
+
+    for name, seconds in results.items():
+        print(f"{name:<20} {seconds / args.iterations * 1e9:10.1f} ns/call")
+
+    saved = (results['pam_per_call'] - results['pam_pooled_handle']) / args.iterations * 1e9
+    print(f"{'saved':<20} {saved:10.1f} ns/call")
+
+
+if __name__ == '__main__':
+    main()
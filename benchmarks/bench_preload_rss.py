@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Measures the memory of workers forked from a preloaded application, as gunicorn does
+with --preload, with and without warming up the application and freezing the garbage
+collector before fork. Each worker reports its memory right after it is forked and again
+after handling a mix of /auth, /verify and /renew requests:
+
+    $ python benchmarks/bench_preload_rss.py --workers 4 --requests 2000
+
+RSS includes pages shared with the master, USS counts only the pages a worker has
+unshared or allocated itself, and PSS splits shared pages evenly between processes.
+Results are written as JSON and can be compared against a previous run with --baseline.
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+
+import psutil
+
+from common import PASSWORD, USERNAME, add_output_arguments, discard_logs, install_fakes, write_results
+
+
+MODES = ['cold', 'warm']
+
+
+def memory():
+    info = psutil.Process().memory_full_info()
+    return {'rss': info.rss, 'uss': info.uss, 'pss': info.pss}
+
+
+def run_worker(app, requests, pipe):
+    before = memory()
+
+    client = app.test_client()
+
+    resp = client.post('/auth', json={'username': USERNAME, 'password': PASSWORD})
+    token = resp.get_json()['jwt']
+
+    for i in range(requests):
+        if i % 10 == 0:
+            client.post('/auth', json={'username': USERNAME, 'password': PASSWORD})
+        elif i % 10 == 1:
+            token = client.post('/renew', json={'username': USERNAME, 'jwt': token}).get_json()['jwt']
+        else:
+            client.post('/verify', json={'jwt': token})
+
+    os.write(pipe, (json.dumps({'before': before, 'after': memory()}) + '\n').encode('utf-8'))
+
+
+def run_mode(mode, workers, requests):
+    """
+    Loads the application, then forks workers and returns the memory of each.
+    """
+    os.environ.setdefault('JWT_MASTER_KEY', 'benchmarks-master-key')
+    os.environ.setdefault('RATELIMIT_ENABLED', 'False')
+    os.environ['WARMUP'] = str(mode == 'warm')
+
+    install_fakes()
+    discard_logs()
+
+    from beesly import create_app
+    app = create_app()
+
+    # as gconfig.py does before gunicorn forks each worker
+    if mode == 'warm' and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+    read_fd, write_fd = os.pipe()
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, requests, write_fd)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        return [json.loads(line) for line in f]
+
+
+def summarize(results):
+    summary = {}
+    for when in ['before', 'after']:
+        for metric in ['rss', 'uss', 'pss']:
+            values = [result[when][metric] for result in results]
+            summary[f'{metric}_{when}_mb'] = round(sum(values) / len(values) / 2**20, 2)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=2000, help='number of requests handled by each worker')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run_mode(args.mode, args.workers, args.requests)))
+        return
+
+    # each mode loads the application in a fresh interpreter
+    results = {}
+    for mode in MODES:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--mode', mode,
+                                 '--workers', str(args.workers), '--requests', str(args.requests)],
+                                stdout=subprocess.PIPE, check=True).stdout
+        results[mode] = summarize(json.loads(output))
+
+    sys.exit(write_results(results, args.output, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Measures how long a new process takes to import beesly and to load serve:app, which
+configures the application with create_app(), as each container or gunicorn master does
+when it starts. Every run starts a fresh interpreter and the median of all runs is reported:
+
+    $ python benchmarks/bench_startup.py --runs 10
+    $ python benchmarks/bench_startup.py --statsd-host statsd.invalid --importtime 15
+
+Results are written as JSON and can be compared against a previous run with --baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import add_output_arguments, write_results
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import beesly
+imported = time.perf_counter()
+import serve
+loaded = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_app_ms': (loaded - imported) * 1000}))
+"""
+
+
+def run(env, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', STARTUP_SCRIPT]
+
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=REPO_PATH, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    elapsed = time.perf_counter() - start
+
+    result = json.loads(process.stdout.decode('utf-8').splitlines()[-1])
+    result['process_ms'] = elapsed * 1000
+
+    return result, process.stderr.decode('utf-8')
+
+
+def print_slowest_imports(stderr, count):
+    # lines are formatted as `import time: self [us] | cumulative | imported package`
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+
+    for (cumulative, name) in sorted(imports, reverse=True)[:count]:
+        print(f"{name:<50} {cumulative / 1000:10.1f} ms", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--statsd-host', help='value of STATSD_HOST, eg. an unresolvable hostname')
+    parser.add_argument('--importtime', type=int, metavar='COUNT', help='print the COUNT slowest imports to stderr')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('JWT_MASTER_KEY', 'benchmarks-master-key')
+    if args.statsd_host is not None:
+        env['STATSD_HOST'] = args.statsd_host
+
+    # the first run warms the filesystem cache and isn't counted
+    run(env)
+
+    runs = [run(env)[0] for _ in range(args.runs)]
+
+    results = {
+        'startup': {metric: round(statistics.median(r[metric] for r in runs), 1) for metric in runs[0]}
+    }
+
+    if args.importtime:
+        print_slowest_imports(run(env, importtime=True)[1], args.importtime)
+
+    sys.exit(write_results(results, args.output, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Helpers shared by the benchmarks: stand-ins for PAM and NSS so that benchmarks run
+offline without local users, and comparison of results against a baseline.
+"""
+from collections import namedtuple
+import json
+import logging
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+USERNAME = 'dwight'
+PASSWORD = 'beets'
+GROUPS = [USERNAME, 'sales', 'safety', 'volunteer-sheriffs']
+
+# metrics where a higher value is an improvement, all others are better when lower
+HIGHER_IS_BETTER = {'rps'}
+
+
+class FakePam(object):
+    """
+    Stand-in for pam.pam that accepts the benchmark user's password after `latency` seconds,
+    which simulates the time taken by pam_unix to hash the password.
+    """
+    latency = 0
+
+    def __init__(self):
+        self.code = 0
+        self.reason = None
+
+    def authenticate(self, username, password, service='login', **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+
+        return username == USERNAME and password == PASSWORD
+
+
+_Passwd = namedtuple('_Passwd', ['pw_name', 'pw_gid'])
+_Group = namedtuple('_Group', ['gr_name', 'gr_gid'])
+
+
+def _getpwnam(username):
+    if username != USERNAME:
+        raise KeyError(username)
+    return _Passwd(username, 1000)
+
+
+def _getgrouplist(username, gid):
+    return [1000 + i for i in range(len(GROUPS))]
+
+
+def _getgrgid(gid):
+    return _Group(GROUPS[gid - 1000], gid)
+
+
+def install_fakes(pam_latency=0):
+    """
+    Replaces PAM and the NSS lookups used by beesly with in-memory stand-ins for the benchmark user.
+
+    Arguments
+    ----------
+    pam_latency : float
+      the number of seconds each PAM authentication takes
+    """
+    FakePam.latency = pam_latency
+
+    for patcher in [
+        mock.patch('beesly.pamauth.pam', FakePam),
+        mock.patch('beesly.utils.pwd.getpwnam', _getpwnam),
+        mock.patch('beesly.utils.os.getgrouplist', _getgrouplist),
+        mock.patch('beesly.utils.grp.getgrgid', _getgrgid),
+    ]:
+        patcher.start()
+
+
+def discard_logs():
+    """
+    Formats logs as they are by gunicorn, then discards them instead of writing them to the terminal.
+    """
+    from beesly._logging import APP_LOGGER, CustomLogFilter, KeyValueFormatter
+
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(KeyValueFormatter())
+    handler.addFilter(CustomLogFilter())
+
+    APP_LOGGER.handlers = [handler]
+    APP_LOGGER.setLevel(logging.INFO)
+    APP_LOGGER.propagate = False
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of each result from the baseline and returns a list of the
+    metrics that regressed by more than `threshold` percent.
+
+    Arguments
+    ----------
+    results : dict
+      the results of each benchmark, a dict of metric names and values
+
+    baseline : dict
+      the baseline results in the same format
+
+    threshold : float
+      the percentage a metric can regress by before it is reported
+    """
+    regressions = []
+
+    for (name, metrics) in sorted(results.items()):
+        for (metric, value) in sorted(metrics.items()):
+            previous = baseline.get(name, {}).get(metric)
+            if not previous or not isinstance(value, (int, float)):
+                continue
+
+            change = (value - previous) / previous * 100
+            regressed = -change > threshold if metric in HIGHER_IS_BETTER else change > threshold
+
+            print(f"{name + '.' + metric:<40} {previous:12.2f} {value:12.2f} {change:+8.1f}%{'  REGRESSION' if regressed else ''}",
+                  file=sys.stderr)
+
+            if regressed:
+                regressions.append(f"{name}.{metric}")
+
+    return regressions
+
+
+def write_results(results, output=None, baseline=None, threshold=10):
+    """
+    Writes the results as JSON to `output` or stdout, and compares them against the baseline
+    file if one is given. Returns the exit status, which is 1 if any metric regressed.
+    """
+    data = json.dumps(results, indent=2, sort_keys=True)
+
+    if output is None:
+        print(data)
+    else:
+        with open(output, 'w') as f:
+            f.write(data + '\n')
+
+    if baseline is None:
+        return 0
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), threshold)
+
+    return 1 if regressions else 0
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--output', help='file to write the JSON results to, defaults to stdout')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=10, help='percentage change reported as a regression')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of serve:app with a mix of /auth, /verify and /renew requests.
+beesly is started in a separate process with PAM and NSS replaced by in-memory
+stand-ins, so no local users are needed. The p50 and p99 latency and requests per
+second of each endpoint are written as JSON and can be compared against a previous run:
+
+    $ python benchmarks/load.py --duration 30 --output baseline.json
+    $ python benchmarks/load.py --duration 30 --baseline baseline.json
+
+The environment variables used to configure beesly can be set to benchmark other
+configurations, eg. JWT_ALGORITHM or RATELIMIT_STORAGE_URL.
+"""
+import argparse
+from http.client import HTTPConnection
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+
+from common import PASSWORD, USERNAME, add_output_arguments, discard_logs, install_fakes, write_results
+
+
+DEFAULT_ENVIRONMENT = {
+    'JWT_MASTER_KEY': 'benchmarks-master-key',
+    'RATELIMIT_ENABLED': 'False',
+}
+
+
+def serve(port, pam_latency, ready):
+    """
+    Runs serve:app in a threaded WSGI server, as `flask run` would.
+    """
+    from werkzeug.serving import make_server
+
+    for (name, value) in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+
+    install_fakes(pam_latency=pam_latency)
+
+    from serve import app
+
+    discard_logs()
+
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def percentile(latencies, percent):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+
+class Client(threading.Thread):
+    """
+    Sends requests over a persistent connection until `deadline`, choosing each endpoint
+    at random in proportion to its weight in the traffic mix.
+    """
+    def __init__(self, port, mix, deadline):
+        super(Client, self).__init__(daemon=True)
+
+        self.port = port
+        self.endpoints = list(mix)
+        self.weights = [mix[endpoint] for endpoint in self.endpoints]
+        self.deadline = deadline
+
+        self.latencies = {endpoint: [] for endpoint in self.endpoints}
+        self.errors = {endpoint: 0 for endpoint in self.endpoints}
+        self.token = None
+
+    def request(self, conn, path, body):
+        start = time.perf_counter()
+        conn.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        data = resp.read()
+
+        return resp.status, json.loads(data), time.perf_counter() - start
+
+    def run(self):
+        conn = HTTPConnection('127.0.0.1', self.port)
+
+        # every client authenticates once to get a JWT for /verify and /renew
+        _, body, _ = self.request(conn, '/auth', {'username': USERNAME, 'password': PASSWORD})
+        self.token = body['jwt']
+
+        while time.monotonic() < self.deadline:
+            endpoint = random.choices(self.endpoints, self.weights)[0]
+
+            if endpoint == 'auth':
+                body = {'username': USERNAME, 'password': PASSWORD}
+            elif endpoint == 'verify':
+                body = {'jwt': self.token}
+            else:
+                body = {'username': USERNAME, 'jwt': self.token}
+
+            try:
+                status, resp_body, latency = self.request(conn, f'/{endpoint}', body)
+            except (OSError, ValueError):
+                self.errors[endpoint] += 1
+                conn.close()
+                conn = HTTPConnection('127.0.0.1', self.port)
+                continue
+
+            if status != 200:
+                self.errors[endpoint] += 1
+                continue
+
+            self.latencies[endpoint].append(latency)
+
+            if endpoint == 'renew':
+                self.token = resp_body['jwt']
+
+        conn.close()
+
+
+def parse_mix(value):
+    mix = {}
+    for pair in value.split(','):
+        endpoint, _, weight = pair.partition('=')
+        if endpoint not in ['auth', 'verify', 'renew']:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{endpoint}'")
+        mix[endpoint] = float(weight)
+
+    return mix
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10, help='number of seconds to send requests for')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent connections')
+    parser.add_argument('--mix', type=parse_mix, default='auth=1,verify=8,renew=1', help='relative weight of each endpoint')
+    parser.add_argument('--pam-latency', type=float, default=5, help='milliseconds taken by each PAM authentication')
+    parser.add_argument('--port', type=int, default=8765)
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.port, args.pam_latency / 1000, ready), daemon=True)
+    server.start()
+
+    if not ready.wait(30):
+        server.terminate()
+        sys.exit("beesly failed to start")
+
+    try:
+        deadline = time.monotonic() + args.duration
+        start = time.monotonic()
+
+        clients = [Client(args.port, args.mix, deadline) for _ in range(args.concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        elapsed = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.join()
+
+    results = {}
+    for endpoint in args.mix:
+        results[endpoint] = summarize([latency for client in clients for latency in client.latencies[endpoint]],
+                                      sum(client.errors[endpoint] for client in clients), elapsed)
+
+    results['total'] = summarize([latency for client in clients for latencies in client.latencies.values() for latency in latencies],
+                                 sum(sum(client.errors.values()) for client in clients), elapsed)
+
+    sys.exit(write_results(results, args.output, args.baseline, args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 # gunicorn config file
 
+import gc
 import logging
 import logging.config
 import os
@@ -9,17 +10,25 @@ import sys
 app_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, app_path)
 
+from beesly._env import strtobool
 from beesly.version import __app__
 
 app_logger = f'{__app__}.logger'
 
+# logs are written to stdout from a background thread if LOG_ASYNC is enabled
+try:
+    log_async = strtobool(os.environ.get('LOG_ASYNC', 'False'))
+except ValueError:
+    log_async = False
+
+log_handler = 'queue' if log_async else 'console'
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': True,
     'formatters': {
         'key_value_format': {
-            'format': '{"timestamp":"%(asctime)s.%(msecs).03d","loglevel":"%(levelname)s","app":"%(app)s","pid":"%(process)d","message":"%(message)s"}',
-            'datefmt': '%Y-%m-%d %H:%M:%S'
+            '()': 'beesly._logging.KeyValueFormatter'
         },
     },
     'filters': {
@@ -34,6 +43,12 @@ LOGGING = {
             'formatter': 'key_value_format',
             'stream': 'ext://sys.stdout'
         },
+        'queue': {
+            'level': 'INFO',
+            '()': 'beesly._logging.QueueLogHandler',
+            'formatter': 'key_value_format',
+            'stream': 'ext://sys.stdout'
+        },
         'null': {
             'class': 'logging.NullHandler'
         }
@@ -43,13 +58,13 @@ LOGGING = {
             'handlers': ['null']
         },
         app_logger: {
-            'handlers': ['console'],
+            'handlers': [log_handler],
             'level': 'INFO',
             'propagate': False,
             'filters': ['customFilter']
         },
         'gunicorn.error': {
-            'handlers': ['console'],
+            'handlers': [log_handler],
             'level': 'INFO',
             'propagate': False,
             'filters': ['customFilter']
@@ -64,4 +79,46 @@ def on_starting(server):
     # remove gunicorn's stream handler to prevent duplicate logs
     gunicornLogger = logging.getLogger('gunicorn.error')
     gunicornLogger.handlers.pop(1)
+
+    # remove Prometheus metrics written by workers of a previous run
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir and os.path.isdir(multiproc_dir):
+        for filename in os.listdir(multiproc_dir):
+            if filename.endswith('.db'):
+                os.remove(os.path.join(multiproc_dir, filename))
+    return
+
+
+def pre_fork(server, worker):
+
+    # move objects created by the master, including the application loaded by --preload, out of reach of
+    # the garbage collector so that collections in workers don't write to and unshare the pages they're on
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    return
+
+
+def child_exit(server, worker):
+
+    # remove the live gauges of the exited worker from Prometheus metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    return
+
+
+def post_worker_init(worker):
+
+    # profile the worker on demand when it receives SIGUSR2, gunicorn resets signal handlers in each worker
+    from beesly.views import profiler
+    profiler.install_signal_handler()
+    return
+
+
+def worker_exit(server, worker):
+
+    # send any metrics buffered by the worker before it exits
+    from beesly.views import statsd
+    statsd.flush()
     return